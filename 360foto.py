@@ -1,36 +1,21 @@
-
-import os
-    Thread(target=process_video).start()
+import startup_profile  # 起動時間の計測（最初に import する）
 import os
 import platform
-import subprocess
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from threading import Thread
-import psutil
 from tkinter import ttk
-import cv2
 import time
 import queue
-from datetime import datetime, timedelta
-import shutil
-import numpy as np
+import foto360_core as core
+from job_scheduler import default_cpu_workers
 
 # If running in a headless Unix-like environment (not Windows), exit with an informative message
 if platform.system() != 'Windows' and os.environ.get('DISPLAY','') == '' and os.environ.get('CI','') == '':
-    print('Warning: No DISPLAY found. This script opens a Tkinter GUI and requires a display.\nIf running inside Docker, run the container with X11 forwarding (e.g. -e DISPLAY -v /tmp/.X11-unix:/tmp/.X11-unix) or run on host.')
+    print('Warning: No DISPLAY found. This script opens a Tkinter GUI and requires a display.\nIf running inside Docker, run the container with X11 forwarding (e.g. -e DISPLAY -v /tmp/.X11-unix:/tmp/.X11-unix) or run on host.\nFor headless batch conversion use the CLI instead: python foto360_cli.py convert --help')
     exit(1)
 
-def ensure_ffmpeg_on_path():
-    """Ensure ffmpeg is discoverable on PATH (especially for Windows user install)."""
-    if shutil.which('ffmpeg') is not None:
-        return
-    if platform.system() == 'Windows':
-        default_bin = os.path.join(os.environ.get('LOCALAPPDATA', ''), 'ffmpeg', 'bin')
-        if default_bin and os.path.isdir(default_bin):
-            os.environ['PATH'] = default_bin + os.pathsep + os.environ.get('PATH', '')
-
-ensure_ffmpeg_on_path()
+core.ensure_ffmpeg_on_path()
 
 def select_input_files():
     files_selected = filedialog.askopenfilenames(filetypes=[("ビデオファイル", "*.mp4;*.avi;*.mov")])
@@ -41,277 +26,73 @@ def select_output_folder():
     folder_selected = filedialog.askdirectory()
     output_folder_var.set(folder_selected)
 
-def kill_ffmpeg_process():
-    for proc in psutil.process_iter(['pid', 'name']):
-        if proc.info['name'] == 'ffmpeg.exe':
-            try:
-                proc.kill()
-            except psutil.NoSuchProcess:
-                pass
-
 def update_total_frames():
-    total_frames = 0
-    frame_rate = frame_rate_var.get()
-    num_directions = 1 if direction_var.get() == "1" else (12 if direction_var.get() == "12" else (8 if direction_var.get() == "8" else (8 if direction_var.get() == "8_20" else (6 if direction_var.get() == "6_h3_45" else (9 if direction_var.get() == "9_h3_45x2" else (5 if direction_var.get() == "5_down" else (4 if direction_var.get() == "4_h1_45" else 2)))))))
-
-    for file in input_files_var.get().split(';'):
-        if not file:
-            continue
-        cap = cv2.VideoCapture(file)
-        if cap.isOpened():
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            if fps <= 0:
-                fps = 30
-            duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / fps
-            frames_for_file = int(duration / frame_rate * num_directions)
-            total_frames += frames_for_file
-            cap.release()
-
-    total_frames_var.set(total_frames)
+    # 動画情報の取得は時間がかかることがあるので、画面を止めないようバックグラウンドで行う
+    global estimate_generation
+    estimate_generation += 1
+    generation = estimate_generation
+    input_paths = input_files_var.get().split(';')
+    interval = frame_rate_var.get() or core.AUTO_INTERVAL
+    preset = direction_var.get()
+
+    def worker():
+        total_frames = core.estimate_total_frames(input_paths, interval, preset)
+        # 計算中に選択が変わっていたら古い結果は捨てる
+        if generation == estimate_generation:
+            app.after(0, lambda: total_frames_var.set(total_frames))
+
+    Thread(target=worker, daemon=True).start()
+
+def get_size():
+    # 「auto」以外は画素数として扱う（数値でなければ ValueError でエラー表示）
+    size = size_var.get().strip()
+    if size == core.AUTO_SIZE:
+        return size
+    try:
+        return int(size)
+    except ValueError:
+        raise ValueError(f"画素数には数値か {core.AUTO_SIZE} を指定してください: {size}")
 
 def process_video():
     global processing, start_time
     processing = True
     status_var.set("処理中...")
-    input_paths = [p for p in input_files_var.get().split(';') if p]
-    output_path = output_folder_var.get()
-    size = 1600  # 画素数を1600x1600に固定
-    fmt = format_var.get()
-    total_frames = total_frames_var.get()
-    processed_frames = 0
     start_time = time.time()
 
-    if not input_paths or not output_path:
-        messagebox.showerror("エラー", "入力ファイルと保存先フォルダを指定してください。")
-        status_var.set("待機中")
-        return
-
-    # ffmpeg の存在チェック（見つからない場合は案内して終了）
-    if shutil.which('ffmpeg') is None:
-        messagebox.showerror(
-            "エラー",
-            "ffmpeg が見つかりません。\nインストール済みであれば、環境変数 PATH に C:/Users/<ユーザー名>/AppData/Local/ffmpeg/bin を追加してから再実行してください。"
+    try:
+        results = core.process_video(
+            input_files_var.get().split(';'),
+            output_folder_var.get(),
+            preset=direction_var.get(),
+            interval=frame_rate_var.get() or core.AUTO_INTERVAL,  # 0 は自動
+            size=get_size(),
+            fov=fov_var.get(),
+            fmt=format_var.get(),
+            xmp=xmp_var.get(),
+            engine=engine_var.get(),
+            split_decode=split_decode_var.get(),
+            cpu_workers=cpu_workers_var.get(),
+            gpu_workers=gpu_workers_var.get(),
+            resume=resume_var.get(),
+            quality=quality_var.get(),
+            report=lambda kind, value: update_queue.put((kind, value)),
+            should_stop=lambda: not processing,
         )
-        status_var.set("待機中")
-        return
 
-    try:
-        os.makedirs(output_path, exist_ok=True)
-
-        transforms = get_transforms()
-
-        for input_path in input_paths:
-            if not processing:
-                break
-
-            fps = 1 / frame_rate_var.get()
-
-            for index, transform in enumerate(transforms):
-                if not processing:
-                    break
-
-                base_name = os.path.basename(input_path)
-                name_part = base_name[-7:-4]
-                output_file_path = os.path.join(output_path, f'{name_part}_ot_{index}_%04d.{fmt}')
-
-                v360_options = ':'.join([
-                    'input=e', 'output=rectilinear',
-                    'h_fov=90', 'v_fov=90',
-                    f'w={size}', f'h={size}',
-                    f'yaw={transform[0]}',
-                    f'pitch={transform[1]}',
-                    f'roll={transform[2]}'
-                ])
-
-                # GPU acceleration with CUDA (適応的に使用)
-                # 大きな解像度の動画の場合、CPUデコード→GPU処理を使用
-                cap = cv2.VideoCapture(input_path)
-                video_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                cap.release()
-                
-                if video_width > 4096:
-                    # 大きな解像度：CPUデコード、GPUエンコード（利用可能な場合）
-                    command = f'ffmpeg -i "{input_path}" -vf v360={v360_options} -c:v mjpeg -q 1 -r {fps} "{output_file_path}"'
-                else:
-                    # 小さな解像度：CUDAアクセラレーション
-                    command = f'ffmpeg -hwaccel cuda -hwaccel_output_format cuda -i "{input_path}" -vf v360={v360_options},hwdownload,format=nv12 -q 1 -r {fps} "{output_file_path}"'
-
-                process = subprocess.Popen(command, shell=True)
-
-                while process.poll() is None:
-                    time.sleep(0.1)
-                    output_files = [f for f in os.listdir(output_path) if f.endswith(f'.{fmt}')]
-                    processed_frames = len(output_files)
-                    if total_frames > 0:
-                        progress = (processed_frames / total_frames) * 100
-                    else:
-                        progress = 0
-                    update_queue.put(('progress', progress))
-                    update_queue.put(('frames', processed_frames))
-
-                    elapsed_time = time.time() - start_time
-                    if processed_frames > 0 and total_frames > 0:
-                        estimated_total_time = (elapsed_time / processed_frames) * total_frames
-                        estimated_remaining_time = estimated_total_time - elapsed_time
-                        estimated_completion_time = datetime.now() + timedelta(seconds=estimated_remaining_time)
-                        update_queue.put(('estimated_time', estimated_completion_time.strftime("%Y-%m-%d %H:%M:%S")))
-                        update_queue.put(('estimated_work_time', time.strftime("%H:%M:%S", time.gmtime(estimated_total_time))))
-                
-                process.wait()
-                
-                # Optional XMP write if enabled
-                if xmp_var.get():
-                    try:
-                        write_xmp(output_file_path, transform[0], transform[1], transform[2])
-                    except Exception:
-                        pass
-
-                if not processing:
-                    kill_ffmpeg_process()
-                    break
-        
-        if processing:
+        failed = [result for result in results if not result['ok']]
+        if processing and failed:
+            names = sorted({os.path.basename(result['job']['input_path']) for result in failed})
+            messagebox.showerror("エラー", f"{len(failed)} 件のジョブが失敗しました:\n" + "\n".join(names))
+        elif processing:
             messagebox.showinfo("成功", "ビデオ処理が完了しました。")
+    except (ValueError, RuntimeError) as e:
+        messagebox.showerror("エラー", str(e))
     except Exception as e:
         messagebox.showerror("エラー", f"ビデオ処理中にエラーが発生しました: {e}")
     finally:
         processing = False
         status_var.set("待機中")
 
-def get_transforms():
-    if direction_var.get() == "1":  # 正面のみ
-        return [(0, 0, 0)]
-    elif direction_var.get() == "2":  # 2方向（正-45）
-        return [
-            (0, 0, 0),
-            (0, -45, 0)
-        ]
-    elif direction_var.get() == "4_h1_45":  # 4方向（H1-45）
-        return [
-            (0, 0, 0),
-            (-60, -45, 0),
-            (60, -45, 0),
-            (180, -45, 0)
-        ]
-    elif direction_var.get() == "8":  # 下8方向（45度）
-        return [
-            (-90, 0, 0),
-            (0, 0, 0),
-            (90, 0, 0),
-            (180, 0, 0),
-            (-45, -45, 0),
-            (45, -45, 0),
-            (135, -45, 0),
-            (-135, -45, 0)
-        ]
-    elif direction_var.get() == "12":  # 12方向
-        return [
-            (-90, 0, 0),
-            (0, 0, 0),
-            (90, 0, 0),
-            (180, 0, 0),
-            (-135, 45, 0),
-            (-45, 45, 0),
-            (45, 45, 0),
-            (135, 45, 0),
-            (-135, -45, 0),
-            (-45, -45, 0),
-            (45, -45, 0),
-            (135, -45, 0)
-        ]
-    elif direction_var.get() == "8_20": # 8方向（ななめ20度）
-        return [
-            (0, -20, 0),
-            (-90, -20, 0),
-            (90, -20, 0),
-            (180, -20, 0),
-            (0, 20, 0),
-            (-90, 20, 0),
-            (90, 20, 0),
-            (180, 20, 0)
-        ]
-    elif direction_var.get() == "6_h3_45": # 6方向（H3-45）
-        return [
-            (0, 0, 0),
-            (-120, 0, 0),
-            (120, 0, 0),
-            (-60, -45, 0),
-            (60, -45, 0),
-            (180, -45, 0)
-        ]
-    elif direction_var.get() == "9_h3_45x2": # 9方向（H3-45×2）
-        return [
-            (0, 0, 0),
-            (-120, 0, 0),
-            (120, 0, 0),
-            (-60, -45, 0),
-            (60, -45, 0),
-            (180, -45, 0),
-            (-60, 45, 0),
-            (60, 45, 0),
-            (180, 45, 0)
-        ]
-    elif direction_var.get() == "5_down": # 下5方向（H4+下）
-        return [
-            (0, -90, 0),
-            (-90, 0, 0),
-            (0, 0, 0),
-            (90, 0, 0),
-            (180, 0, 0)
-        ]
-    else:
-        return []
-
-def get_rotation_matrix(yaw_deg, pitch_deg, roll_deg):
-    # Convert to radians
-    yaw = np.radians(yaw_deg)
-    pitch = np.radians(pitch_deg)
-    roll = np.radians(roll_deg)
-
-    # Rotation matrices (assumptions may need adjustment depending on v360 conventions)
-    Ry = np.array([
-        [np.cos(yaw), 0, np.sin(yaw)],
-        [0, 1, 0],
-        [-np.sin(yaw), 0, np.cos(yaw)]
-    ])
-
-    Rx = np.array([
-        [1, 0, 0],
-        [0, np.cos(pitch), -np.sin(pitch)],
-        [0, np.sin(pitch), np.cos(pitch)]
-    ])
-
-    Rz = np.array([
-        [np.cos(roll), -np.sin(roll), 0],
-        [np.sin(roll), np.cos(roll), 0],
-        [0, 0, 1]
-    ])
-
-    R = Ry @ Rx @ Rz
-    return R
-
-def write_xmp(output_path, yaw, pitch, roll):
-    try:
-        R = get_rotation_matrix(yaw, pitch, roll)
-        R_flat = R.flatten()
-        rotation_str = " ".join([f"{x:.9f}" for x in R_flat])
-
-        xmp_content = f"""<x:xmpmeta xmlns:x="adobe:ns:meta/">
- <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
-  <rdf:Description rdf:about=""
-    xmlns:xcr="http://www.capturingreality.com/ns/xcr/1.1#">
-   <xcr:Position>0 0 0</xcr:Position>
-   <xcr:Rotation>{rotation_str}</xcr:Rotation>
-  </rdf:Description>
- </rdf:RDF>
-</x:xmpmeta>"""
-
-        xmp_path = os.path.splitext(output_path)[0] + ".xmp"
-        with open(xmp_path, "w", encoding="utf-8") as f:
-            f.write(xmp_content)
-    except Exception as e:
-        print(f"Error writing XMP: {e}")
-
 def start_processing():
     global update_queue
     update_queue = queue.Queue()
@@ -332,6 +113,8 @@ def update_gui():
                     estimated_time_var.set(value)
                 elif update_type == 'estimated_work_time':
                     estimated_work_time_var.set(value)
+                elif update_type == 'total':
+                    total_frames_var.set(value)
         except queue.Empty:
             pass
         
@@ -342,9 +125,8 @@ def update_gui():
 
 def cancel_processing():
     global processing
+    # 変換側がこの実行で起動した ffmpeg だけを止める（ほかのアプリの ffmpeg には触れない）
     processing = False
-    kill_ffmpeg_process()
-    subprocess.call("taskkill /f /im cmd.exe", shell=True)
     messagebox.showinfo("キャンセル", "ビデオ処理がキャンセルされました。")
     status_var.set("待機中")
 
@@ -354,19 +136,27 @@ app.title("全天球画像変換")
 input_files_var = tk.StringVar()
 output_folder_var = tk.StringVar()
 frame_rate_var = tk.DoubleVar(value=1.5)
-size_var = tk.IntVar(value=1600)
+size_var = tk.StringVar(value="1600")
+fov_var = tk.DoubleVar(value=90)
 format_var = tk.StringVar(value="jpg")
 xmp_var = tk.BooleanVar(value=False)
+split_decode_var = tk.BooleanVar(value=True)
+engine_var = tk.StringVar(value="ffmpeg")
+cpu_workers_var = tk.IntVar(value=default_cpu_workers())
+gpu_workers_var = tk.IntVar(value=1)
+resume_var = tk.BooleanVar(value=True)
+quality_var = tk.IntVar(value=95)
 status_var = tk.StringVar(value="待機中")
 total_frames_var = tk.IntVar(value=0)
 processed_frames_var = tk.IntVar(value=0)
 progress_var = tk.DoubleVar(value=0)
 elapsed_time_var = tk.StringVar(value="00:00:00")
 estimated_time_var = tk.StringVar(value="")
-direction_var = tk.StringVar(value="6_h3_45")  # デフォルトを6方向（H3-45）に設定
+direction_var = tk.StringVar(value=core.DEFAULT_PRESET)  # デフォルトを6方向（H3-45）に設定
 estimated_work_time_var = tk.StringVar(value="00:00:00")
 processing = False
 update_queue = None
+estimate_generation = 0
 
 tk.Label(app, text="入力ファイル:").grid(row=0, column=0, padx=5, pady=5, sticky="e")
 tk.Entry(app, textvariable=input_files_var, width=50).grid(row=0, column=1, columnspan=3, padx=5, pady=5, sticky="ew")
@@ -381,24 +171,36 @@ tk.Radiobutton(app, text="1秒", variable=frame_rate_var, value=1.0, command=upd
 tk.Radiobutton(app, text="1.5秒", variable=frame_rate_var, value=1.5, command=update_total_frames).grid(row=2, column=2, padx=5, pady=5, sticky="w")
 tk.Radiobutton(app, text="2秒", variable=frame_rate_var, value=2.0, command=update_total_frames).grid(row=2, column=3, padx=5, pady=5, sticky="w")
 tk.Radiobutton(app, text="3秒", variable=frame_rate_var, value=3.0, command=update_total_frames).grid(row=2, column=4, padx=5, pady=5, sticky="w")
+tk.Radiobutton(app, text="自動（鮮明さ・動き）", variable=frame_rate_var, value=0.0, command=update_total_frames).grid(row=2, column=5, padx=5, pady=5, sticky="w")
 
 tk.Label(app, text="フォーマット:").grid(row=3, column=0, padx=5, pady=5, sticky="e")
 tk.Radiobutton(app, text="JPG", variable=format_var, value="jpg").grid(row=3, column=1, padx=5, pady=5, sticky="w")
 tk.Radiobutton(app, text="PNG", variable=format_var, value="png").grid(row=3, column=2, padx=5, pady=5, sticky="w")
-tk.Checkbutton(app, text="XMPデータを作成", variable=xmp_var).grid(row=3, column=3, padx=5, pady=5, sticky="w")
+tk.Radiobutton(app, text="WebP", variable=format_var, value="webp").grid(row=3, column=3, padx=5, pady=5, sticky="w")
+tk.Checkbutton(app, text="XMPデータを作成", variable=xmp_var).grid(row=3, column=4, padx=5, pady=5, sticky="w")
+tk.Checkbutton(app, text="一括デコード（全方向を1回で処理）", variable=split_decode_var).grid(row=4, column=2, columnspan=2, padx=5, pady=5, sticky="w")
+tk.Label(app, text="変換エンジン:").grid(row=5, column=2, padx=5, pady=5, sticky="e")
+tk.Radiobutton(app, text="ffmpeg (v360)", variable=engine_var, value="ffmpeg").grid(row=5, column=3, padx=5, pady=5, sticky="w")
+tk.Radiobutton(app, text="OpenCV（CPU）", variable=engine_var, value="opencv").grid(row=6, column=3, padx=5, pady=5, sticky="w")
+tk.Label(app, text="CPU並列数:").grid(row=7, column=2, padx=5, pady=5, sticky="e")
+tk.Spinbox(app, from_=1, to=os.cpu_count() or 1, textvariable=cpu_workers_var, width=5).grid(row=7, column=3, padx=5, pady=5, sticky="w")
+tk.Label(app, text="GPU並列数:").grid(row=8, column=2, padx=5, pady=5, sticky="e")
+tk.Spinbox(app, from_=1, to=8, textvariable=gpu_workers_var, width=5).grid(row=8, column=3, padx=5, pady=5, sticky="w")
+tk.Checkbutton(app, text="中断した処理を再開（済んだ画像は作り直さない）", variable=resume_var).grid(row=9, column=2, columnspan=2, padx=5, pady=5, sticky="w")
+tk.Label(app, text="画質（JPG/WebP）:").grid(row=10, column=2, padx=5, pady=5, sticky="e")
+tk.Spinbox(app, from_=50, to=100, textvariable=quality_var, width=5).grid(row=10, column=3, padx=5, pady=5, sticky="w")
+tk.Label(app, text="画素数:").grid(row=11, column=2, padx=5, pady=5, sticky="e")
+ttk.Combobox(app, textvariable=size_var, values=[core.AUTO_SIZE, "800", "1200", "1600", "2048", "3072"], width=7).grid(row=11, column=3, padx=5, pady=5, sticky="w")
+tk.Label(app, text="視野角（度）:").grid(row=12, column=2, padx=5, pady=5, sticky="e")
+tk.Spinbox(app, from_=30, to=150, increment=5, textvariable=fov_var, width=5).grid(row=12, column=3, padx=5, pady=5, sticky="w")
 
 # 方向選択ラジオボタン（更新）
 tk.Label(app, text="出力方向:").grid(row=4, column=0, padx=5, pady=5, sticky="e")
-tk.Radiobutton(app, text="正面のみ", variable=direction_var, value="1", command=update_total_frames).grid(row=4, column=1, padx=5, pady=5, sticky="w")
-tk.Radiobutton(app, text="2方向（正-45）", variable=direction_var, value="2", command=update_total_frames).grid(row=5, column=1, padx=5, pady=5, sticky="w")
-tk.Radiobutton(app, text="4方向（H1-45）", variable=direction_var, value="4_h1_45", command=update_total_frames).grid(row=6, column=1, padx=5, pady=5, sticky="w")
-# 前のコードの続き
-tk.Radiobutton(app, text="6方向（H3-45度）", variable=direction_var, value="6_h3_45", command=update_total_frames).grid(row=7, column=1, padx=5, pady=5, sticky="w")
-tk.Radiobutton(app, text="9方向（H3-45×2）", variable=direction_var, value="9_h3_45x2", command=update_total_frames).grid(row=8, column=1, padx=5, pady=5, sticky="w")
-tk.Radiobutton(app, text="下5方向（H4+下）", variable=direction_var, value="5_down", command=update_total_frames).grid(row=9, column=1, padx=5, pady=5, sticky="w")
-tk.Radiobutton(app, text="8方向（ななめ20度）", variable=direction_var, value="8_20", command=update_total_frames).grid(row=10, column=1, padx=5, pady=5, sticky="w")
-tk.Radiobutton(app, text="下8方向（H4-45度）", variable=direction_var, value="8", command=update_total_frames).grid(row=11, column=1, padx=5, pady=5, sticky="w")
-tk.Radiobutton(app, text="全12方向（H4+斜め上下45度）", variable=direction_var, value="12", command=update_total_frames).grid(row=12, column=1, padx=5, pady=5, sticky="w")
+# 利用者のプリセットで数が増えても下の行と重ならないよう、枠にまとめて並べる
+direction_frame = tk.Frame(app)
+direction_frame.grid(row=4, column=1, rowspan=9, padx=5, pady=5, sticky="nw")
+for preset, (label, _) in core.PRESETS.items():
+    tk.Radiobutton(direction_frame, text=label, variable=direction_var, value=preset, command=update_total_frames).pack(anchor="w", pady=5)
 
 tk.Label(app, text="フレーム数:").grid(row=13, column=0, padx=5, pady=5, sticky="e")
 tk.Label(app, textvariable=total_frames_var).grid(row=13, column=1, padx=5, pady=5, sticky="w")
@@ -429,4 +231,8 @@ app.columnconfigure(1, weight=1)
 app.columnconfigure(2, weight=1)
 app.columnconfigure(3, weight=1)
 
+# 起動時間を報告し（--startup-report のとき）、ウィンドウを出した後で変換に使うモジュールを読み込んでおく
+startup_profile.on_first_window(app, '360foto')
+app.after(500, lambda: startup_profile.preload(['numpy', 'cv2']))
+
 app.mainloop()
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""鮮明さと動きから書き出すフレームを選ぶ（固定間隔の代わりの自動モード）
+
+再投影の前に、縮小したグレースケール画像でフレームを採点する。
+- 鮮明さ: ラプラシアンの分散（ブレているほど小さい）
+- 動き  : 直前に調べたフレームとの平均輝度差（撮影位置・向きの変化の目安）
+動きの累計が一定量に達するか最大間隔に達するまでを1区間とし、区間内でもっとも鮮明な
+フレームを選ぶ。止まっている間は枚数が減り、速く動く間は最小間隔まで詰まる。
+同じ動画・同じ設定なら常に同じ時刻を返す（乱数や処理時間に依存しない）。
+"""
+import os
+import shutil
+import subprocess
+
+import numpy as np
+
+from proc_group import popen, tail_lines
+from sampling import AUTO_MAX_INTERVAL, AUTO_MIN_INTERVAL, AUTO_TARGET_INTERVAL
+
+ANALYSIS_WIDTH = 320  # 採点用に縮小する幅
+ANALYSIS_FPS = 5.0    # 1秒あたりに採点するフレーム数
+BATCH_SIZE = 64
+MOTION_BLOCK = 8       # 動きを比べるときのブロックの大きさ（画素）
+
+_score_cache = {}
+
+
+def _iter_gray_ffmpeg(input_path, width, height, fps, processes=None):
+    """ffmpeg で縮小・グレースケール化したフレームを (時刻, 画像) で返す（processes は proc_group.ProcessGroup）
+
+    ffmpeg が失敗したら（キャンセルで止めた場合を除き）標準エラーの末尾を付けて RuntimeError にする。
+    """
+    command = [
+        'ffmpeg', '-v', 'error', '-nostdin', '-i', input_path,
+        '-vf', f'fps={fps},scale={width}:{height}:flags=area,format=gray',
+        '-f', 'rawvideo', 'pipe:1',
+    ]
+    frame_bytes = width * height
+    process = popen(command, processes, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=frame_bytes)
+    stderr_reader, stderr_tail = tail_lines(process.stderr)
+    finished = False
+    try:
+        index = 0
+        while True:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            yield index / fps, np.frombuffer(data, np.uint8).reshape(height, width)
+            index += 1
+        finished = True
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+        stderr_reader.join(5)
+        if processes is not None:
+            processes.release(process)
+    cancelled = processes is not None and processes.cancelled
+    if finished and returncode != 0 and not cancelled:
+        error = '\n'.join(stderr_tail).strip()
+        raise RuntimeError(f"採点用のデコードに失敗しました（終了コード {returncode}）: {input_path}: {error}")
+
+
+def _iter_gray_opencv(input_path, width, height, fps):
+    import cv2
+
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"動画を開けません: {input_path}")
+    try:
+        video_fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        frame_index = 0
+        index = 0
+        while cap.grab():
+            t = frame_index / video_fps
+            frame_index += 1
+            if t + 1e-6 < index / fps:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok:
+                break
+            small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            yield index / fps, cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            index += 1
+    finally:
+        cap.release()
+
+
+def _score_batch(frames, previous):
+    """フレームの束（B, H, W）の鮮明さと、直前フレームとの動きをまとめて計算する"""
+    # 正距円筒の上下は引き伸ばされていて当てにならないので、中央の帯だけを見る
+    height = frames.shape[1]
+    band = frames[:, height // 4:height - height // 4].astype(np.float32)
+    laplacian = (4 * band[:, 1:-1, 1:-1] - band[:, :-2, 1:-1] - band[:, 2:, 1:-1]
+                 - band[:, 1:-1, :-2] - band[:, 1:-1, 2:])
+    sharpness = laplacian.var(axis=(1, 2))
+
+    # 動きはブロック平均で比べる（ピントのぼけによる細部の変化を動きと数えないため）
+    b, h, w = band.shape
+    h, w = h // MOTION_BLOCK * MOTION_BLOCK, w // MOTION_BLOCK * MOTION_BLOCK
+    coarse = band[:, :h, :w].reshape(b, h // MOTION_BLOCK, MOTION_BLOCK, w // MOTION_BLOCK, MOTION_BLOCK).mean(axis=(2, 4))
+    if previous is None:
+        previous = coarse[:1]
+    else:
+        previous = previous[None]
+    shifted = np.concatenate([previous, coarse[:-1]])
+    motion = np.abs(coarse - shifted).mean(axis=(1, 2)) / 255.0
+    return sharpness, motion, coarse[-1]
+
+
+def score_frames(input_path, info=None, width=ANALYSIS_WIDTH, fps=ANALYSIS_FPS, processes=None):
+    """(時刻, 鮮明さ, 動き) の配列を返す。結果は (パス, 更新時刻, サイズ) ごとにメモリに残す"""
+    st = os.stat(input_path)
+    key = (os.path.abspath(input_path), st.st_mtime_ns, st.st_size, width, fps)
+    if key in _score_cache:
+        return _score_cache[key]
+
+    if info and info.get('width') and info.get('height'):
+        height = max(2, int(round(width * info['height'] / info['width'] / 2)) * 2)
+    else:
+        height = width // 2
+    if shutil.which('ffmpeg') is not None:
+        frames = _iter_gray_ffmpeg(input_path, width, height, fps, processes)
+    else:
+        frames = _iter_gray_opencv(input_path, width, height, fps)
+
+    times, sharpness, motion = [], [], []
+    previous = None
+    batch = []
+    for t, frame in frames:
+        times.append(t)
+        batch.append(frame)
+        if len(batch) == BATCH_SIZE:
+            s, m, previous = _score_batch(np.stack(batch), previous)
+            sharpness.append(s)
+            motion.append(m)
+            batch = []
+    if batch:
+        s, m, previous = _score_batch(np.stack(batch), previous)
+        sharpness.append(s)
+        motion.append(m)
+
+    if not times:
+        # 1枚も読めない動画を「書き出すフレームなし」として成功させない
+        raise RuntimeError(f"採点用のフレームを1枚も読み込めませんでした: {input_path}")
+    result = (np.array(times), np.concatenate(sharpness), np.concatenate(motion))
+    _score_cache[key] = result
+    return result
+
+
+def select_keyframes(times, sharpness, motion, target_interval=AUTO_TARGET_INTERVAL,
+                     min_interval=AUTO_MIN_INTERVAL, max_interval=AUTO_MAX_INTERVAL):
+    """採点結果から書き出すフレームのインデックスを選ぶ
+
+    動きの量は動画全体の平均から「target_interval 秒ぶん」を1区間の目安にし、
+    区間の後半でもっとも鮮明なフレームを選ぶ。
+    """
+    count = len(times)
+    if count == 0:
+        return []
+    cumulative = np.cumsum(motion)
+    duration = times[-1] - times[0]
+    budget = cumulative[-1] * target_interval / duration if duration > 0 else 0.0
+    if budget <= 0:
+        budget = np.inf
+
+    picks = []
+    last = None
+    while True:
+        if last is None:
+            lo, base, end_time = 0, cumulative[0], times[0] + max_interval
+        else:
+            lo = int(np.searchsorted(times, times[last] + min_interval - 1e-9))
+            base, end_time = cumulative[last], times[last] + max_interval
+        if lo >= count:
+            break
+        hi = max(int(np.searchsorted(times, end_time + 1e-9, side='right')), lo + 1)
+        reached = np.nonzero(cumulative[lo:hi] - base >= budget)[0]
+        if reached.size:
+            hi = lo + int(reached[0]) + 1
+        # 区間の後半から選ぶ（前の1枚の直後ばかりが選ばれて間隔が詰まらないように）
+        start_time = times[0] if last is None else times[last]
+        lo = min(max(lo, int(np.searchsorted(times, (start_time + times[hi - 1]) / 2 - 1e-9))), hi - 1)
+        # 同点なら早いほう（argmax は最初の最大値を返す）
+        last = lo + int(np.argmax(sharpness[lo:hi]))
+        picks.append(last)
+    return picks
+
+
+def adaptive_timestamps(input_path, info=None, target_interval=AUTO_TARGET_INTERVAL,
+                        min_interval=AUTO_MIN_INTERVAL, max_interval=AUTO_MAX_INTERVAL, processes=None):
+    """自動モードで書き出す時刻（秒）の一覧"""
+    times, sharpness, motion = score_frames(input_path, info, processes=processes)
+    picks = select_keyframes(times, sharpness, motion, target_interval, min_interval, max_interval)
+    return [round(float(times[k]), 6) for k in picks]
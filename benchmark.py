@@ -0,0 +1,200 @@
+"""変換パイプラインのベンチマーク（GPU や実写の動画がなくても測れる）
+
+正距円筒のテスト動画をその場で作り（ffmpeg の testsrc2、なければ NumPy で描画して
+OpenCV で書き出す）、プリセット・エンジン・書き出し間隔の組み合わせごとに変換して
+フレーム/秒、出力1枚あたりの CPU 秒、ピークメモリ（RSS）、書き出したバイト数を測る。
+結果は JSON に保存し、版やマシンをまたいで比べられるようにする。
+"""
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from threading import Event, Thread
+
+import psutil
+
+import foto360_core as core
+
+BENCHMARK_VERSION = 1
+
+
+def synthesize_video(path, width=3840, height=1920, seconds=10, fps=30):
+    """テスト用の正距円筒動画を作り、実際に作ったファイルのパスを返す"""
+    if shutil.which('ffmpeg') is not None:
+        path = os.path.splitext(path)[0] + '.mp4'
+        command = [
+            'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi',
+            '-i', f'testsrc2=size={width}x{height}:rate={fps}',
+            '-t', str(seconds), '-c:v', 'libx264', '-preset', 'veryfast',
+            '-pix_fmt', 'yuv420p', '-g', str(fps), path,
+        ]
+        subprocess.run(command, check=True)
+        return path
+
+    import cv2
+    import numpy as np
+
+    path = os.path.splitext(path)[0] + '.avi'
+    # 経緯度の格子と横に流れる縞（再投影とエンコードに実写程度の負荷がかかるように細かい模様にする）
+    ys, xs = np.mgrid[0:height, 0:width]
+    grid = (((xs // 32) + (ys // 32)) % 2 * 80).astype(np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    try:
+        for i in range(int(seconds * fps)):
+            stripes = ((np.sin((xs + i * 16) / 24.0) + 1) * 80).astype(np.uint8)
+            frame = np.dstack([grid + stripes // 2, stripes, (ys * 255 // height).astype(np.uint8)])
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+class _PeakRSS:
+    """自プロセスと子プロセス（ffmpeg）の RSS 合計の最大値を定期的に測る"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = Event()
+        self.thread = Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, total)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self._sample()
+
+
+def _cpu_seconds():
+    """自プロセスと終了済みの子プロセスの CPU 時間（user + system）"""
+    times = psutil.Process().cpu_times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def _output_stats(path):
+    files = 0
+    size = 0
+    for entry in os.scandir(path):
+        if entry.is_file() and not entry.name.endswith('.json'):
+            files += 1
+            size += entry.stat().st_size
+    return files, size
+
+
+def run_case(input_path, output_path, preset, engine, interval, size, fmt):
+    """1つの組み合わせを変換して測定結果の dict を返す"""
+    shutil.rmtree(output_path, ignore_errors=True)
+    # 自動間隔の採点結果は前の組み合わせから持ち越さない（採点の時間も測りたいため）
+    if 'adaptive_sampling' in sys.modules:
+        sys.modules['adaptive_sampling']._score_cache.clear()
+    cpu_start = _cpu_seconds()
+    start = time.perf_counter()
+    with _PeakRSS() as rss:
+        results = core.process_video(
+            [input_path], output_path, preset=preset, interval=interval, size=size, fmt=fmt,
+            engine=engine, resume=False)
+    wall = time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu_start
+    frames, written = _output_stats(output_path)
+    return {
+        'preset': preset,
+        'engine': engine,
+        'interval': interval,
+        'size': size,
+        'format': fmt,
+        'ok': all(result['ok'] for result in results),
+        'frames': frames,
+        'wall_seconds': round(wall, 3),
+        'frames_per_second': round(frames / wall, 2) if wall > 0 else 0.0,
+        'cpu_seconds_per_frame': round(cpu / frames, 4) if frames else None,
+        'peak_rss_bytes': rss.peak,
+        'bytes_written': written,
+    }
+
+
+def machine_info():
+    import cv2
+
+    ffmpeg_version = None
+    if shutil.which('ffmpeg') is not None:
+        try:
+            output = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, timeout=10).stdout
+            ffmpeg_version = output.splitlines()[0] if output else None
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'memory_bytes': psutil.virtual_memory().total,
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'ffmpeg': ffmpeg_version,
+    }
+
+
+def run_benchmark(presets=(core.DEFAULT_PRESET,), engines=('ffmpeg', 'opencv'), intervals=(1.5,),
+                  size=1600, fmt='jpg', width=3840, height=1920, seconds=10, fps=30,
+                  work_dir=None, report=None):
+    """全組み合わせを測り、JSON に書ける dict を返す。report(種類, 値) に途中経過を渡す"""
+    report = report or (lambda kind, value: None)
+    core.ensure_ffmpeg_on_path()
+    own_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='360foto_bench_')
+    try:
+        os.makedirs(work_dir, exist_ok=True)
+        video_start = time.perf_counter()
+        input_path = synthesize_video(os.path.join(work_dir, 'bench_src'), width, height, seconds, fps)
+        report('video', {'path': input_path, 'seconds': round(time.perf_counter() - video_start, 3)})
+
+        cases = []
+        for engine in engines:
+            if engine == 'ffmpeg' and shutil.which('ffmpeg') is None:
+                report('skipped', {'engine': engine, 'reason': 'ffmpeg not found'})
+                continue
+            for preset in presets:
+                for interval in intervals:
+                    case = run_case(input_path, os.path.join(work_dir, 'out'), preset, engine, interval, size, fmt)
+                    report('case', case)
+                    cases.append(case)
+
+        return {
+            'version': BENCHMARK_VERSION,
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'machine': machine_info(),
+            'video': {'width': width, 'height': height, 'seconds': seconds, 'fps': fps,
+                      'container': os.path.splitext(input_path)[1].lstrip('.')},
+            'results': cases,
+        }
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def save_results(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,79 @@
+"""デコード → 再投影 → エンコードの間で使い回すフレームのバッファ
+
+8K の正距円筒フレームは 1 枚 100MB 近くあり、デコードが再投影・エンコードより速いと、
+フレームごとに確保した配列が溜まってメモリを使い切る。BufferPool はあらかじめ確保した配列だけを
+貸し出し、空きがなければ返却を待つ。処理中のフレーム数はバッファの数で決まるので、
+メモリの使用量は動画の長さによらず、(同時に動くジョブの数) × (バッファの数 × 1 個の大きさ) で頭打ちになる。
+"""
+import time
+from threading import Condition
+
+DEFAULT_FRAMES_IN_FLIGHT = 3  # 上限を指定しないときに1ジョブで同時に扱うフレーム数
+MAX_FRAMES_IN_FLIGHT = 8      # 上限に余裕があっても、これより多くは確保しない
+
+
+def plan_count(unit_bytes, per_frame, budget=None, fixed_bytes=0):
+    """1ジョブのバッファの数
+
+    per_frame は1フレームに使うバッファの数（方向ごとに1つなら方向数、横に並べて1つなら 1）。
+    budget（バイト）がなければ DEFAULT_FRAMES_IN_FLIGHT フレームぶん。あれば fixed_bytes
+    （デコード中のフレームや参照テーブル）を除いた残りに入る数で、少なくとも1フレームぶんは確保する。
+    """
+    if budget is None:
+        return per_frame * DEFAULT_FRAMES_IN_FLIGHT
+    count = int((budget - fixed_bytes) // max(1, unit_bytes))
+    return max(per_frame, min(count, per_frame * MAX_FRAMES_IN_FLIGHT))
+
+
+class BufferPool:
+    """同じ形の ndarray を count 個あらかじめ確保して使い回す（スレッドから同時に使ってよい）
+
+    acquire() は空きがなければ返却を待つ（後段が追いつくまで前段を止める）。1つのバッファを
+    parts 個のビュー（方向ごとの切り出しなど）に分けて渡した場合は、release() が parts 回
+    呼ばれた時点で空きに戻る。release() にはバッファから切り出したビューをそのまま渡してよい。
+    """
+
+    def __init__(self, shape, count, dtype='uint8'):
+        import numpy as np
+
+        self.shape = tuple(shape)
+        self.count = count
+        self.nbytes = int(np.prod(self.shape)) * np.dtype(dtype).itemsize * count
+        self.waited = 0.0  # 空きを待った秒数の合計
+        self._cond = Condition()
+        self._buffers = {}  # id -> [配列, 返却を待っているビューの数]
+        self._free = []
+        for _ in range(count):
+            buffer = np.empty(self.shape, dtype)
+            self._buffers[id(buffer)] = [buffer, 0]
+            self._free.append(buffer)
+
+    def acquire(self, parts=1, should_stop=None):
+        """空いているバッファを返す。待っている間に should_stop() が True になったら None"""
+        start = time.perf_counter()
+        with self._cond:
+            while not self._free:
+                if should_stop is not None and should_stop():
+                    return None
+                self._cond.wait(0.1)
+            # 最後に返されたものから使う（CPU のキャッシュに残っている可能性が高い）
+            buffer = self._free.pop()
+            self._buffers[id(buffer)][1] = parts
+            self.waited += time.perf_counter() - start
+        return buffer
+
+    def _root(self, array):
+        while id(array) not in self._buffers:
+            if getattr(array, 'base', None) is None:
+                raise ValueError("プールのバッファではありません")
+            array = array.base
+        return array
+
+    def release(self, array, parts=1):
+        with self._cond:
+            entry = self._buffers[id(self._root(array))]
+            entry[1] -= parts
+            if entry[1] <= 0:
+                entry[1] = 0
+                self._free.append(entry[0])
+                self._cond.notify()
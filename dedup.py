@@ -0,0 +1,274 @@
+"""書き出した画像のうち、ほぼ同じ画像を知覚ハッシュで見つけて取り除く
+
+止まっている区間の画像は方向ごとにほとんど同じになり、出力が増えて RealityScan も遅くなる。
+各画像の dHash（64 ビット）を NumPy でまとめて計算し、同じ動画・同じ方向ですでに残した画像との
+ハミング距離が max_distance 以下なら重複として duplicates/ に移す（または削除する）。
+別の動画の画像とは比べない（同じ場所を撮った別の動画の画像を重複として消さないため）。
+読み込めない画像は飛ばして 'unreadable' に数える。
+
+ハッシュと判定はフォルダの 360foto_dedup.json に（保存先からの相対パスごとに）記録し、
+次回は増えた画像だけをハッシュして判定する（ファイルの更新時刻・サイズが同じ画像は計算し直さない）。
+動画ごと・方向ごとのフォルダ（output_layout）に分けた出力も下のフォルダまでたどる。
+"""
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from output_layout import NAME_PATTERN, drop_from_index
+from xmp_sidecar import sidecar_path
+
+DEDUP_INDEX_NAME = '360foto_dedup.json'
+DEDUP_INDEX_VERSION = 1
+DUPLICATES_DIR = 'duplicates'
+
+# 64 ビット中の違うビット数。6 前後で「構図は同じで少し揺れた」程度までを重複とみなす
+DEFAULT_DISTANCE = 6
+BATCH_SIZE = 256
+
+ACTIONS = ('move', 'delete', 'none')
+
+# 以前の形式のファイル名 {名前}_ot_{方向}_{番号}.{拡張子}
+_LEGACY_PATTERN = re.compile(r'_ot_(\d+)_(\d+)\.(jpg|jpeg|png|webp|jxl)$', re.IGNORECASE)
+
+
+def direction_of(name):
+    """ファイル名から方向の番号を返す。変換の出力でなければ None"""
+    match = NAME_PATTERN.search(name) or _LEGACY_PATTERN.search(name)
+    return int(match.group(1)) if match else None
+
+
+def group_of(name):
+    """(動画の接頭辞, 方向)。同じ組の画像どうしだけを比べる。変換の出力でなければ None"""
+    name = os.path.basename(name)
+    match = NAME_PATTERN.search(name) or _LEGACY_PATTERN.search(name)
+    return (name[:match.start()], int(match.group(1))) if match else None
+
+
+def _scan_images(folder):
+    """(保存先からの相対パス, DirEntry) を返す（duplicates/ の中は見ない）"""
+    stack = [folder]
+    while stack:
+        directory = stack.pop()
+        for item in os.scandir(directory):
+            if item.is_dir():
+                if item.name != DUPLICATES_DIR or directory != folder:
+                    stack.append(item.path)
+            elif direction_of(item.name) is not None:
+                yield os.path.relpath(item.path, folder), item
+
+
+def _load_gray(path):
+    """縮小して読み込んだグレースケール画像（日本語パスでも読めるよう imdecode を使う）"""
+    import cv2
+    import numpy as np
+
+    data = np.fromfile(path, dtype=np.uint8)
+    # JPEG は 1/4 でデコードすると速い（ハッシュは 9x8 まで縮めるので精度は変わらない）
+    image = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        image = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"画像を読み込めません: {path}")
+    return cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+
+
+def _try_load_gray(path):
+    """_load_gray と同じだが、読み込めない画像は None（1枚のせいで全体を止めない）"""
+    try:
+        return _load_gray(path)
+    except Exception as e:
+        print(f"Warning: 画像を読み込めないため重複の判定から外します: {path}: {e}")
+        return None
+
+
+def dhash_batch(thumbnails):
+    """9x8 のグレースケール画像の列から dHash（uint64 の配列）をまとめて計算する"""
+    import numpy as np
+
+    stack = np.stack(thumbnails).astype(np.int16)            # (N, 8, 9)
+    bits = stack[:, :, 1:] > stack[:, :, :-1]                # 横に隣り合う画素の明暗 (N, 8, 8)
+    packed = np.packbits(bits.reshape(len(thumbnails), 64), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+def _popcount(values):
+    """uint64 の配列の各要素の立っているビット数"""
+    import numpy as np
+
+    if hasattr(np, 'bitwise_count'):  # NumPy 2.0 以降
+        return np.bitwise_count(values)
+    # 古い NumPy では、2・4・8 ビットごとに数えて足し合わせる（配列全体の演算数回で済む）
+    values = values - ((values >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    values = (values & np.uint64(0x3333333333333333)) + ((values >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    values = (values + (values >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (values * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def hamming(value, hashes):
+    """value と hashes（uint64 の配列）の各要素とのハミング距離"""
+    import numpy as np
+
+    return _popcount(np.bitwise_xor(hashes, np.uint64(value)))
+
+
+class _KeptHashes:
+    """1方向ぶんの残した画像のハッシュ
+
+    np.append のように追加のたびに全体をコピーしないよう、確保した配列がいっぱいになったら倍に広げる。
+    """
+
+    def __init__(self):
+        import numpy as np
+
+        self.values = np.empty(1024, np.uint64)
+        self.count = 0
+
+    def add(self, value):
+        import numpy as np
+
+        if self.count == len(self.values):
+            grown = np.empty(len(self.values) * 2, np.uint64)
+            grown[:self.count] = self.values
+            self.values = grown
+        self.values[self.count] = value
+        self.count += 1
+
+    def nearest(self, value):
+        """いちばん近いハッシュとの距離。まだ1つもなければ None"""
+        if not self.count:
+            return None
+        return int(hamming(value, self.values[:self.count]).min())
+
+
+def _load_index(folder):
+    try:
+        with open(os.path.join(folder, DEDUP_INDEX_NAME), encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == DEDUP_INDEX_VERSION:
+            return data
+    except (OSError, ValueError):
+        pass
+    return {'version': DEDUP_INDEX_VERSION, 'max_distance': None, 'entries': {}}
+
+
+def _save_index(folder, index):
+    path = os.path.join(folder, DEDUP_INDEX_NAME)
+    tmp_path = path + f'.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def pruned_names(folder):
+    """重複として取り除いたファイル名の集合（再開時に作り直さないため）"""
+    entries = _load_index(folder)['entries']
+    return {name for name, entry in entries.items() if entry.get('status') == 'duplicate'}
+
+
+def _remove(folder, name, action):
+    path = os.path.join(folder, name)
+    for source in (path, sidecar_path(path)):
+        if not os.path.exists(source):
+            continue
+        if action == 'delete':
+            os.remove(source)
+        else:
+            # フォルダ分けした出力は、同じ構成のまま duplicates/ の下に移す
+            target = os.path.join(folder, DUPLICATES_DIR, os.path.relpath(source, folder))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(source, target)
+
+
+def dedup_folder(folder, max_distance=DEFAULT_DISTANCE, action='move', max_workers=None,
+                 report=None, should_stop=None):
+    """folder の画像の重複を取り除き、{'hashed', 'reused', 'kept', 'duplicates', 'unreadable'} を返す
+
+    action='move' なら duplicates/ へ（XMP サイドカーも一緒に）移し、'delete' なら削除、
+    'none' なら判定の記録だけを行う。max_distance を前回から変えた場合は、記録済みの
+    ハッシュを使って全体を判定し直す（画像は読み直さない）。
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"不明な処理です: {action}")
+    report = report or (lambda kind, value: None)
+    index = _load_index(folder)
+    entries = index['entries']
+    if index.get('max_distance') != max_distance:
+        # フォルダに残っている画像の判定だけやり直す（移動・削除した画像は重複のまま）
+        for name, entry in entries.items():
+            if entry.get('status') == 'kept' or os.path.exists(os.path.join(folder, name)):
+                entry.pop('status', None)
+        index['max_distance'] = max_distance
+
+    # 判定が済んでいない画像（新しい画像と、更新された画像）を集める
+    todo = []
+    reused = 0
+    seen = set()
+    removed = []
+    for name, item in _scan_images(folder):
+        seen.add(name)
+        st = item.stat()
+        stamp = [st.st_size, st.st_mtime_ns]
+        entry = entries.get(name)
+        if entry is not None and entry.get('stamp') == stamp:
+            if 'status' not in entry:
+                todo.append(name)
+                reused += 1
+            elif entry['status'] == 'duplicate' and action != 'none':
+                # 前回 action='none' で判定だけした重複
+                _remove(folder, name, action)
+                removed.append(name)
+            continue
+        entries[name] = {'direction': direction_of(item.name), 'stamp': stamp}
+        todo.append(name)
+    # 利用者が消した画像は比べる相手にしない
+    for name in [n for n, entry in entries.items() if n not in seen and entry.get('status') != 'duplicate']:
+        del entries[name]
+
+    # 足りないハッシュをバッチごとに計算する（読み込みは並列、ハッシュはまとめて NumPy で）
+    to_hash = [name for name in todo if 'hash' not in entries[name]]
+    unreadable = 0
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as pool:
+        for start in range(0, len(to_hash), BATCH_SIZE):
+            if should_stop is not None and should_stop():
+                break
+            batch = to_hash[start:start + BATCH_SIZE]
+            thumbnails = list(pool.map(lambda name: _try_load_gray(os.path.join(folder, name)), batch))
+            loaded = [(name, thumbnail) for name, thumbnail in zip(batch, thumbnails) if thumbnail is not None]
+            unreadable += len(batch) - len(loaded)
+            if loaded:
+                for (name, _), value in zip(loaded, dhash_batch([thumbnail for _, thumbnail in loaded])):
+                    entries[name]['hash'] = f'{int(value):016x}'
+            report('dedup_hash', {'done': min(start + BATCH_SIZE, len(to_hash)), 'total': len(to_hash)})
+
+    # 動画・方向ごとに、番号の若い順に「残した画像のどれかに近いか」を判定する
+    kept = {}
+    for name, entry in entries.items():
+        if entry.get('status') == 'kept':
+            kept.setdefault(group_of(name), _KeptHashes()).add(int(entry['hash'], 16))
+
+    stats = {'hashed': len(to_hash) - unreadable, 'reused': reused, 'kept': 0, 'duplicates': 0,
+             'unreadable': unreadable}
+    for name in sorted((n for n in todo if 'hash' in entries[n]), key=lambda n: (group_of(n), os.path.basename(n))):
+        entry = entries[name]
+        value = int(entry['hash'], 16)
+        group = group_of(name)
+        previous = kept.get(group)
+        if previous is None:
+            previous = kept[group] = _KeptHashes()
+        distance = previous.nearest(value)
+        if distance is not None and distance <= max_distance:
+            entry.update(status='duplicate', distance=distance)
+            if action != 'none':
+                _remove(folder, name, action)
+                removed.append(name)
+            stats['duplicates'] += 1
+            continue
+        entry['status'] = 'kept'
+        previous.add(value)
+        stats['kept'] += 1
+
+    _save_index(folder, index)
+    drop_from_index(folder, [name.replace(os.sep, '/') for name in removed])
+    return stats
@@ -0,0 +1,218 @@
+"""正距円筒（全天球）画像から透視投影ビューを切り出す NumPy/OpenCV エンジン
+
+ffmpeg の v360 フィルタ（input=e, output=rectilinear）と同じ向きの画像を
+cv2.remap で生成する。参照座標テーブルは (元解像度, yaw, pitch, roll, FOV, 出力サイズ)
+ごとに一度だけ計算し、メモリとディスクにキャッシュする。
+"""
+import math
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# テーブルの計算方法を変えたら上げる（古いキャッシュを無効化するため）
+REMAP_CACHE_VERSION = 1
+
+_remap_cache = {}
+
+
+def get_rotation_matrix(yaw_deg, pitch_deg, roll_deg):
+    # Convert to radians
+    yaw = np.radians(yaw_deg)
+    pitch = np.radians(pitch_deg)
+    roll = np.radians(roll_deg)
+
+    # Rotation matrices (assumptions may need adjustment depending on v360 conventions)
+    Ry = np.array([
+        [np.cos(yaw), 0, np.sin(yaw)],
+        [0, 1, 0],
+        [-np.sin(yaw), 0, np.cos(yaw)]
+    ])
+
+    Rx = np.array([
+        [1, 0, 0],
+        [0, np.cos(pitch), -np.sin(pitch)],
+        [0, np.sin(pitch), np.cos(pitch)]
+    ])
+
+    Rz = np.array([
+        [np.cos(roll), -np.sin(roll), 0],
+        [np.sin(roll), np.cos(roll), 0],
+        [0, 0, 1]
+    ])
+
+    R = Ry @ Rx @ Rz
+    return R
+
+
+def default_cache_dir():
+    """参照テーブルのキャッシュ先（FOTO360_CACHE_DIR で変更可能）"""
+    base = os.environ.get('FOTO360_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', '360foto')
+    return os.path.join(base, 'remap')
+
+
+def build_remap_maps(src_width, src_height, yaw, pitch, roll, h_fov, v_fov, width, height):
+    """出力画素ごとの参照元座標を計算し、cv2.remap 用の固定小数点テーブルを返す"""
+    # 出力画素の中心を通る視線ベクトル（x: 右, y: 下, z: 前）
+    xs = (2.0 * (np.arange(width) + 0.5) / width - 1.0) * math.tan(math.radians(h_fov) / 2)
+    ys = (2.0 * (np.arange(height) + 0.5) / height - 1.0) * math.tan(math.radians(v_fov) / 2)
+    x, y = np.meshgrid(xs, ys)
+    vec = np.stack([x, y, np.ones_like(x)], axis=-1)
+    vec /= np.linalg.norm(vec, axis=-1, keepdims=True)
+
+    rotated = vec @ get_rotation_matrix(yaw, pitch, roll).T
+
+    phi = np.arctan2(rotated[..., 0], rotated[..., 2])
+    theta = np.arcsin(np.clip(rotated[..., 1], -1.0, 1.0))
+
+    map_x = (phi / np.pi + 1.0) * src_width / 2 - 0.5
+    map_y = (theta / (np.pi / 2) + 1.0) * src_height / 2 - 0.5
+    # 左右は BORDER_WRAP で回り込ませ、上下は極で止める
+    map_x = np.mod(map_x, src_width)
+    map_y = np.clip(map_y, 0, src_height - 1)
+
+    return cv2.convertMaps(map_x.astype(np.float32), map_y.astype(np.float32), cv2.CV_16SC2)
+
+
+def get_remap_maps(src_width, src_height, yaw, pitch, roll, h_fov, v_fov, width, height, cache_dir=None):
+    """参照テーブルをメモリ → ディスク → 新規計算の順に取得する"""
+    key = (src_width, src_height, yaw, pitch, roll, h_fov, v_fov, width, height)
+    maps = _remap_cache.get(key)
+    if maps is not None:
+        return maps
+
+    cache_dir = cache_dir or default_cache_dir()
+    file_name = 'v{}_e{}x{}_y{}_p{}_r{}_f{}x{}_{}x{}.npz'.format(REMAP_CACHE_VERSION, *key)
+    cache_path = os.path.join(cache_dir, file_name)
+
+    try:
+        with np.load(cache_path) as data:
+            maps = (data['map1'], data['map2'])
+    except Exception:
+        # ない・壊れている（途中で切れた .npz は zipfile.BadZipFile になる）ときは計算し直して上書きする
+        maps = build_remap_maps(*key)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # 同じプロセスのほかのスレッドが同じテーブルを同時に書くことがあるので、スレッドごとの名前にする
+            tmp_path = cache_path + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, map1=maps[0], map2=maps[1])
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Warning: remap テーブルをキャッシュできませんでした: {e}")
+
+    _remap_cache[key] = maps
+    return maps
+
+
+def reproject(frame, maps, dst=None):
+    """正距円筒フレームを1方向の透視投影ビューに変換する"""
+    return cv2.remap(frame, maps[0], maps[1], cv2.INTER_LINEAR, dst=dst, borderMode=cv2.BORDER_WRAP)
+
+
+def iter_views(input_path, transforms, interval, size, h_fov=90, v_fov=90, should_stop=None,
+               cache_dir=None, timestamps=None, frame_numbers=None, profile=None,
+               start_time=0.0, end_time=None, start_number=1, buffers=None):
+    """動画を1回だけデコードし、interval 秒ごとに (番号, 時刻, [方向ごとのビュー]) を順に返す
+
+    ビューは BGR の ndarray（size x size）。timestamps を渡すと、順に読むかわりに
+    各時刻へシークして1フレームずつ取り出す。その場合の番号は frame_numbers
+    （省略時は 1 からの連番）になる。profile(工程, 秒) を渡すと 'decode' と 'reproject' の時間を渡す。
+    start_time / end_time を渡すとその区間だけを start_number 番から返す（start_time は interval の倍数。
+    番号と時刻は先頭から読んだ場合と同じになる）。
+    buffers（buffer_pool.BufferPool）を渡すと、ビューはそこから借りた配列に書き込む（受け取った側が
+    使い終わったら buffers.release(ビュー) で返す）。空きがなければ返却を待つので、デコードが先に進みすぎない。
+    デコードしたフレームの配列は毎回使い回す。
+    """
+    profile = profile or (lambda stage, seconds: None)
+
+    def reproject_all(frame):
+        views = []
+        elapsed = 0.0
+        for view_maps in maps:
+            dst = None
+            if buffers is not None:
+                dst = buffers.acquire(should_stop=should_stop)
+                if dst is None:
+                    # 中断された。借りた分は返しておく
+                    for view in views:
+                        buffers.release(view)
+                    return None
+            start = time.perf_counter()
+            views.append(reproject(frame, view_maps, dst))
+            elapsed += time.perf_counter() - start
+        profile('reproject', elapsed)
+        return views
+
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"動画を開けません: {input_path}")
+
+    try:
+        src_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        src_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if fps <= 0:
+            fps = 30
+
+        # 4番目の値があれば方向ごとの視野角（プリセットで指定されたもの）
+        maps = [
+            get_remap_maps(src_width, src_height, t[0], t[1], t[2],
+                           t[3] if len(t) > 3 else h_fov, t[3] if len(t) > 3 else v_fov, size, size, cache_dir)
+            for t in transforms
+        ]
+
+        frame = None
+        if timestamps is not None:
+            if frame_numbers is None:
+                frame_numbers = range(1, len(timestamps) + 1)
+            for t, number in zip(timestamps, frame_numbers):
+                if should_stop is not None and should_stop():
+                    break
+                start = time.perf_counter()
+                cap.set(cv2.CAP_PROP_POS_MSEC, t * 1000)
+                ok, frame = cap.read(frame)
+                profile('decode', time.perf_counter() - start)
+                if not ok:
+                    break
+                views = reproject_all(frame)
+                if views is None:
+                    break
+                yield number, t, views
+            return
+
+        frame_index = 0
+        number = start_number - 1
+        next_time = start_time
+        if start_time > 0:
+            cap.set(cv2.CAP_PROP_POS_MSEC, start_time * 1000)
+            frame_index = int(round(cap.get(cv2.CAP_PROP_POS_FRAMES)))
+        while True:
+            if should_stop is not None and should_stop():
+                break
+            start = time.perf_counter()
+            # 不要なフレームは grab だけで読み飛ばす（色変換・コピーを省く）
+            if not cap.grab():
+                break
+            t = frame_index / fps
+            frame_index += 1
+            if end_time is not None and t + 1e-6 >= end_time:
+                break
+            if t + 1e-6 < next_time:
+                profile('decode', time.perf_counter() - start)
+                continue
+
+            ok, frame = cap.retrieve(frame)
+            profile('decode', time.perf_counter() - start)
+            if not ok:
+                break
+            views = reproject_all(frame)
+            if views is None:
+                break
+            number += 1
+            yield number, t, views
+            next_time = (math.floor(t / interval + 1e-6) + 1) * interval
+    finally:
+        cap.release()
@@ -0,0 +1,367 @@
+"""全天球動画変換のコマンドラインインターフェース（GUI なし・ジョブキューからの実行用）
+
+例:
+    python foto360_cli.py convert "input/*.mp4" -o output --preset 6_h3_45 --interval 1.5
+    python foto360_cli.py presets --coverage
+    python foto360_cli.py layout --overlap 40 --min-pitch -60 --save auto_10
+    python foto360_cli.py watch //nas/capture -o output --parallel 2 --status-port 8360
+    python foto360_cli.py dedup output --distance 6
+    python foto360_cli.py realityscan output/a output/b -o rs --parallel 1
+    python foto360_cli.py hwinfo
+    python foto360_cli.py benchmark --preset 1 6_h3_45 --engine opencv -o bench.json
+
+進捗は1行1イベントの JSON（{"event": 種類, "value": 値}）で標準出力に出す。
+終了コード: 0 = 成功, 1 = 失敗したジョブあり, 2 = 引数・入力の誤り, 130 = 中断
+"""
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+import foto360_core as core
+from presets import analyze_coverage, fibonacci_layout, layout_for_overlap, save_user_preset, user_presets_path
+from run_report import jsonl_hook
+
+
+_emit_lock = threading.Lock()
+
+
+def emit(kind, value):
+    # 並列ジョブのスレッドから呼ばれるので、行が混ざらないようにまとめて書く
+    line = json.dumps({'event': kind, 'value': value}, ensure_ascii=False) + '\n'
+    with _emit_lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+
+def expand_inputs(patterns):
+    """glob パターンを展開する（Windows のシェルは展開しないため自前で行う）"""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def parse_interval(value):
+    if value == core.AUTO_INTERVAL:
+        return value
+    try:
+        interval = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"秒数か {core.AUTO_INTERVAL} を指定してください: {value}")
+    if interval <= 0:
+        raise argparse.ArgumentTypeError(f"間隔は正の値にしてください: {value}")
+    return interval
+
+
+def parse_size(value):
+    if value == core.AUTO_SIZE:
+        return value
+    try:
+        size = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"画素数か {core.AUTO_SIZE} を指定してください: {value}")
+    if size < 16:
+        raise argparse.ArgumentTypeError(f"画素数は 16 以上にしてください: {value}")
+    return size
+
+
+def parse_segment(value):
+    if value == core.AUTO_SEGMENT:
+        return value
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"秒数か {core.AUTO_SEGMENT} を指定してください: {value}")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(f"区間の長さは正の値にしてください: {value}")
+    return seconds
+
+
+def cmd_convert(args):
+    input_paths = expand_inputs(args.inputs)
+    if not input_paths:
+        print("入力ファイルが見つかりません: " + " ".join(args.inputs), file=sys.stderr)
+        return 2
+
+    stop_event = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            outcome['results'] = core.process_video(
+                input_paths, args.output, report=emit, should_stop=stop_event.is_set,
+                hooks=[jsonl_hook(args.events)] if args.events else None, **conversion_options(args))
+        except Exception as e:
+            outcome['error'] = e
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(0.2)
+    except KeyboardInterrupt:
+        stop_event.set()
+        worker.join()
+        emit('cancelled', True)
+        return 130
+
+    if 'error' in outcome:
+        emit('error', str(outcome['error']))
+        return 2 if isinstance(outcome['error'], ValueError) else 1
+
+    results = outcome['results']
+    failed = sum(1 for result in results if not result['ok'])
+    emit('done', {'jobs': len(results), 'failed': failed})
+    return 1 if failed else 0
+
+
+def cmd_watch(args):
+    from watch_folder import WatchDaemon
+
+    folders = [folder for folder in args.folders if os.path.isdir(folder)]
+    if len(folders) != len(args.folders):
+        print("入力フォルダが見つかりません: " + " ".join(sorted(set(args.folders) - set(folders))), file=sys.stderr)
+        return 2
+
+    options = conversion_options(args)
+    if args.events:
+        options['hooks'] = [jsonl_hook(args.events)]
+    daemon = WatchDaemon(folders, args.output, options, max_parallel=args.parallel, settle=args.settle,
+                         poll_interval=args.poll_interval, status_port=args.status_port,
+                         use_inotify=not args.poll, report=emit)
+    worker = threading.Thread(target=daemon.run)
+    worker.start()
+
+    def on_terminate(signum, frame):
+        # サービスの停止（SIGTERM）も Ctrl+C と同じく、変換中の ffmpeg を止めて状態を書いてから終わる
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, on_terminate)
+    try:
+        # join() の途中で KeyboardInterrupt を受けると、後の join() が終わりを待たずに戻ることがあるので sleep で待つ
+        while worker.is_alive():
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        daemon.stop()
+        worker.join()
+        emit('cancelled', True)
+        return 130
+    return 0
+
+
+def cmd_presets(args):
+    for name, (label, transforms) in core.PRESETS.items():
+        value = {'name': name, 'label': label, 'views': [list(t) for t in transforms]}
+        if args.coverage:
+            value['coverage'] = analyze_coverage(transforms, args.fov)
+        emit('preset', value)
+    return 0
+
+
+def cmd_layout(args):
+    pitch_range = (args.min_pitch, args.max_pitch)
+    if args.views:
+        views = fibonacci_layout(args.views, pitch_range)
+        stats = analyze_coverage(views, args.fov, pitch_range=pitch_range)
+    else:
+        try:
+            views, stats = layout_for_overlap(args.overlap / 100, args.fov, pitch_range)
+        except ValueError as e:
+            emit('error', str(e))
+            return 2
+    if args.fov != 90:
+        views = [view + (args.fov,) for view in views]
+    emit('layout', {'views': [list(view) for view in views], 'coverage': stats})
+    if args.save:
+        save_user_preset(args.save, args.label or f"{len(views)}方向（自動配置）", views)
+        emit('saved', {'name': args.save, 'path': user_presets_path()})
+    return 0
+
+
+def cmd_dedup(args):
+    from dedup import dedup_folder
+
+    if not os.path.isdir(args.folder):
+        print(f"フォルダが見つかりません: {args.folder}", file=sys.stderr)
+        return 2
+    emit('dedup', dedup_folder(args.folder, args.distance, args.action, report=emit))
+    return 0
+
+
+def cmd_realityscan(args):
+    from realityscan_runner import run_queue
+
+    folders = [folder for folder in args.folders if os.path.isdir(folder)]
+    if len(folders) != len(args.folders):
+        print("画像フォルダが見つかりません: " + " ".join(sorted(set(args.folders) - set(folders))), file=sys.stderr)
+        return 2
+
+    def on_finished(result):
+        emit('project', dict(result['job'].get('record', {}), ok=result['ok'], error=result['error']))
+
+    results = run_queue(folders, args.output, args.parallel, exe=args.exe, on_finished=on_finished)
+    failed = sum(1 for result in results if not result['ok'])
+    emit('done', {'projects': len(results), 'failed': failed})
+    return 1 if failed else 0
+
+
+def cmd_hwinfo(args):
+    import hw_detect
+
+    core.ensure_ffmpeg_on_path()
+    caps = hw_detect.get_capabilities()
+    emit('hwinfo', dict(caps, selected={
+        codec: hw_detect.choose_backend(codec, args.width, caps) for codec in ('h264', 'hevc')}))
+    return 0
+
+
+def cmd_benchmark(args):
+    from benchmark import run_benchmark, save_results
+
+    results = run_benchmark(
+        presets=args.preset, engines=args.engine, intervals=args.interval, size=args.size, fmt=args.format,
+        width=args.width, height=args.width // 2, seconds=args.seconds, fps=args.fps,
+        work_dir=args.work_dir, report=emit)
+    if args.output:
+        save_results(results, args.output)
+        emit('saved', {'path': args.output})
+    failed = sum(1 for case in results['results'] if not case['ok'])
+    emit('done', {'cases': len(results['results']), 'failed': failed})
+    return 1 if failed else 0
+
+
+def add_conversion_options(parser):
+    """convert と watch に共通の変換の設定"""
+    parser.add_argument('--preset', default=core.DEFAULT_PRESET, choices=list(core.PRESETS), help="出力方向プリセット")
+    parser.add_argument('--interval', type=parse_interval, default=1.5,
+                        help=f"画像書出し間隔（秒）。{core.AUTO_INTERVAL} で鮮明さと動きから自動で選ぶ")
+    parser.add_argument('--size', type=parse_size, default=1600,
+                        help=f"出力画像の一辺の画素数。{core.AUTO_SIZE} で元動画の解像度から決める")
+    parser.add_argument('--fov', type=float, default=90, help="出力画像の視野角（度）")
+    parser.add_argument('--format', default='jpg', choices=['jpg', 'png', 'webp', 'jxl'], help="出力フォーマット")
+    parser.add_argument('--quality', type=int, default=95, help="JPG / WebP / JPEG XL の品質（0〜100）")
+    parser.add_argument('--png-level', type=int, default=3, choices=range(10), metavar='0-9', help="PNG の圧縮レベル")
+    parser.add_argument('--encoder', default='python', choices=['python', 'ffmpeg'],
+                        help="python = 並列エンコード段で書き出す, ffmpeg = ffmpeg が直接書き出す")
+    parser.add_argument('--encode-workers', type=int, default=None, help="エンコードのスレッド数（既定は CPU コア数）")
+    parser.add_argument('--xmp', action='store_true', help="XMP データを作成する")
+    parser.add_argument('--engine', default='ffmpeg', choices=['ffmpeg', 'opencv'], help="変換エンジン")
+    parser.add_argument('--hwaccel', default='auto', choices=['auto', 'cuda', 'qsv', 'vaapi', 'cpu'],
+                        help="ffmpeg のデコードに使うハードウェア（auto は調べて使えるものを選ぶ）")
+    parser.add_argument('--no-split', action='store_true', help="方向ごとに ffmpeg を実行する（一括デコードしない）")
+    parser.add_argument('--cpu-workers', type=int, default=None, help="CPU ジョブの並列数")
+    parser.add_argument('--gpu-workers', type=int, default=1, help="GPU ジョブの並列数")
+    parser.add_argument('--retries', type=int, default=1, help="失敗したジョブの再試行回数")
+    parser.add_argument('--no-resume', action='store_true', help="マニフェストを無視して最初から作り直す")
+    parser.add_argument('--layout', default='flat', choices=['flat', 'video', 'direction'],
+                        help="出力のフォルダ構成（flat: 保存先に直接, video: 動画ごと, direction: 動画・方向ごと）")
+    parser.add_argument('--dedup', type=int, default=None, metavar='DISTANCE',
+                        help="変換後にハッシュの違いが DISTANCE ビット以下の画像を重複として duplicates/ に移す")
+    parser.add_argument('--memory-limit', type=float, default=None, metavar='MB',
+                        help="変換中のフレームに使うメモリの上限（MB、同時に動くジョブで等分する）")
+    parser.add_argument('--segment', type=parse_segment, default=None, metavar='SECONDS',
+                        help=f"長い動画を SECONDS 秒ごとの区間に分けて並列に処理する（{core.AUTO_SEGMENT} なら並列数で等分）")
+
+
+def conversion_options(args):
+    """変換の設定を process_video のキーワード引数にする"""
+    return dict(
+        preset=args.preset, interval=args.interval, size=args.size, fov=args.fov, fmt=args.format,
+        xmp=args.xmp, engine=args.engine, split_decode=not args.no_split,
+        cpu_workers=args.cpu_workers, gpu_workers=args.gpu_workers, retries=args.retries,
+        resume=not args.no_resume, encoder=args.encoder, quality=args.quality,
+        png_level=args.png_level, encode_workers=args.encode_workers, hwaccel=args.hwaccel,
+        dedup_distance=args.dedup, layout=args.layout, segment_seconds=args.segment,
+        memory_limit=args.memory_limit * 2 ** 20 if args.memory_limit else None,
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='foto360_cli.py', description="全天球動画を複数方向の静止画に変換します。")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    convert = sub.add_parser('convert', help="動画を変換する")
+    convert.add_argument('inputs', nargs='+', help="入力動画（glob パターン可）")
+    convert.add_argument('-o', '--output', required=True, help="保存先フォルダ")
+    add_conversion_options(convert)
+    convert.add_argument('--events', metavar='PATH', help="ジョブごとの記録と工程別の集計を JSON Lines で追記するファイル")
+    convert.set_defaults(func=cmd_convert)
+
+    watch = sub.add_parser('watch', help="フォルダを見張り、置かれた動画を自動で変換し続ける")
+    watch.add_argument('folders', nargs='+', help="見張る入力フォルダ（複数可）")
+    watch.add_argument('-o', '--output', required=True, help="保存先フォルダ（動画ごとのフォルダに分けて書き出す）")
+    watch.add_argument('--parallel', type=int, default=1, help="同時に変換する動画の数")
+    watch.add_argument('--settle', type=float, default=3.0,
+                       help="サイズと更新時刻がこの秒数変わらなければ書き込みが終わったとみなす")
+    watch.add_argument('--poll-interval', type=float, default=2.0, help="inotify を使えないときにフォルダを調べる間隔（秒）")
+    watch.add_argument('--poll', action='store_true', help="inotify を使わず、常にフォルダを調べる（ネットワーク共有など）")
+    watch.add_argument('--status-port', type=int, default=None,
+                       help="状態を http://127.0.0.1:PORT/status（死活監視は /health）で返す")
+    add_conversion_options(watch)
+    watch.add_argument('--events', metavar='PATH', help="ジョブごとの記録と工程別の集計を JSON Lines で追記するファイル")
+    watch.set_defaults(func=cmd_watch)
+
+    presets = sub.add_parser('presets', help="出力方向プリセットの一覧")
+    presets.add_argument('--coverage', action='store_true', help="球面のカバー率と重なりも出力する")
+    presets.add_argument('--fov', type=float, default=90, help="カバー率を調べるときの視野角（度）")
+    presets.set_defaults(func=cmd_presets)
+
+    layout = sub.add_parser('layout', help="目標の重なりを満たす最少の方向を自動で配置する")
+    layout.add_argument('--overlap', type=float, default=30, help="各方向の画角のうちほかと重なる割合の下限（%%）")
+    layout.add_argument('--views', type=int, default=None, help="方向数を指定して均等に配置する（--overlap より優先）")
+    layout.add_argument('--fov', type=float, default=90, help="視野角（度）")
+    layout.add_argument('--min-pitch', type=float, default=-90, help="覆う範囲の下限（度、負が下）")
+    layout.add_argument('--max-pitch', type=float, default=90, help="覆う範囲の上限（度）")
+    layout.add_argument('--save', metavar='NAME', help="利用者のプリセットとして保存する")
+    layout.add_argument('--label', help="保存するときの表示名")
+    layout.set_defaults(func=cmd_layout)
+
+    dedup = sub.add_parser('dedup', help="書き出した画像のうち、ほぼ同じ画像を取り除く")
+    dedup.add_argument('folder', help="変換の保存先フォルダ")
+    dedup.add_argument('--distance', type=int, default=6, help="重複とみなすハッシュの違い（0〜64 ビット）")
+    dedup.add_argument('--action', default='move', choices=['move', 'delete', 'none'],
+                       help="重複の扱い（move: duplicates/ に移す, delete: 削除, none: 記録だけ）")
+    dedup.set_defaults(func=cmd_dedup)
+
+    rs = sub.add_parser('realityscan', help="画像フォルダごとに RealityScan を実行する")
+    rs.add_argument('folders', nargs='+', help="画像フォルダ（複数可）")
+    rs.add_argument('-o', '--output', required=True, help="保存先フォルダ（複数のときはフォルダ名ごとに分ける）")
+    rs.add_argument('--parallel', type=int, default=1, help="同時に起動する RealityScan の数（ライセンスに合わせる）")
+    rs.add_argument('--exe', default=None, help="RealityScan.exe のパス（既定は環境変数 REALITYSCAN_EXE か標準のインストール先）")
+    rs.set_defaults(func=cmd_realityscan)
+
+    hwinfo = sub.add_parser('hwinfo', help="使えるハードウェアデコードを調べて表示する")
+    hwinfo.add_argument('--width', type=int, default=3840, help="選ばれるバックエンドを表示するときの動画の横幅")
+    hwinfo.set_defaults(func=cmd_hwinfo)
+
+    bench = sub.add_parser('benchmark', help="テスト動画を作って変換速度を測る")
+    bench.add_argument('--preset', nargs='+', default=[core.DEFAULT_PRESET], choices=list(core.PRESETS), help="測るプリセット")
+    bench.add_argument('--engine', nargs='+', default=['ffmpeg', 'opencv'], choices=['ffmpeg', 'opencv'], help="測る変換エンジン")
+    bench.add_argument('--interval', nargs='+', type=parse_interval, default=[1.5], help="測る書き出し間隔（秒）")
+    bench.add_argument('--size', type=parse_size, default=1600, help="出力画像の一辺の画素数")
+    bench.add_argument('--format', default='jpg', choices=['jpg', 'png', 'webp'], help="出力フォーマット")
+    bench.add_argument('--width', type=int, default=3840, help="テスト動画の横幅（高さは半分）")
+    bench.add_argument('--seconds', type=float, default=10, help="テスト動画の長さ（秒）")
+    bench.add_argument('--fps', type=int, default=30, help="テスト動画のフレームレート")
+    bench.add_argument('--work-dir', help="作業フォルダ（省略時は一時フォルダを使って最後に消す）")
+    bench.add_argument('-o', '--output', help="結果を保存する JSON ファイル")
+    bench.set_defaults(func=cmd_benchmark)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
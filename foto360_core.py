@@ -0,0 +1,830 @@
+"""全天球動画を複数方向の静止画に変換する処理本体（Tkinter に依存しない）
+
+GUI（360foto.py）と CLI（foto360_cli.py）の両方から使う。
+OpenCV / NumPy は起動を速くするため、実際に必要になるまで import しない。
+"""
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+
+import hw_detect
+from buffer_pool import BufferPool, plan_count
+from dedup import dedup_folder, pruned_names
+from job_manifest import JobManifest, entry_key, input_hash, is_complete_image
+from job_scheduler import default_cpu_workers, run_jobs, threads_per_job
+from output_layout import LAYOUTS, OutputLayout, update_index
+from proc_group import ProcessGroup, tail_lines
+from presets import load_presets, view_fov
+from run_report import REPORT_NAME, RateMeter, RunProfile
+from sampling import (AUTO_INTERVAL, AUTO_SEGMENT, choose_strategy, estimate_count, sample_timestamps,
+                      segment_length, select_expression, split_segments)
+from video_probe import probe_videos
+# write_xmp は従来どおり foto360_core からも使えるようにしておく
+from xmp_sidecar import parse_creation_time, write_xmp, write_xmp_sidecars
+
+DEFAULT_PRESET = "6_h3_45"
+
+# 出力サイズを元動画の幅から決めるモード（size の代わりに指定する）
+AUTO_SIZE = 'auto'
+
+# 再開時、欠けている画像がこの割合を超える方向は1枚ずつ作らず通しで作り直す
+REFILL_RATIO = 0.25
+
+# 出力方向のプリセット: 名前 -> (表示名, [(yaw, pitch, roll[, fov]), ...])
+# presets.json（同梱）と利用者のプリセットファイルから読み込む
+PRESETS = load_presets()
+
+
+def ensure_ffmpeg_on_path():
+    """Ensure ffmpeg is discoverable on PATH (especially for Windows user install)."""
+    if shutil.which('ffmpeg') is not None:
+        return
+    if platform.system() == 'Windows':
+        default_bin = os.path.join(os.environ.get('LOCALAPPDATA', ''), 'ffmpeg', 'bin')
+        if default_bin and os.path.isdir(default_bin):
+            os.environ['PATH'] = default_bin + os.pathsep + os.environ.get('PATH', '')
+
+
+def get_transforms(preset):
+    """プリセット名から (yaw, pitch, roll[, fov]) のリストを返す。未知の名前なら空リスト"""
+    if preset not in PRESETS:
+        return []
+    return list(PRESETS[preset][1])
+
+
+def estimate_total_frames(input_paths, interval, preset):
+    """書き出される画像の総数（全方向の合計）の見積もり（メタデータはキャッシュを使う）"""
+    num_directions = len(get_transforms(preset))
+    total_frames = 0
+    for info in probe_videos(input_paths).values():
+        if info:
+            total_frames += estimate_count(info['duration'], interval) * num_directions
+    return total_frames
+
+
+def auto_view_size(src_width, fov=90):
+    """視野の中心で元動画と同じ画素密度になる出力サイズ（16 の倍数）
+
+    正距円筒は横 src_width 画素で 360 度なので、1 ラジアンあたり src_width / 2π 画素。
+    透視投影の中心では1画素が 2·tan(fov/2) / size ラジアンにあたる。
+    """
+    size = src_width * math.tan(math.radians(fov) / 2) / math.pi
+    return max(16, int(round(size / 16)) * 16)
+
+
+def resolve_view_size(size, src_width, fov=90):
+    """size が 'auto' なら元動画の幅から決める"""
+    if size == AUTO_SIZE:
+        return auto_view_size(src_width, fov)
+    return int(size)
+
+
+def build_v360_options(transform, size, fov=90):
+    # プリセットで方向ごとに視野角が決まっていればそちらを使う
+    fov = view_fov(transform, fov)
+    return ':'.join([
+        'input=e', 'output=rectilinear',
+        f'h_fov={fov}', f'v_fov={fov}',
+        f'w={size}', f'h={size}',
+        f'yaw={transform[0]}',
+        f'pitch={transform[1]}',
+        f'roll={transform[2]}'
+    ])
+
+
+def build_codec_options(fmt, quality=95, png_level=3):
+    """ffmpeg で直接書き出すときの出力フォーマットごとのエンコード指定"""
+    if fmt == 'png':
+        return f'-c:v png -compression_level {png_level}'
+    if fmt == 'webp':
+        return f'-c:v libwebp -quality {quality}'
+    if fmt == 'jxl':
+        return '-c:v libjxl'
+    # mjpeg の qscale は 1（最高）〜31。品質 95 でおよそ 2 になる
+    return f'-c:v mjpeg -q:v {max(1, min(31, round(31 - quality * 0.3)))}'
+
+
+def build_split_command(input_path, transforms, output_file_paths, size, hwaccel,
+                        interval, strategy='select', seek_time=None, start_number=1, threads=None,
+                        fmt='jpg', quality=95, png_level=3, fov=90, duration=None, frames=None):
+    """1回のデコードから split で方向ごとに v360 を分岐し、方向数ぶんの出力を書き出すコマンド（引数のリスト）を組み立てる
+
+    シェルを通さずに起動するので、パスに空白や記号があっても引用符で囲む必要はない。
+    hwaccel は hw_detect のバックエンド名（'cuda' / 'qsv' / 'vaapi'）で、デコードだけを GPU で行う。
+    'cpu' か None なら CPU でデコードする。threads は CPU 実行時の1ジョブあたりのスレッド数。
+    strategy が 'seek' のときは seek_time の1フレームだけを start_number 番として書き出す。
+    それ以外は v360 の前で書き出し対象のフレームだけを残す（全フレームを再投影しない）。
+    seek_time を渡すと、そこから duration 秒の区間（最大 frames 枚）を start_number 番から書き出す。
+    """
+    if strategy == 'seek':
+        frame_options = ['-frames:v', '1', '-start_number', str(start_number)]
+        sampler = ''
+    else:
+        frame_options = ['-fps_mode', 'vfr']
+        if seek_time is not None:
+            frame_options += ['-start_number', str(start_number)] + (['-frames:v', str(frames)] if frames else [])
+        sampler = select_expression(interval) + ','
+
+    count = len(transforms)
+    codec_options = build_codec_options(fmt, quality, png_level).split()
+    graph = ['[0:v]{}split={}{}'.format(sampler, count, ''.join(f'[s{i}]' for i in range(count)))]
+    outputs = []
+    for i, transform in enumerate(transforms):
+        graph.append(f'[s{i}]v360={build_v360_options(transform, size, fov)}[v{i}]')
+        outputs += ['-map', f'[v{i}]', *codec_options, *frame_options, output_file_paths[i]]
+
+    input_options = ['-i', input_path]
+    if seek_time is not None:
+        if duration is not None and strategy != 'seek':
+            input_options = ['-t', str(duration), *input_options]
+        input_options = ['-ss', str(seek_time), *input_options]
+    if strategy == 'keyframe':
+        input_options = ['-skip_frame', 'nokey', *input_options]
+
+    if hwaccel and hwaccel != hw_detect.CPU:
+        # v360 は CPU のフィルタなので、デコードしたフレームは CPU 側に戻して渡す
+        input_options = [*hw_detect.hwaccel_args(hwaccel), *input_options]
+    elif threads:
+        # 並列実行時にジョブ同士でコアを取り合わないよう、スレッド数を割り当て分に抑える
+        input_options = ['-threads', str(threads), '-filter_threads', str(threads), *input_options]
+
+    # -progress pipe:1 で処理済みフレーム数を標準出力に流す（フォルダを数えずに進捗を取る）
+    return ['ffmpeg', '-progress', 'pipe:1', '-nostats', *input_options,
+            '-filter_complex', ';'.join(graph), *outputs]
+
+
+def watch_ffmpeg_progress(stream, on_frame, on_speed=None):
+    """ffmpeg の -progress 出力（key=value の行）を読み、frame が進むたびに on_frame(フレーム数) を呼ぶ
+
+    on_speed を渡すと speed=（再生速度に対する倍率）が出るたびに on_speed(倍率) を呼ぶ。
+    """
+    for line in stream:
+        key, _, value = line.strip().partition('=')
+        if key == 'frame':
+            try:
+                on_frame(int(value))
+            except ValueError:
+                pass
+        elif key == 'speed' and on_speed is not None:
+            try:
+                on_speed(float(value.rstrip('x')))
+            except ValueError:
+                pass  # 始まった直後は N/A
+
+
+def report_progress(report, processed_frames, total_frames, start_time, meter=None):
+    """進捗・予想終了時刻を report(種類, 値) で通知する（GUI の update_queue と同じ形式）
+
+    meter（run_report.RateMeter）を渡すと、直近の実測の速度から残り時間を見積もる。
+    """
+    if total_frames > 0:
+        progress = (processed_frames / total_frames) * 100
+    else:
+        progress = 0
+    report('progress', progress)
+    report('frames', processed_frames)
+
+    elapsed_time = time.time() - start_time
+    estimated_remaining_time = None
+    if meter is not None:
+        meter.update(processed_frames)
+        estimated_remaining_time = meter.remaining(processed_frames, total_frames)
+    elif processed_frames > 0 and total_frames > 0:
+        estimated_remaining_time = (elapsed_time / processed_frames) * total_frames - elapsed_time
+    if estimated_remaining_time is not None:
+        estimated_total_time = elapsed_time + estimated_remaining_time
+        estimated_completion_time = datetime.now() + timedelta(seconds=estimated_remaining_time)
+        report('estimated_time', estimated_completion_time.strftime("%Y-%m-%d %H:%M:%S"))
+        report('estimated_work_time', time.strftime("%H:%M:%S", time.gmtime(estimated_total_time)))
+
+
+def process_video(input_paths, output_path, preset=DEFAULT_PRESET, interval=1.5, size=1600, fov=90, fmt='jpg',
+                  xmp=False, engine='ffmpeg', split_decode=True, cpu_workers=None, gpu_workers=1,
+                  retries=1, resume=True, encoder='python', quality=95, png_level=3, encode_workers=None,
+                  report=None, should_stop=None, hooks=None, hwaccel='auto', dedup_distance=None, layout='flat',
+                  segment_seconds=None, memory_limit=None):
+    """動画をまとめて変換し、ジョブごとの結果（job_scheduler.run_jobs の戻り値）を返す
+
+    report(種類, 値) には 'total', 'progress', 'frames', 'estimated_time',
+    'estimated_work_time', 'resume', 'job', 'encode', 'summary' が渡される。should_stop() が True になると中断し、
+    この実行で起動した ffmpeg だけを（まず穏やかに、残れば強制的に）止める。
+    hooks（dict を受け取る関数のリスト、run_report.logging_hook / jsonl_hook など）には
+    ジョブごとのコマンド・終了コード・速度・書き出しバイト数と、最後に工程ごとの集計が渡される。
+    集計は出力フォルダの 360foto_run_report.json にも保存する。
+    resume が True なら出力フォルダのマニフェストを見て、済んでいる方向・フレームを飛ばす。
+    interval に AUTO_INTERVAL を渡すと、固定間隔の代わりに鮮明さと動きから書き出す時刻を選ぶ。
+    size は出力画像の一辺の画素数、fov は水平・垂直の視野角（度）。size に AUTO_SIZE を渡すと
+    元動画の幅から、拡大も間引きもしないサイズを動画ごとに決める。
+    encoder='python' ならビューをパイプで受け取り、EncodePool（encode_workers スレッド）で
+    エンコードする。encoder='ffmpeg' なら従来どおり ffmpeg が直接書き出す。
+    hwaccel='auto' なら hw_detect で調べた使えるデコード（cuda / qsv / vaapi）を動画ごとに選び、
+    'cpu' やバックエンド名を渡すとそれに固定する。GPU のジョブが失敗すると、そのジョブは CPU でやり直す。
+    dedup_distance を渡すと、変換後に dedup.dedup_folder でほぼ同じ画像を duplicates/ に移す（'dedup' を通知）。
+    取り除いた画像は再開時に作り直さない。
+    layout は出力のフォルダ構成（output_layout.LAYOUTS）。全画像の一覧を 360foto_index.json に書き出す。
+    segment_seconds を渡すと、長い動画をその秒数ごと（AUTO_SEGMENT なら並列数で等分）の区間に分けて
+    並列に処理する。区間の境目は書き出し時刻に置くので、番号・時刻・ファイル名・XMP は分けない場合と同じになる。
+    encoder='python' のフレームは buffer_pool.BufferPool で使い回し、memory_limit（バイト）を渡すと
+    同時に動くジョブで等分した範囲に収まる数だけ確保する（デコードはエンコードが追いつくまで待つ）。
+    入力の不備や ffmpeg が見つからない場合は ValueError / RuntimeError を送出する。
+    """
+    report = report or (lambda kind, value: None)
+    should_stop = should_stop or (lambda: False)
+    input_paths = [p for p in input_paths if p]
+    start_time = time.time()
+    profile = RunProfile(hooks)
+    meter = RateMeter()
+    # この実行で起動した ffmpeg（キャンセルではこれだけを止める）
+    processes = ProcessGroup()
+
+    if not input_paths or not output_path:
+        raise ValueError("入力ファイルと保存先フォルダを指定してください。")
+
+    transforms = get_transforms(preset)
+    if not transforms:
+        raise ValueError(f"不明な出力方向プリセットです: {preset}")
+    if hwaccel != 'auto' and hwaccel not in hw_detect.BACKENDS:
+        raise ValueError(f"不明なハードウェアデコードです: {hwaccel}")
+    if layout not in LAYOUTS:
+        raise ValueError(f"不明なフォルダ構成です: {layout}")
+
+    # ffmpeg の存在チェック（見つからない場合は案内して終了）
+    ensure_ffmpeg_on_path()
+    if engine == "ffmpeg" and shutil.which('ffmpeg') is None:
+        raise RuntimeError(
+            "ffmpeg が見つかりません。\nインストール済みであれば、環境変数 PATH に C:/Users/<ユーザー名>/AppData/Local/ffmpeg/bin を追加してから再実行してください。"
+        )
+
+    if encoder == 'python' or engine == 'opencv':
+        from image_encode import available_formats
+        if fmt not in available_formats():
+            raise ValueError(f"この環境では {fmt} 形式で書き出せません（対応: {', '.join(available_formats())}）")
+
+    os.makedirs(output_path, exist_ok=True)
+    manifest = JobManifest(output_path)
+    # 重複として取り除いた画像は「欠けている」扱いにしない
+    pruned = pruned_names(output_path) if resume else set()
+
+    # 動画情報は1本につき1回だけ調べる（キャッシュ済みなら再利用）
+    with profile.timed('probe'):
+        video_info = probe_videos(input_paths)
+
+    def frame_time(times, number):
+        # n 枚目の時刻（select が1枚多く出した場合などは interval 区間の先頭とみなす）
+        if number <= len(times):
+            return times[number - 1]
+        return round((number - 1) * interval, 6)
+
+    def video_backend(info):
+        if hwaccel != 'auto':
+            return hwaccel
+        with profile.timed('hw_probe'):
+            return hw_detect.choose_backend(info.get('codec'), info['width'])
+
+    def set_job_backend(job, backend):
+        gpu = backend != hw_detect.CPU
+        job.update(kind='gpu' if gpu else 'cpu', hwaccel=backend,
+                   threads=None if gpu else threads_per_job(cpu_workers or default_cpu_workers()))
+
+    # （動画, 方向グループ）ごとのジョブを先にすべて組み立てる
+    jobs = []
+    videos = []  # (入力, 入力ID, OutputLayout, 方向ごとのマニフェストのキー, 書き出し予定の枚数)
+    pending = {}       # マニフェストのキー -> まだ書き出していない番号（番号指定のジョブ用）
+    frame_totals = {}  # マニフェストのキー -> 完了時の枚数（番号指定のジョブ用）
+    total_frames = 0
+    for input_path in input_paths:
+        info = video_info.get(input_path)
+        if info is None:
+            raise ValueError(f"動画を開けません: {input_path}")
+
+        # 書き出し時刻と、その取り出し方を決める
+        if interval == AUTO_INTERVAL:
+            # 自動モード：鮮明さと動きから選んだ時刻へ1枚ずつシークする
+            from adaptive_sampling import adaptive_timestamps
+            with profile.timed('sample'):
+                timestamps = adaptive_timestamps(input_path, info, processes=processes)
+            strategy = 'seek'
+        else:
+            timestamps = sample_timestamps(info['duration'], interval)
+            # GOP 構造から書き出し時刻の取り出し方を決める
+            strategy = choose_strategy(interval, info['keyframe_interval'], info.get('keyframe_max_interval'))
+        expected = len(timestamps)
+        plan_start = time.perf_counter()
+        input_id = input_hash(input_path)
+        # 'auto' のサイズは方向ごとの視野角から決める（視野角の違う方向は大きさも違う）
+        view_sizes = [resolve_view_size(size, info['width'], view_fov(transform, fov)) for transform in transforms]
+        keys = [entry_key(input_id, index, transform, interval, view_sizes[index], fmt, view_fov(transform, fov))
+                for index, transform in enumerate(transforms)]
+        # ファイル名は入力 ID と時刻を含むので、名前の似た動画どうしでも衝突しない
+        output = OutputLayout(output_path, input_path, input_id, fmt, layout,
+                              lambda number, times=timestamps: frame_time(times, number))
+        output.makedirs(range(len(transforms)))
+        videos.append((input_path, input_id, output, keys, expected))
+
+        # 方向ごとに「全部作る」「欠けた番号だけ作る」「何もしない」を決める
+        full = []
+        refill = {}  # 番号 -> その番号が欠けている方向
+        started = {}
+        for index, key in enumerate(keys):
+            entry = manifest.get(key) if resume else None
+            if entry is None:
+                full.append(index)
+                continue
+            count = entry['frames'] if entry.get('complete') else expected
+            missing = [n for n in range(1, count + 1)
+                       if not is_complete_image(output.path(index, n)) and output.relpath(index, n) not in pruned]
+            if not missing:
+                if not entry.get('complete'):
+                    started[key] = dict(entry, frames=count, complete=True)
+            elif len(missing) > count * REFILL_RATIO:
+                full.append(index)
+            else:
+                frame_totals[key] = count
+                for number in missing:
+                    refill.setdefault(number, []).append(index)
+
+        # 書き出し開始を記録しておく（中断しても次回はここから再開できる）
+        for index in full:
+            started[keys[index]] = {'input': input_path, 'direction': index, 'frames': 0, 'complete': False}
+        if started:
+            manifest.update(started)
+        profile.add('plan', time.perf_counter() - plan_start)
+
+        refill_count = sum(len(indices) for indices in refill.values())
+        if resume and len(full) < len(transforms):
+            report('resume', {'input': input_path,
+                              'skipped_directions': len(transforms) - len(full) - len({i for v in refill.values() for i in v}),
+                              'refill_frames': refill_count})
+        total_frames += expected * len(full) + refill_count
+
+        # 作業の単位: (方向のリスト, 番号のリスト)。番号が None なら先頭から順に全部書き出す
+        # 区間に分ける場合は (方向のリスト, 番号のリスト, (区間の開始時刻, 終了時刻)) にする
+        work = []
+        segments = []
+        if full and segment_seconds is not None and strategy != 'seek':
+            gpu = engine == 'ffmpeg' and video_backend(info) != hw_detect.CPU
+            workers = gpu_workers if gpu else cpu_workers or default_cpu_workers()
+            segments = split_segments(expected, interval, segment_length(info['duration'], workers, segment_seconds),
+                                      info.get('keyframe_interval'))
+        def by_size(indices, sizes=view_sizes):
+            """同じ出力サイズの方向ごとに分ける（1つのジョブのビューは同じ大きさで横に並べるため）"""
+            groups = {}
+            for index in indices:
+                groups.setdefault(sizes[index], []).append(index)
+            return list(groups.values())
+
+        if full:
+            if split_decode or engine == "opencv":
+                # 一括デコード：1回のデコードを split で全方向に分岐
+                groups = by_size(full)
+            else:
+                # 方向ごとに ffmpeg を実行（従来方式）
+                groups = [[index] for index in full]
+            for indices in groups:
+                if segments:
+                    for first, last in segments:
+                        # 最後の区間は動画の終わりまで（一括の場合と同じく、見積もりより多く出ても書き出す）
+                        end = round(last * interval, 6) if last < expected else None
+                        work.append((indices, list(range(first, last + 1)), (round((first - 1) * interval, 6), end)))
+                else:
+                    work.append((indices, list(range(1, expected + 1)) if strategy == 'seek' else None, None))
+                for index in indices:
+                    if strategy == 'seek' or segments:
+                        frame_totals[keys[index]] = expected
+        by_indices = {}
+        for number, indices in sorted(refill.items()):
+            by_indices.setdefault(tuple(indices), []).append(number)
+        for indices, numbers in by_indices.items():
+            for group in by_size(indices):
+                work.append((group, numbers, None))
+
+        for indices, numbers, segment in work:
+            for index in indices:
+                if numbers is not None:
+                    pending.setdefault(keys[index], set()).update(numbers)
+            job = {
+                'kind': 'cpu',
+                'engine': engine,
+                'input_path': input_path,
+                'creation_time': info.get('creation_time'),
+                'indices': indices,
+                'keys': keys,
+                'output': output,
+                'numbers': numbers,
+                'segment': segment,
+                'source_size': (info['width'], info['height']),
+                'timestamps': timestamps,
+                'size': view_sizes[indices[0]],
+            }
+
+            if engine == "opencv":
+                # NumPy/OpenCV エンジン：ffmpeg を使わずプロセス内で再投影
+                jobs.append(job)
+                continue
+
+            # 使えるハードウェアデコードを動画ごとに選ぶ（H.264 の NVDEC は幅 4096 までなど）
+            backend = video_backend(info)
+            job.update(strategy=strategy)
+            set_job_backend(job, backend)
+            if numbers is None or segment is not None:
+                jobs.append(job)
+                continue
+            if encoder == 'ffmpeg':
+                # 番号指定：ffmpeg に直接書き出させる場合は1枚ずつ入力側シークで書き出す
+                for number in numbers:
+                    jobs.append(dict(job, numbers=[number], strategy='seek'))
+                continue
+            # 番号指定：並列に動く数だけのまとまりに分け、まとまりごとに1つのバッファで順にシークする
+            # （1枚ずつのジョブにすると、フレームごとにバッファを確保し直すことになる）
+            workers = gpu_workers if backend != hw_detect.CPU else cpu_workers or default_cpu_workers()
+            chunks = max(1, min(len(numbers), workers))
+            for i in range(chunks):
+                chunk = numbers[len(numbers) * i // chunks:len(numbers) * (i + 1) // chunks]
+                jobs.append(dict(job, numbers=chunk, strategy='seek'))
+
+    report('total', total_frames)
+
+    # ジョブごとの書き出し枚数。更新のたびに合計を report で通知する
+    job_frames = {}
+    frames_lock = Lock()
+    pending_lock = Lock()
+
+    def set_job_frames(job, count):
+        with frames_lock:
+            job_frames[id(job)] = count
+            processed_frames = sum(job_frames.values())
+            report_progress(report, processed_frames, total_frames, start_time, meter)
+
+    def job_numbers(job, written):
+        if job['segment'] is not None:
+            # 最後の区間は見積もりより多く書き出すことがある
+            return list(range(job['numbers'][0], job['numbers'][0] + written))
+        if job['numbers'] is not None:
+            return job['numbers'][:written]
+        return list(range(1, written + 1))
+
+    def remove_job_temps(job):
+        """失敗・中断したジョブが ffmpeg に書き出させた一時ファイル（_tmp_*）を消す
+
+        image2 は番号順に書き出すので、ジョブの先頭の番号からファイルがなくなるまで（区間なら区間の終わりまで）消す。
+        同じ方向を受け持つほかのジョブ（ほかの区間・番号）の一時ファイルには触れない。
+        """
+        numbers = job['numbers']
+        first = numbers[0] if numbers is not None else 1
+        last = numbers[-1] if numbers is not None and (job['segment'] is None or job['segment'][1] is not None) else None
+        for index in job['indices']:
+            pattern = job['output'].temp_pattern(index)
+            number = first
+            while last is None or number <= last:
+                try:
+                    os.remove(pattern % number)
+                except FileNotFoundError:
+                    break
+                except OSError as e:
+                    print(f"Warning: 一時ファイルを削除できませんでした: {e}")
+                number += 1
+
+    def write_job_sidecars(job, written):
+        """ジョブが書き出した全フレームに XMP を付ける"""
+        xmp_start = time.perf_counter()
+        numbers = job_numbers(job, written)
+        timestamps = [frame_time(job['timestamps'], n) for n in numbers]
+        start = parse_creation_time(job.get('creation_time'))
+        for index in job['indices']:
+            yaw, pitch, roll = transforms[index][:3]
+            try:
+                write_xmp_sidecars([job['output'].path(index, n) for n in numbers], yaw, pitch, roll,
+                                   timestamps=timestamps, start_time=start)
+            except Exception as e:
+                print(f"Error writing XMP: {e}")
+        profile.add('xmp', time.perf_counter() - xmp_start, len(numbers) * len(job['indices']))
+
+    def record_done(job, written):
+        """マニフェストに完了を記録する（番号指定のジョブは、その方向の番号がそろった時点で完了）"""
+        updates = {}
+        with pending_lock:
+            for index in job['indices']:
+                key = job['keys'][index]
+                entry = {'input': job['input_path'], 'direction': index, 'complete': True}
+                if job['numbers'] is None:
+                    updates[key] = dict(entry, frames=written)
+                    continue
+                remaining = pending[key]
+                if job['segment'] is not None and job['segment'][1] is None:
+                    # 最後の区間は動画の終わりまで書き出すので、実際の枚数で完了時の枚数を決め直す
+                    last = job['numbers'][0] + written - 1
+                    remaining.difference_update(range(last + 1, job['numbers'][-1] + 1))
+                    frame_totals[key] = last
+                remaining.difference_update(job_numbers(job, written))
+                if not remaining:
+                    updates[key] = dict(entry, frames=frame_totals[key])
+        if updates:
+            with profile.timed('manifest'):
+                manifest.update(updates)
+
+    def job_buffers(job):
+        """ジョブのフレームのバッファ（memory_limit があれば、同時に動くジョブで等分した範囲で確保する）"""
+        count = len(job['indices'])
+        size = job['size']
+        if job['engine'] == 'opencv':
+            # ビューごとに1つ。デコード中のフレームと参照テーブル（1画素 6 バイト）は別に固定で使う
+            shape, per_frame = (size, size, 3), count
+            width, height = job['source_size']
+            fixed = width * height * 3 + count * size * size * 6
+        else:
+            # ffmpeg が横に並べて流す全方向ぶんで1つ
+            shape, per_frame, fixed = (size, size * count, 3), 1, 0
+        buffers = BufferPool(shape, plan_count(shape[0] * shape[1] * 3, per_frame, job_budget, fixed))
+        if job_budget is not None and buffers.nbytes + fixed > job_budget and not memory_warned:
+            memory_warned.append(True)
+            print(f"Warning: メモリの上限では1フレームも扱えないため、1ジョブあたり "
+                  f"{(buffers.nbytes + fixed) / 2 ** 20:.0f}MB を使います（上限から割り当てたのは {job_budget / 2 ** 20:.0f}MB）")
+        return buffers
+
+    def encode_job(job, encode_pool, run):
+        """ビューをパイプ（またはプロセス内の再投影）で受け取り、エンコード段に渡す
+
+        フレームはジョブごとの BufferPool から借りた配列に書き込まれ、エンコードが終わると返される。
+        run にはコマンド・終了コード・速度・書き出しバイト数を記録する。
+        """
+        job_transforms = [transforms[i] for i in job['indices']]
+        numbers = job['numbers']
+        segment = job['segment']
+        buffers = job_buffers(job)
+        run['buffer_bytes'] = buffers.nbytes
+        if job['engine'] == 'opencv':
+            from equirect import iter_views
+            if segment is not None:
+                sources = [iter_views(job['input_path'], job_transforms, interval, job['size'], h_fov=fov, v_fov=fov,
+                                      should_stop=should_stop, profile=profile.add, start_time=segment[0],
+                                      end_time=segment[1], start_number=numbers[0], buffers=buffers)]
+            else:
+                sources = [iter_views(
+                    job['input_path'], job_transforms, interval, job['size'], h_fov=fov, v_fov=fov,
+                    should_stop=should_stop,
+                    timestamps=[frame_time(job['timestamps'], n) for n in numbers] if numbers is not None else None,
+                    frame_numbers=numbers, profile=profile.add, buffers=buffers)]
+        else:
+            from frame_stream import stream_views
+
+            def on_exit(command, returncode, error):
+                run.update(command=subprocess.list2cmdline(command), returncode=returncode)
+                if error:
+                    run['stderr'] = error[-2000:]
+
+            options = dict(hwaccel=job['hwaccel'], threads=job['threads'], fov=fov, should_stop=should_stop,
+                           on_exit=on_exit, processes=processes, buffers=buffers)
+            if numbers is None:
+                sources = [stream_views(job['input_path'], job_transforms, interval, job['size'],
+                                        strategy=job['strategy'], **options)]
+            elif segment is not None:
+                sources = [stream_views(job['input_path'], job_transforms, interval, job['size'],
+                                        strategy=job['strategy'], seek_time=segment[0], start_number=numbers[0],
+                                        **segment_options(job), **options)]
+            else:
+                sources = (stream_views(job['input_path'], job_transforms, interval, job['size'], strategy='seek',
+                                        seek_time=frame_time(job['timestamps'], n), start_number=n, **options)
+                           for n in numbers)
+
+        # ffmpeg の場合、フレームを待つ時間がデコード＋v360 の時間（OpenCV は iter_views の中で計る）
+        wait_stage = 'ffmpeg' if job['engine'] == 'ffmpeg' else None
+        futures = []
+        written = 0
+        last_time = 0.0
+        start = time.perf_counter()
+        for frames in sources:
+            frames = iter(frames)
+            while True:
+                wait_start = time.perf_counter()
+                waited = buffers.waited
+                item = next(frames, None)
+                # 空きバッファを待った時間（エンコードが追いつかない）は背圧として分けて数える
+                waited = buffers.waited - waited
+                profile.add('backpressure', waited, 0)
+                if wait_stage:
+                    profile.add(wait_stage, time.perf_counter() - wait_start - waited, 1 if item else 0)
+                if item is None:
+                    break
+                number, last_time, views = item
+                submit_start = time.perf_counter()
+                for view, index in zip(views, job['indices']):
+                    futures.append(encode_pool.submit(job['output'].path(index, number), view, buffers.release))
+                # エンコードが追いつかずに待たされた時間
+                profile.add('backpressure', time.perf_counter() - submit_start, 0)
+                written += 1
+                set_job_frames(job, written * len(job['indices']))
+        # 書き込みがすべて終わるまで完了にしない（エンコードの失敗はジョブの失敗として再試行する）
+        run['bytes'] = sum(future.result() for future in futures)
+        elapsed = time.perf_counter() - start
+        if job['engine'] == 'ffmpeg' and (numbers is None or segment is not None) and elapsed > 0:
+            # 動画の何秒ぶんを何秒で処理したか（ffmpeg の speed= と同じ意味）
+            run['speed'] = round((last_time - (segment[0] if segment else 0.0)) / elapsed, 2)
+        return written
+
+    def segment_options(job):
+        """区間の長さと枚数（最後の区間は動画の終わりまで書き出すので制限しない）"""
+        start, end = job['segment']
+        if end is None:
+            return {'duration': None, 'frames': None}
+        return {'duration': round(end - start, 6), 'frames': len(job['numbers'])}
+
+    def split_command(job):
+        """encoder='ffmpeg' のとき、ffmpeg に直接書き出させるコマンド（フォールバックで組み直せるよう実行時に作る）"""
+        job_transforms = [transforms[i] for i in job['indices']]
+        job_paths = [job['output'].temp_pattern(i) for i in job['indices']]
+        if job['strategy'] == 'seek':
+            number = job['numbers'][0]
+            return build_split_command(job['input_path'], job_transforms, job_paths, job['size'], job['hwaccel'],
+                                       interval, 'seek', frame_time(job['timestamps'], number), number, job['threads'],
+                                       fmt, quality, png_level, fov)
+        if job['segment'] is not None:
+            return build_split_command(job['input_path'], job_transforms, job_paths, job['size'], job['hwaccel'],
+                                       interval, job['strategy'], job['segment'][0], job['numbers'][0], job['threads'],
+                                       fmt, quality, png_level, fov, **segment_options(job))
+        return build_split_command(job['input_path'], job_transforms, job_paths, job['size'], job['hwaccel'],
+                                   interval, job['strategy'], threads=job['threads'],
+                                   fmt=fmt, quality=quality, png_level=png_level, fov=fov)
+
+    run_info = {}  # id(job) -> 最後の実行の記録
+
+    def run_job(job):
+        backend = job.get('hwaccel', hw_detect.CPU)
+        if backend != hw_detect.CPU and not hw_detect.supports(backend):
+            # ほかのジョブで失敗して使わないことにしたバックエンド
+            set_job_backend(job, hw_detect.CPU)
+            backend = hw_detect.CPU
+        try:
+            if run_job_once(job):
+                return True
+            error = run_info[id(job)].get('stderr')
+        except Exception as e:
+            if backend == hw_detect.CPU:
+                raise
+            error = str(e)
+        if backend == hw_detect.CPU or should_stop():
+            return False
+
+        # GPU で失敗したジョブは CPU でやり直す。CPU なら通るなら、そのバックエンドは以後使わない
+        print(f"Warning: {backend} でのデコードに失敗したため CPU でやり直します: {job['input_path']}: {error}")
+        set_job_backend(job, hw_detect.CPU)
+        if not run_job_once(job):
+            return False
+        hw_detect.mark_failed(backend)
+        run_info[id(job)]['fallback_from'] = backend
+        return True
+
+    def run_job_once(job):
+        set_job_frames(job, 0)  # 再試行時は数え直す
+        run = run_info[id(job)] = {'started': time.time()}
+        if encoder == 'python' or job['engine'] == 'opencv':
+            written = encode_job(job, encode_pool, run)
+        else:
+            command = split_command(job)
+            run['command'] = subprocess.list2cmdline(command)
+            start = time.perf_counter()
+            renamed = False
+            try:
+                process = processes.popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                          errors='replace')
+                # 標準エラーは別スレッドで読み続け、失敗したときのために末尾だけ残す
+                stderr_reader, stderr_tail = tail_lines(process.stderr)
+                frames = [0]
+
+                def on_frame(count):
+                    frames[0] = count
+                    # split の出力はどれも同じフレーム数なので、方向数を掛けて画像枚数にする
+                    set_job_frames(job, count * len(job['indices']))
+
+                watch_ffmpeg_progress(process.stdout, on_frame, lambda speed: run.update(speed=speed))
+                run['returncode'] = process.wait()
+                processes.release(process)
+                stderr_reader.join(5)
+                if run['returncode'] != 0 and stderr_tail:
+                    run['stderr'] = '\n'.join(stderr_tail)[-2000:]
+                written = frames[0]
+                profile.add('ffmpeg', time.perf_counter() - start, written)
+                if run['returncode'] != 0:
+                    return False
+                # image2 は番号しか付けられないので、時刻入りの名前に改名する
+                run['bytes'] = 0
+                for index in job['indices']:
+                    for number in job_numbers(job, written):
+                        path = job['output'].path(index, number)
+                        os.replace(job['output'].temp_pattern(index) % number, path)
+                        run['bytes'] += os.path.getsize(path)
+                renamed = True
+            finally:
+                if not renamed:
+                    # 失敗・中断したジョブの一時ファイルを出力フォルダに残さない
+                    remove_job_temps(job)
+        run['frames'] = written
+
+        # 中断されたジョブや1枚も書き出せなかったジョブは完了扱いにしない
+        if should_stop() or written == 0:
+            return False
+
+        # Optional XMP write if enabled
+        if xmp:
+            write_job_sidecars(job, written)
+        record_done(job, written)
+        return True
+
+    def on_finished(result):
+        job = result['job']
+        run = run_info.get(id(job), {})
+        profile.add_job({
+            'input': job['input_path'],
+            'directions': job['indices'],
+            'numbers': job['numbers'],
+            'segment': job['segment'],
+            'engine': job['engine'],
+            'kind': job['kind'],
+            'hwaccel': job.get('hwaccel'),
+            'fallback_from': run.get('fallback_from'),
+            'command': run.get('command'),
+            'returncode': run.get('returncode'),
+            'speed': run.get('speed'),
+            'seconds': round(time.time() - run['started'], 3) if 'started' in run else None,
+            'frames': run.get('frames', 0),
+            'images': run.get('frames', 0) * len(job['indices']),
+            'bytes': run.get('bytes', 0),
+            'buffer_bytes': run.get('buffer_bytes'),
+            'ok': result['ok'],
+            'attempts': result['attempts'],
+            'error': result['error'] or run.get('stderr'),
+        })
+        report('job', {
+            'input': job['input_path'],
+            'directions': job['indices'],
+            'ok': result['ok'],
+            'attempts': result['attempts'],
+            'error': result['error'],
+        })
+
+    def write_output_index():
+        """全画像の相対パス・方向・番号・時刻を 360foto_index.json にまとめる（dedup で除いた画像は含めない）"""
+        removed = pruned_names(output_path)
+        records = {}
+        for input_path, input_id, output, keys, expected in videos:
+            frames = []
+            for index, key in enumerate(keys):
+                entry = manifest.get(key) or {}
+                count = entry['frames'] if entry.get('complete') else expected
+                for number in range(1, count + 1):
+                    relpath = output.relpath(index, number)
+                    if relpath not in removed and os.path.exists(output.path(index, number)):
+                        frames.append([relpath.replace(os.sep, '/'), index, number, output.time_of(number)])
+            records[input_id] = {
+                'input': input_path,
+                'layout': layout,
+                'views': [list(t[:3]) + [view_fov(t, fov)] for t in transforms],
+                'frames': frames,
+            }
+        try:
+            update_index(output_path, records)
+        except OSError as e:
+            print(f"Warning: 画像の一覧を保存できませんでした: {e}")
+
+    # フレームのバッファに使える1ジョブあたりのバイト数（同時に動くジョブの数で上限を等分する）
+    job_budget = None
+    memory_warned = []
+    if memory_limit is not None and jobs:
+        gpu_jobs = any(job['kind'] == 'gpu' for job in jobs)
+        concurrency = min(len(jobs), (cpu_workers or default_cpu_workers()) + (gpu_workers if gpu_jobs else 0))
+        job_budget = memory_limit / concurrency
+
+    from image_encode import EncodePool
+
+    encode_pool = EncodePool(fmt, quality, png_level, max_workers=encode_workers, profile=profile.add)
+    stop_watching = processes.watch(should_stop)
+    try:
+        results = run_jobs(jobs, run_job, cpu_workers=cpu_workers, gpu_workers=gpu_workers, retries=retries,
+                           should_stop=should_stop, on_finished=on_finished)
+        if dedup_distance is not None and not should_stop():
+            with profile.timed('dedup'):
+                report('dedup', dedup_folder(output_path, dedup_distance, report=report, should_stop=should_stop))
+        with profile.timed('index'):
+            write_output_index()
+        return results
+    finally:
+        stop_watching()
+        # 例外で抜けた場合などに残った ffmpeg を止める
+        processes.terminate(grace=1.0)
+        encode_pool.close()
+        stats = encode_pool.stats()
+        if stats['frames']:
+            report('encode', stats)
+        summary = profile.summary()
+        profile.emit('summary', **summary)
+        report('summary', {key: value for key, value in summary.items() if key != 'jobs'})
+        try:
+            with open(os.path.join(output_path, REPORT_NAME), 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=1)
+        except OSError as e:
+            print(f"Warning: 実行レポートを保存できませんでした: {e}")
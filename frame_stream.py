@@ -0,0 +1,152 @@
+"""変換したビューをファイルに書かず、パイプ経由で Python に渡すストリーミング出力
+
+ffmpeg の各方向の v360 出力を hstack で横に並べ、rawvideo（bgr24）として標準出力に流す。
+stream_views() はそれを1フレームずつ切り分け、(番号, 時刻, [方向ごとのビュー]) を返す
+ジェネレータ。エンコード・フィルタ・アップロードなどは中間ファイルなしで行える
+（画像として書き出す場合は image_encode.EncodePool に渡す）。
+"""
+import shutil
+import subprocess
+
+import numpy as np
+
+from foto360_core import build_v360_options
+from hw_detect import hwaccel_args
+from proc_group import popen, tail_lines
+from sampling import choose_strategy, select_expression
+
+# パイプの読み込みバッファ。1フレームより小さくしておくと、readinto() が内部のバッファを経由せず
+# 渡した配列に直接読み込む（フレームと同じ大きさの隠れたコピーを持たない）
+PIPE_BUFSIZE = 1 << 20
+
+
+def build_stream_command(input_path, transforms, size, interval, strategy='select', hwaccel=None, threads=None,
+                         seek_time=None, fov=90, duration=None, frames=None):
+    """全方向のビューを横に並べた rawvideo（bgr24）を標準出力に流す ffmpeg の引数リストを返す
+
+    strategy が 'seek' のときは seek_time の1フレームだけを流す。
+    それ以外で seek_time を渡すと、そこから duration 秒の区間（最大 frames 枚）だけを流す
+    （seek_time は interval の倍数にする。区間の先頭から select するので、一括の場合と同じフレームになる）。
+    hwaccel は hw_detect のバックエンド名（'cuda' / 'qsv' / 'vaapi'）。None か 'cpu' なら CPU でデコードする。
+    """
+    count = len(transforms)
+    sampler = '' if strategy == 'seek' else select_expression(interval) + ','
+    graph = ['[0:v]{}split={}{}'.format(sampler, count, ''.join(f'[s{i}]' for i in range(count)))]
+    for i, transform in enumerate(transforms):
+        graph.append(f'[s{i}]v360={build_v360_options(transform, size, fov)}[v{i}]')
+    if count > 1:
+        graph.append('{}hstack=inputs={},format=bgr24[out]'.format(''.join(f'[v{i}]' for i in range(count)), count))
+    else:
+        graph.append('[v0]format=bgr24[out]')
+
+    command = ['ffmpeg', '-v', 'error', '-nostdin']
+    if hwaccel and hwaccel != 'cpu':
+        # デコードだけ GPU で行い、v360 は CPU で処理する
+        command += hwaccel_args(hwaccel)
+    elif threads:
+        command += ['-threads', str(threads), '-filter_threads', str(threads)]
+    if strategy == 'keyframe':
+        command += ['-skip_frame', 'nokey']
+    if seek_time is not None:
+        command += ['-ss', str(seek_time)]
+        if duration is not None and strategy != 'seek':
+            command += ['-t', str(duration)]
+    command += ['-i', input_path, '-filter_complex', ';'.join(graph), '-map', '[out]']
+    if strategy == 'seek':
+        command += ['-frames:v', '1']
+    else:
+        command += ['-fps_mode', 'vfr'] + (['-frames:v', str(frames)] if frames else [])
+    command += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+    return command
+
+
+def _stream_ffmpeg(input_path, transforms, interval, size, strategy, hwaccel, threads, should_stop,
+                   seek_time, start_number, fov, on_exit, processes, duration, frames, buffers):
+    if shutil.which('ffmpeg') is None:
+        raise RuntimeError("ffmpeg が見つかりません。")
+
+    count = len(transforms)
+    frame_bytes = size * size * 3 * count
+    command = build_stream_command(input_path, transforms, size, interval, strategy, hwaccel, threads, seek_time, fov,
+                                   duration, frames)
+    process = popen(command, processes, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=PIPE_BUFSIZE)
+    # 警告の多い動画でも標準エラーのパイプが詰まらないよう、別スレッドで読み続ける
+    stderr_reader, stderr_tail = tail_lines(process.stderr)
+    number = start_number - 1
+    try:
+        while True:
+            if should_stop is not None and should_stop():
+                break
+            if buffers is None:
+                data = process.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                strip = np.frombuffer(data, np.uint8).reshape(size, size * count, 3)
+            else:
+                # 借りた配列にパイプから直接読み込む（方向ごとのビューがすべて返されると空きに戻る）
+                strip = buffers.acquire(parts=count, should_stop=should_stop)
+                if strip is None:
+                    break
+                if process.stdout.readinto(memoryview(strip).cast('B')) < frame_bytes:
+                    buffers.release(strip, parts=count)
+                    break
+            number += 1
+            if strategy == 'seek':
+                t = seek_time
+            else:
+                # select は各区間の先頭フレームを残すので、時刻は区間の開始で代表する
+                t = round((number - 1) * interval, 6)
+            yield number, t, [strip[:, i * size:(i + 1) * size] for i in range(count)]
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+        stderr_reader.join(5)
+        error = '\n'.join(stderr_tail).strip()
+        if processes is not None:
+            processes.release(process)
+        if on_exit is not None:
+            on_exit(command, returncode, error)
+    if returncode != 0 and not (should_stop is not None and should_stop()):
+        raise RuntimeError(f"ffmpeg が失敗しました（終了コード {returncode}）: {error}")
+
+
+def stream_views(input_path, transforms, interval, size, engine='ffmpeg', hwaccel=None,
+                 keyframe_interval=None, threads=None, should_stop=None, strategy=None,
+                 seek_time=None, start_number=1, fov=90, on_exit=None, profile=None, processes=None,
+                 duration=None, frames=None, buffers=None, keyframe_max_interval=None):
+    """(番号, 時刻, [方向ごとのビュー]) を1フレームずつ返すジェネレータ
+
+    ビューは BGR の ndarray（size x size, 読み取り専用）。engine='opencv' なら
+    ffmpeg を使わずプロセス内で再投影する。途中で close() すれば ffmpeg も止まる。
+    strategy='seek' と seek_time を渡すと、その時刻の1フレームを start_number 番として返す。
+    ほかの strategy で seek_time を渡すと、そこから duration 秒（最大 frames 枚）の区間を
+    start_number 番から返す（sampling.split_segments の区間。番号と時刻は一括の場合と同じ）。
+    fov は水平・垂直の視野角（度）。ffmpeg が終わると on_exit(引数リスト, 終了コード, エラー出力) を呼ぶ。
+    profile(工程, 秒) は OpenCV エンジンの 'decode' / 'reproject' の計測に使う。
+    processes（proc_group.ProcessGroup）を渡すと、ffmpeg をそこに登録して起動する（キャンセルで止められる）。
+    buffers（buffer_pool.BufferPool）を渡すと、フレームはそこから借りた配列に読み込む。ffmpeg なら形は
+    (size, size * 方向数, 3) で、方向ごとのビューはその切り出し。OpenCV エンジンなら形は (size, size, 3) で
+    ビューごとに1つ。受け取った側はビューを使い終わったら buffers.release(ビュー) で返すこと。
+    strategy を省くと keyframe_interval と keyframe_max_interval（video_probe の値）から選ぶ。
+    """
+    if engine == 'opencv':
+        from equirect import iter_views
+        if strategy == 'seek':
+            return iter_views(input_path, transforms, interval, size, fov, fov, should_stop=should_stop,
+                              timestamps=[seek_time], frame_numbers=[start_number], profile=profile, buffers=buffers)
+        if seek_time is not None:
+            return iter_views(input_path, transforms, interval, size, fov, fov, should_stop=should_stop, profile=profile,
+                              start_time=seek_time, end_time=None if duration is None else seek_time + duration,
+                              start_number=start_number, buffers=buffers)
+        return iter_views(input_path, transforms, interval, size, fov, fov, should_stop=should_stop, profile=profile,
+                          buffers=buffers)
+
+    if strategy is None:
+        strategy = choose_strategy(interval, keyframe_interval, keyframe_max_interval)
+        if strategy == 'seek':
+            # 連続して流すので、1枚ずつのシークより1回のデコードのほうが安い
+            strategy = 'select'
+    return _stream_ffmpeg(input_path, transforms, interval, size, strategy, hwaccel, threads, should_stop,
+                          seek_time, start_number, fov, on_exit, processes, duration, frames, buffers)
@@ -0,0 +1,182 @@
+"""ハードウェアデコードの対応状況の検出と、使うパイプラインの選択
+
+ffmpeg の -hwaccels / -filters / -decoders と、小さなテスト動画を実際に
+デコード＋v360 する試運転で、使えるバックエンド（cuda / qsv / vaapi / cpu）を調べる。
+結果はセッション中1回だけ調べてキャッシュする。
+
+GPU のない環境で動作を確かめるときは、環境変数 FOTO360_HW_PROBE に
+probe_capabilities() と同じ形の JSON ファイルを指定すると、ffmpeg を呼ばずにその内容を使う。
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from threading import Lock
+
+CPU = 'cpu'
+
+# 速い順。使えるもののうち先頭を選ぶ
+BACKENDS = ('cuda', 'qsv', 'vaapi', CPU)
+
+# デコーダが扱える最大の幅（NVDEC / QSV / VA-API の H.264 は 4096、HEVC・AV1 などは 8192）
+MAX_WIDTH = {'h264': 4096}
+DEFAULT_MAX_WIDTH = 8192
+
+# バックエンドごとの専用デコーダ名の接尾辞（-decoders に載っていれば、その形式をデコードできるとみなす）
+_DECODER_SUFFIX = {'cuda': '_cuvid', 'qsv': '_qsv'}
+# VA-API は専用デコーダを持たないので、一般に対応している形式とする
+_VAAPI_CODECS = ('h264', 'hevc', 'vp9', 'av1', 'mpeg2video')
+
+_VAAPI_DEVICE = '/dev/dri/renderD128'
+
+_capabilities = None
+_failed = set()
+_lock = Lock()
+
+
+def hwaccel_args(backend):
+    """ffmpeg の入力オプション（デコードだけを GPU で行い、フレームは CPU 側に戻して v360 にかける）"""
+    if backend == 'cuda':
+        return ['-hwaccel', 'cuda']
+    if backend == 'qsv':
+        return ['-hwaccel', 'qsv']
+    if backend == 'vaapi':
+        return ['-hwaccel', 'vaapi', '-hwaccel_device', _VAAPI_DEVICE]
+    return []
+
+
+def _run(command, timeout=30):
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, errors='replace', timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result
+
+
+def _list_section(ffmpeg, option):
+    """ffmpeg -hwaccels / -filters / -decoders の名前の一覧"""
+    result = _run([ffmpeg, '-hide_banner', option])
+    if result is None or result.returncode != 0:
+        return []
+    names = []
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if not fields or fields[0].endswith(':') or set(fields[0]) <= set('-='):
+            continue
+        if option == '-hwaccels':
+            names.append(fields[0])
+        elif len(fields) >= 2 and not set(fields[0]) - set('.ADVSFTCXILB|'):
+            # "V....D h264  H.264 ..." / " T.. v360  V->V  ..." の形（先頭はフラグ列）
+            names.append(fields[1])
+    return names
+
+
+def _make_sample(ffmpeg, directory):
+    """試運転用の小さな正距円筒の動画（H.264、なければ MPEG-4）を作る"""
+    path = os.path.join(directory, 'probe.mp4')
+    for codec in ('libx264', 'mpeg4'):
+        result = _run([ffmpeg, '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=size=256x128:rate=10',
+                       '-t', '0.5', '-c:v', codec, '-pix_fmt', 'yuv420p', path])
+        if result is not None and result.returncode == 0 and os.path.exists(path):
+            return path
+    return None
+
+
+def _dry_run(ffmpeg, backend, sample):
+    """実際の変換と同じ形（GPU デコード → v360 → CPU）で数フレーム処理できるか。かかった秒数か None"""
+    command = [ffmpeg, '-v', 'error', '-nostdin'] + hwaccel_args(backend) + [
+        '-i', sample, '-vf', 'v360=input=e:output=rectilinear:w=64:h=64', '-frames:v', '3', '-f', 'null', '-']
+    start = time.perf_counter()
+    result = _run(command)
+    if result is None or result.returncode != 0:
+        return None
+    return round(time.perf_counter() - start, 3)
+
+
+def probe_capabilities(ffmpeg=None):
+    """ffmpeg を実際に呼んで対応状況を調べ、dict を返す（キャッシュしない）
+
+    {'ffmpeg': パス, 'hwaccels': [...], 'filters': [...], 'decoders': [...],
+     'working': {バックエンド: 試運転の秒数}, 'backend': 選んだバックエンド}
+    """
+    ffmpeg = ffmpeg or shutil.which('ffmpeg')
+    caps = {'ffmpeg': ffmpeg, 'hwaccels': [], 'filters': [], 'decoders': [], 'working': {}, 'backend': CPU}
+    if ffmpeg is None:
+        return caps
+    caps['hwaccels'] = _list_section(ffmpeg, '-hwaccels')
+    caps['filters'] = [name for name in _list_section(ffmpeg, '-filters') if name == 'v360']
+    decoders = _list_section(ffmpeg, '-decoders')
+    caps['decoders'] = [name for name in decoders if name.endswith(tuple(_DECODER_SUFFIX.values()))]
+
+    candidates = [b for b in BACKENDS if b == CPU or b in caps['hwaccels']]
+    if 'vaapi' in candidates and not os.path.exists(_VAAPI_DEVICE):
+        candidates.remove('vaapi')
+    with tempfile.TemporaryDirectory(prefix='360foto_hw_') as directory:
+        sample = _make_sample(ffmpeg, directory)
+        if sample is None:
+            return caps
+        for backend in candidates:
+            seconds = _dry_run(ffmpeg, backend, sample)
+            if seconds is not None:
+                caps['working'][backend] = seconds
+    caps['backend'] = next((b for b in BACKENDS if b in caps['working']), CPU)
+    return caps
+
+
+def _load_fake(path):
+    with open(path, encoding='utf-8') as f:
+        caps = json.load(f)
+    caps.setdefault('hwaccels', [])
+    caps.setdefault('filters', ['v360'])
+    caps.setdefault('decoders', [])
+    caps.setdefault('working', {})
+    caps.setdefault('backend', next((b for b in BACKENDS if b in caps['working']), CPU))
+    caps['fake'] = path
+    return caps
+
+
+def get_capabilities(refresh=False):
+    """セッション中1回だけ調べた対応状況を返す（FOTO360_HW_PROBE があればその内容）"""
+    global _capabilities
+    with _lock:
+        if _capabilities is None or refresh:
+            fake = os.environ.get('FOTO360_HW_PROBE')
+            _capabilities = _load_fake(fake) if fake else probe_capabilities()
+            _failed.clear()
+        return _capabilities
+
+
+def mark_failed(backend):
+    """実行中に失敗したバックエンドを、このセッションでは以後使わない"""
+    if backend != CPU:
+        with _lock:
+            _failed.add(backend)
+
+
+def supports(backend, codec=None, width=0, caps=None):
+    """backend で codec・幅 width の動画をデコードできるか"""
+    if backend == CPU:
+        return True
+    caps = caps or get_capabilities()
+    if backend in _failed or backend not in caps['working']:
+        return False
+    if width > MAX_WIDTH.get(codec, DEFAULT_MAX_WIDTH):
+        return False
+    if codec:
+        if backend == 'vaapi':
+            return codec in _VAAPI_CODECS
+        suffix = _DECODER_SUFFIX.get(backend)
+        # 専用デコーダの一覧が取れなかったとき（古い ffmpeg など）は試運転の結果を信じる
+        if suffix and any(name.endswith(suffix) for name in caps['decoders']):
+            return codec + suffix in caps['decoders']
+    return True
+
+
+def choose_backend(codec=None, width=0, caps=None):
+    """動画ごとに使うバックエンド（使える中で速い順の先頭、なければ 'cpu'）"""
+    caps = caps or get_capabilities()
+    preferred = caps.get('backend', CPU)
+    order = [preferred] + [b for b in BACKENDS if b != preferred]
+    return next(b for b in order if supports(b, codec, width, caps))
@@ -0,0 +1,126 @@
+"""再投影した画像のエンコードと書き込み（ffmpeg から切り離したエンコード段）
+
+cv2.imencode（JPEG は libjpeg-turbo）は GIL を解放するので、スレッドプールで
+全コアを使って並列にエンコードできる。PNG のように重い形式でも1スレッドに詰まらない。
+1枚ごとのエンコード時間を集計し、stats() で取り出せる。
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+import cv2
+
+FORMATS = ('jpg', 'png', 'webp', 'jxl')
+
+DEFAULT_QUALITY = 95
+DEFAULT_PNG_LEVEL = 3  # 0（無圧縮）〜9。3 前後が速度とサイズの釣り合いがよい
+
+
+def available_formats():
+    """この環境の OpenCV で書き出せる形式"""
+    return [fmt for fmt in FORMATS if cv2.haveImageWriter(f'x.{fmt}')]
+
+
+def encode_params(fmt, quality=DEFAULT_QUALITY, png_level=DEFAULT_PNG_LEVEL):
+    if fmt == 'jpg':
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if fmt == 'png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, png_level]
+    if fmt == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    if fmt == 'jxl' and hasattr(cv2, 'IMWRITE_JPEGXL_QUALITY'):
+        return [cv2.IMWRITE_JPEGXL_QUALITY, quality]
+    return []
+
+
+def encode_image(image, fmt, quality=DEFAULT_QUALITY, png_level=DEFAULT_PNG_LEVEL):
+    ok, buf = cv2.imencode(f'.{fmt}', image, encode_params(fmt, quality, png_level))
+    if not ok:
+        raise RuntimeError(f"画像のエンコードに失敗しました（{fmt}）")
+    return buf
+
+
+def save_image(path, image, fmt, quality=DEFAULT_QUALITY, png_level=DEFAULT_PNG_LEVEL):
+    """cv2.imwrite は Windows の日本語パスで失敗するため、エンコードしてから書き込む"""
+    buf = encode_image(image, fmt, quality, png_level)
+    with open(path, 'wb') as f:
+        f.write(buf)
+
+
+class EncodePool:
+    """画像のエンコードと書き込みをスレッドプールで行う
+
+    submit() は未処理の画像が max_pending 枚に達すると空くまで待つので、
+    デコード側が速すぎてもメモリを使い切らない。
+    profile(工程, 秒, 件数, バイト数) を渡すと 'encode' と 'write' の時間を1枚ごとに渡す。
+    """
+
+    def __init__(self, fmt, quality=DEFAULT_QUALITY, png_level=DEFAULT_PNG_LEVEL, max_workers=None, max_pending=None,
+                 profile=None):
+        self.fmt = fmt
+        self.profile = profile
+        self.quality = quality
+        self.png_level = png_level
+        max_workers = max_workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='encode')
+        self.slots = BoundedSemaphore(max_pending or max_workers * 4)
+        self.lock = Lock()
+        self.count = 0
+        self.encode_seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes_written = 0
+
+    def _encode(self, path, image, release):
+        try:
+            start = time.perf_counter()
+            buf = encode_image(image, self.fmt, self.quality, self.png_level)
+            elapsed = time.perf_counter() - start
+            with open(path, 'wb') as f:
+                f.write(buf)
+            if self.profile is not None:
+                self.profile('encode', elapsed)
+                self.profile('write', time.perf_counter() - start - elapsed, 1, len(buf))
+            with self.lock:
+                self.count += 1
+                self.encode_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+                self.bytes_written += len(buf)
+            return len(buf)
+        finally:
+            if release is not None:
+                release(image)
+            self.slots.release()
+
+    def submit(self, path, image, release=None):
+        """書き込みを予約して Future（結果は書き込んだバイト数）を返す
+
+        image はエンコードが終わるまで書き換えないこと。release を渡すと、エンコードが終わった
+        （または失敗した）後に release(image) を呼ぶ（buffer_pool.BufferPool へ返すため）。
+        """
+        self.slots.acquire()
+        try:
+            return self.executor.submit(self._encode, path, image, release)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def stats(self):
+        """{'frames', 'encode_seconds', 'mean_ms', 'max_ms', 'bytes'} を返す"""
+        with self.lock:
+            return {
+                'frames': self.count,
+                'encode_seconds': round(self.encode_seconds, 3),
+                'mean_ms': round(self.encode_seconds / self.count * 1000, 2) if self.count else 0.0,
+                'max_ms': round(self.max_seconds * 1000, 2),
+                'bytes': self.bytes_written,
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,95 @@
+"""出力フォルダに置くジョブマニフェスト（中断・クラッシュ後の再開用）
+
+(入力のハッシュ, 方向, 間隔, サイズ, フォーマット) ごとに、書き出しが完了したか・
+何枚書き出したかを記録する。再実行時は完了済みの方向を飛ばし、
+欠けている／途中で切れている画像だけを作り直す。
+"""
+import hashlib
+import json
+import os
+from threading import Lock
+
+MANIFEST_NAME = '360foto_manifest.json'
+MANIFEST_VERSION = 1
+
+# 画像の末尾にあるはずのマーカー（途中で書き込みが止まったファイルを見分ける）
+_TRAILERS = {
+    '.jpg': b'\xff\xd9',
+    '.jpeg': b'\xff\xd9',
+    '.png': b'IEND\xaeB`\x82',
+}
+
+
+def input_hash(path, chunk_size=1 << 20):
+    """動画の同一性を調べるための軽いハッシュ（サイズ＋先頭と末尾の 1MiB）"""
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(chunk_size))
+        if size > chunk_size:
+            f.seek(max(chunk_size, size - chunk_size))
+            h.update(f.read(chunk_size))
+    return h.hexdigest()[:16]
+
+
+def entry_key(input_id, index, transform, interval, size, fmt, fov=90):
+    yaw, pitch, roll = transform[:3]
+    key = f'{input_id}|d{index}:{yaw},{pitch},{roll}|i{interval}|s{size}|{fmt}'
+    # 視野角は既定（90 度）以外のときだけ付ける（既存のマニフェストのキーを変えないため）
+    return key if fov == 90 else f'{key}|f{fov}'
+
+
+def is_complete_image(path):
+    """画像が存在し、末尾まで書き込まれているか"""
+    try:
+        file_size = os.path.getsize(path)
+    except OSError:
+        return False
+    if file_size == 0:
+        return False
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.webp':
+        # RIFF ヘッダに書かれた長さとファイルサイズを比べる
+        with open(path, 'rb') as f:
+            header = f.read(8)
+        return len(header) == 8 and header[:4] == b'RIFF' and int.from_bytes(header[4:], 'little') + 8 == file_size
+    trailer = _TRAILERS.get(ext)
+    if trailer is None:
+        return True
+    with open(path, 'rb') as f:
+        f.seek(max(0, file_size - 16))
+        return trailer in f.read()
+
+
+class JobManifest:
+    """マニフェストの読み書き（ジョブのスレッドから同時に更新されてもよいようロックする）"""
+
+    def __init__(self, output_path):
+        self.path = os.path.join(output_path, MANIFEST_NAME)
+        self.lock = Lock()
+        self.entries = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data.get('entries', {})
+        except (OSError, ValueError):
+            pass
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return dict(entry) if entry else None
+
+    def update(self, updates):
+        """{キー: 内容} をまとめて反映して保存する"""
+        with self.lock:
+            for key, entry in updates.items():
+                self.entries[key] = entry
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
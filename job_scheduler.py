@@ -0,0 +1,56 @@
+"""（動画, 方向グループ）単位のジョブを CPU / GPU 別の並列数で実行するスケジューラ
+
+ジョブは 'kind'（'cpu' または 'gpu'）を持つ dict。実行そのものは呼び出し側の
+run_job(job) に任せ、ここでは並列数の制限・再試行・中断だけを扱う。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def default_cpu_workers():
+    """ffmpeg は1ジョブでも複数スレッドを使うので、コア数の 1/4 を既定の並列数にする"""
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def threads_per_job(cpu_workers):
+    """CPU ジョブ1本あたりに割り当てるスレッド数（並列実行時の取り合いを防ぐ）"""
+    return max(1, (os.cpu_count() or 1) // max(1, cpu_workers))
+
+
+def run_jobs(jobs, run_job, cpu_workers=None, gpu_workers=1, retries=1, should_stop=None, on_finished=None):
+    """jobs を並列に実行し、投入順に結果の dict を返す
+
+    run_job(job) が False を返すか例外を送出したジョブは retries 回まで再実行する。
+    should_stop() が True になると、まだ始まっていないジョブと再試行は行わない。
+    結果は {'job', 'ok', 'attempts', 'error'}。on_finished があればジョブ終了ごとに呼ぶ。
+    """
+    pools = {
+        'cpu': ThreadPoolExecutor(max_workers=cpu_workers or default_cpu_workers(), thread_name_prefix='cpu-job'),
+        'gpu': ThreadPoolExecutor(max_workers=max(1, gpu_workers), thread_name_prefix='gpu-job'),
+    }
+
+    def attempt(job):
+        result = {'job': job, 'ok': False, 'attempts': 0, 'error': None}
+        for _ in range(retries + 1):
+            if should_stop is not None and should_stop():
+                result['error'] = 'cancelled'
+                break
+            result['attempts'] += 1
+            try:
+                if run_job(job):
+                    result['ok'] = True
+                    result['error'] = None
+                    break
+                result['error'] = 'failed'
+            except Exception as e:
+                result['error'] = str(e)
+        if on_finished is not None:
+            on_finished(result)
+        return result
+
+    try:
+        futures = [pools[job.get('kind', 'cpu')].submit(attempt, job) for job in jobs]
+        return [future.result() for future in futures]
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True)
@@ -0,0 +1,114 @@
+"""出力画像のファイル名・フォルダ構成と、全画像の一覧（インデックス）
+
+ファイル名は {動画名}-{入力ID}_d{方向}_{番号}_t{時刻ミリ秒}.{拡張子}。入力 ID は動画の内容の
+ハッシュ（job_manifest.input_hash）なので、名前の末尾が同じ動画どうしでも上書きし合わず、
+同じ動画・同じ条件なら毎回同じ名前になる。
+
+layout は 'flat'（保存先にすべて置く）、'video'（動画ごとのフォルダ）、'direction'
+（動画ごと・方向ごとのフォルダ）。10 万枚を超えるような場合はフォルダを分けると一覧や同期が速い。
+
+360foto_index.json には、全画像の相対パス・方向・番号・動画内の時刻と、方向の定義をまとめる。
+下流の処理は glob の代わりにこれを読めばよい。
+"""
+import json
+import os
+import re
+
+LAYOUTS = ('flat', 'video', 'direction')
+
+OUTPUT_INDEX_NAME = '360foto_index.json'
+OUTPUT_INDEX_VERSION = 1
+
+# 出力のファイル名（dedup などで方向・番号を読み取る）
+NAME_PATTERN = re.compile(r'_d(\d+)_(\d+)_t(\d+)\.(jpg|jpeg|png|webp|jxl)$', re.IGNORECASE)
+
+
+def safe_stem(input_path, max_length=40):
+    """ファイル名に使う動画名（記号と空白は _ に置き換える。日本語はそのまま）"""
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return re.sub(r'[^\w\-]+', '_', stem)[:max_length] or 'video'
+
+
+class OutputLayout:
+    """1本の動画の出力先。path(方向, 番号) で画像のパスを返す
+
+    time_of(番号) はその番号の動画内の時刻（秒）を返す関数。
+    """
+
+    def __init__(self, output_path, input_path, input_id, fmt, layout='flat', time_of=None):
+        if layout not in LAYOUTS:
+            raise ValueError(f"不明なフォルダ構成です: {layout}")
+        self.output_path = output_path
+        self.fmt = fmt
+        self.layout = layout
+        self.prefix = f'{safe_stem(input_path)}-{input_id[:8]}'
+        self.time_of = time_of or (lambda number: 0.0)
+
+    def directory(self, index):
+        if self.layout == 'flat':
+            return self.output_path
+        if self.layout == 'video':
+            return os.path.join(self.output_path, self.prefix)
+        return os.path.join(self.output_path, self.prefix, f'd{index:02d}')
+
+    def makedirs(self, indices):
+        for index in indices:
+            os.makedirs(self.directory(index), exist_ok=True)
+
+    def name(self, index, number):
+        ms = int(round(self.time_of(number) * 1000))
+        return f'{self.prefix}_d{index:02d}_{number:05d}_t{ms:08d}.{self.fmt}'
+
+    def path(self, index, number):
+        return os.path.join(self.directory(index), self.name(index, number))
+
+    def relpath(self, index, number):
+        return os.path.relpath(self.path(index, number), self.output_path)
+
+    def temp_pattern(self, index):
+        """ffmpeg（image2）に直接書き出させるときの '%05d' 付きパス。書き出し後に path() へ改名する"""
+        return os.path.join(self.directory(index), f'_tmp_{self.prefix}_d{index:02d}_%05d.{self.fmt}')
+
+
+def load_index(output_path):
+    try:
+        with open(os.path.join(output_path, OUTPUT_INDEX_NAME), encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == OUTPUT_INDEX_VERSION:
+            return data
+    except (OSError, ValueError):
+        pass
+    return {'version': OUTPUT_INDEX_VERSION, 'videos': {}}
+
+
+def _save_index(output_path, data):
+    path = os.path.join(output_path, OUTPUT_INDEX_NAME)
+    tmp_path = path + f'.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        # 10 万枚を超えても小さく速く読めるよう、空白を入れずに書く
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def update_index(output_path, videos):
+    """動画ごとの記録を差し替えて保存する（今回変換しなかった動画の記録は残す）
+
+    videos は 入力ID -> {'input', 'layout', 'views': [[yaw, pitch, roll, fov], ...],
+    'frames': [[相対パス, 方向, 番号, 時刻], ...]}。
+    """
+    data = load_index(output_path)
+    data['videos'].update(videos)
+    _save_index(output_path, data)
+
+
+def drop_from_index(output_path, relpaths):
+    """取り除いた画像（dedup で移動・削除したもの）を一覧から外す"""
+    relpaths = set(relpaths)
+    if not relpaths:
+        return
+    data = load_index(output_path)
+    if not data['videos']:
+        return
+    for video in data['videos'].values():
+        video['frames'] = [frame for frame in video['frames'] if frame[0] not in relpaths]
+    _save_index(output_path, data)
@@ -0,0 +1,181 @@
+"""出力方向プリセットの登録・読み込み・自動生成・カバー率の解析
+
+プリセットは presets.json（同梱）と利用者のファイル（FOTO360_PRESETS または
+~/.config/360foto/presets.json、.yaml/.yml は PyYAML があれば可）から読み込み、
+名前 -> (表示名, [(yaw, pitch, roll[, fov]), ...]) の dict にまとめる。
+fov を省いた方向は変換時に指定した視野角を使う。pitch は負が下向き。
+
+fibonacci_layout / cube_layout で方向を均等に配置し、analyze_coverage で球面の
+カバー率と重なりを調べる。layout_for_overlap は目標の重なりを満たす最少の方向数を探す。
+"""
+import json
+import math
+import os
+
+PRESETS_VERSION = 1
+BUILTIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presets.json')
+
+# 黄金角（フィボナッチ球面配置で隣り合う方向の方位差）
+_GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+
+
+def user_presets_path():
+    return os.environ.get('FOTO360_PRESETS') or os.path.join(os.path.expanduser('~'), '.config', '360foto', 'presets.json')
+
+
+def _parse_view(view):
+    if isinstance(view, dict):
+        values = [view['yaw'], view['pitch'], view.get('roll', 0)]
+        if 'fov' in view:
+            values.append(view['fov'])
+    else:
+        values = list(view)
+    if len(values) not in (3, 4):
+        raise ValueError(f"方向は [yaw, pitch, roll] か [yaw, pitch, roll, fov] で指定してください: {view}")
+    return tuple(values)
+
+
+def _read_file(path):
+    with open(path, encoding='utf-8') as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"YAML のプリセットを読むには PyYAML が必要です: {path}")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def parse_presets(data):
+    """読み込んだ JSON/YAML の内容をプリセットの dict にする"""
+    presets = {}
+    for item in data.get('presets', []):
+        views = [_parse_view(view) for view in item['views']]
+        if not views:
+            raise ValueError(f"方向が空のプリセットです: {item['name']}")
+        presets[str(item['name'])] = (item.get('label') or str(item['name']), views)
+    return presets
+
+
+def load_presets(paths=None):
+    """同梱のプリセットに利用者のファイルを重ねて読む（同じ名前は後から読んだほうが優先）"""
+    presets = parse_presets(_read_file(BUILTIN_PATH))
+    for path in paths if paths is not None else [user_presets_path()]:
+        if not os.path.exists(path):
+            continue
+        try:
+            presets.update(parse_presets(_read_file(path)))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Warning: プリセットを読み込めませんでした（{path}）: {e}")
+    return presets
+
+
+def save_user_preset(name, label, views, path=None):
+    """利用者のプリセットファイル（JSON）に追加・上書きする"""
+    path = path or user_presets_path()
+    data = {'version': PRESETS_VERSION, 'presets': []}
+    if os.path.exists(path):
+        data = _read_file(path)
+    items = [item for item in data.get('presets', []) if str(item['name']) != name]
+    items.append({'name': name, 'label': label, 'views': [list(view) for view in views]})
+    data['presets'] = items
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + f'.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def view_fov(view, fov=90):
+    """方向ごとの視野角（プリセットで指定がなければ fov）"""
+    return view[3] if len(view) > 3 else fov
+
+
+def cube_layout():
+    """キューブマップの6面（前・右・後・左・下・上）"""
+    return [(0, 0, 0), (90, 0, 0), (180, 0, 0), (-90, 0, 0), (0, -90, 0), (0, 90, 0)]
+
+
+def fibonacci_layout(count, pitch_range=(-90, 90)):
+    """count 方向を球面（pitch_range の帯）にほぼ均等に並べる。同じ引数なら常に同じ配置"""
+    low, high = (math.sin(math.radians(p)) for p in pitch_range)
+    views = []
+    for i in range(count):
+        # 高さ（sin pitch）を等間隔に、方位を黄金角ずつ回すと面積あたりの密度がそろう
+        up = high - (high - low) * (i + 0.5) / count
+        pitch = math.degrees(math.asin(max(-1.0, min(1.0, up))))
+        yaw = math.degrees((i * _GOLDEN_ANGLE) % (2 * math.pi))
+        if yaw > 180:
+            yaw -= 360
+        views.append((round(yaw, 1), round(pitch, 1), 0))
+    return views
+
+
+def _sphere_samples(count, pitch_range):
+    """解析用の点を帯の中に均等に取り、(N, 3) の方向ベクトル（x: 右, y: 下, z: 前）で返す"""
+    import numpy as np
+
+    low, high = (math.sin(math.radians(p)) for p in pitch_range)
+    i = np.arange(count)
+    up = high - (high - low) * (i + 0.5) / count
+    yaw = i * _GOLDEN_ANGLE
+    horizontal = np.sqrt(1 - up ** 2)
+    return np.stack([horizontal * np.sin(yaw), -up, horizontal * np.cos(yaw)], axis=1)
+
+
+def analyze_coverage(views, fov=90, samples=20000, pitch_range=(-90, 90)):
+    """方向の組み合わせが球面（pitch_range の帯）をどれだけ覆い、どれだけ重なるかを調べる
+
+    返り値の dict:
+      coverage         : 1方向以上に写る割合
+      redundant        : 覆われた部分のうち2方向以上に写る割合
+      mean_views       : 覆われた点が平均で何方向に写るか
+      min_view_overlap : 各方向の画角のうち、ほかの方向と重なる割合の最小値
+      mean_view_overlap: 同じく平均
+    """
+    import numpy as np
+
+    from equirect import get_rotation_matrix
+
+    points = _sphere_samples(samples, pitch_range)
+    visible = np.zeros((len(views), len(points)), dtype=bool)
+    for index, view in enumerate(views):
+        # remap と同じ向きの定義: ワールド = R・カメラ なので、カメラ座標 = ワールド・R
+        camera = points @ get_rotation_matrix(*view[:3])
+        half = math.tan(math.radians(view_fov(view, fov)) / 2)
+        z = camera[:, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            visible[index] = (z > 0) & (np.abs(camera[:, 0] / z) <= half) & (np.abs(camera[:, 1] / z) <= half)
+
+    counts = visible.sum(axis=0)
+    covered = counts > 0
+    view_overlaps = []
+    for index in range(len(views)):
+        seen = visible[index]
+        if seen.any():
+            view_overlaps.append(float((counts[seen] > 1).mean()))
+        else:
+            view_overlaps.append(0.0)
+
+    return {
+        'views': len(views),
+        'coverage': round(float(covered.mean()), 4),
+        'redundant': round(float((counts > 1).sum() / max(1, covered.sum())), 4),
+        'mean_views': round(float(counts[covered].mean()) if covered.any() else 0.0, 3),
+        'min_view_overlap': round(min(view_overlaps), 4) if view_overlaps else 0.0,
+        'mean_view_overlap': round(sum(view_overlaps) / len(view_overlaps), 4) if view_overlaps else 0.0,
+    }
+
+
+def layout_for_overlap(target_overlap, fov=90, pitch_range=(-90, 90), min_coverage=0.995, max_views=64):
+    """どの方向も画角の target_overlap（0〜1）以上がほかと重なり、帯を覆う最少の配置を返す
+
+    (方向のリスト, analyze_coverage の結果) を返す。max_views 方向までで満たせなければ ValueError。
+    """
+    for count in range(1, max_views + 1):
+        views = fibonacci_layout(count, pitch_range)
+        stats = analyze_coverage(views, fov, pitch_range=pitch_range)
+        if stats['coverage'] >= min_coverage and stats['min_view_overlap'] >= target_overlap:
+            return views, stats
+    raise ValueError(f"{max_views} 方向以内では重なり {target_overlap:.0%} を満たせません（視野角 {fov} 度）")
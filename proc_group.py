@@ -0,0 +1,147 @@
+"""子プロセス（ffmpeg・RealityScan）の起動と、この実行の分だけを止めるキャンセル
+
+子プロセスはシェルを通さず、それぞれ新しいプロセスグループで起動して ProcessGroup に
+ハンドルを登録する。terminate() は登録したプロセスだけに、まず穏やかな停止
+（POSIX は SIGINT、Windows は CTRL_BREAK_EVENT。ffmpeg は処理中のフレームを書き終えて終わる）を送り、
+grace 秒たっても終わらないものを強制終了する。同じマシンで動いているほかの ffmpeg には触れない。
+"""
+import os
+import signal
+import subprocess
+import time
+from threading import Event, Lock, Thread
+
+# 穏やかな停止を送ってから強制終了するまでの秒数
+DEFAULT_GRACE = 5.0
+
+# エラーメッセージに使う標準エラーの末尾の行数
+ERROR_TAIL = 20
+
+_WINDOWS = os.name == 'nt'
+
+
+def group_options():
+    """Popen に渡す、新しいプロセスグループで起動するための引数"""
+    if _WINDOWS:
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def _interrupt(process):
+    try:
+        if _WINDOWS:
+            # CREATE_NEW_PROCESS_GROUP で起動したので、グループ ID はプロセス ID と同じ
+            os.kill(process.pid, signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(process.pid, signal.SIGINT)
+    except (OSError, ValueError):
+        pass
+
+
+def _kill(process):
+    try:
+        if _WINDOWS:
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+class ProcessGroup:
+    """1回の実行で起動した子プロセスの集まり（ジョブのスレッドから同時に使ってよい）"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.processes = set()
+        self.cancelled = False
+
+    def popen(self, command, **kwargs):
+        """command（引数のリスト）を新しいプロセスグループで起動して登録する
+
+        キャンセル後に呼ばれた場合は起動しない（RuntimeError）。標準入力は既定で閉じておく。
+        """
+        if isinstance(command, str):
+            raise TypeError("コマンドは引数のリストで渡してください（シェルは使わない）")
+        kwargs.setdefault('stdin', subprocess.DEVNULL)
+        with self.lock:
+            if self.cancelled:
+                raise RuntimeError("キャンセルされました")
+            process = subprocess.Popen(command, **group_options(), **kwargs)
+            self.processes.add(process)
+        return process
+
+    def release(self, process):
+        """終わったプロセスの登録を外す"""
+        with self.lock:
+            self.processes.discard(process)
+
+    def running(self):
+        with self.lock:
+            return [process for process in self.processes if process.poll() is None]
+
+    def terminate(self, grace=DEFAULT_GRACE):
+        """登録したプロセスを止める（穏やかに止め、grace 秒後に残っていれば強制終了）。止めた数を返す"""
+        with self.lock:
+            self.cancelled = True
+        processes = self.running()
+        for process in processes:
+            _interrupt(process)
+        deadline = time.monotonic() + grace
+        for process in processes:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                _kill(process)
+        for process in processes:
+            if not _WINDOWS:
+                # 先頭のプロセスが終わっても、同じグループに残った子（孫）プロセスは止める
+                _kill(process)
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                pass
+            self.release(process)
+        return len(processes)
+
+    def watch(self, should_stop, interval=0.2):
+        """should_stop() が True になったら terminate() するスレッドを始め、監視をやめる関数を返す"""
+        done = Event()
+
+        def watcher():
+            while not done.wait(interval):
+                if should_stop():
+                    self.terminate()
+                    return
+
+        Thread(target=watcher, daemon=True).start()
+        return done.set
+
+
+def tail_lines(stream, limit=ERROR_TAIL):
+    """stream（子プロセスの標準エラーなど）を別スレッドで最後まで読み、末尾 limit 行だけを残す
+
+    読まずに置くとパイプ（64KB 程度）が詰まり、子プロセスが書き込みで止まってしまう。
+    (スレッド, 行のリスト) を返す。スレッドを join() した後のリストが末尾の行になる。
+    """
+    tail = []
+
+    def reader():
+        for line in stream:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', 'replace')
+            tail.append(line.rstrip('\r\n'))
+            del tail[:-limit]
+        stream.close()
+
+    thread = Thread(target=reader, daemon=True)
+    thread.start()
+    return thread, tail
+
+
+def popen(command, group=None, **kwargs):
+    """group があれば登録して起動し、なければ新しいプロセスグループで起動するだけ"""
+    if group is not None:
+        return group.popen(command, **kwargs)
+    kwargs.setdefault('stdin', subprocess.DEVNULL)
+    return subprocess.Popen(command, **group_options(), **kwargs)
@@ -1,3 +1,4 @@
+import startup_profile  # 起動時間の計測（最初に import する）
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
@@ -6,8 +7,10 @@ import subprocess
 import platform
 import queue
 
-# RealityScan.exeのパス
-REALITYSCAN_EXE = r"C:\Program Files\Epic Games\RealityScan_2.1\RealityScan.exe"
+from realityscan_runner import default_exe
+
+# RealityScan.exeのパス（環境変数 REALITYSCAN_EXE で差し替えられる）
+REALITYSCAN_EXE = default_exe()
 
 # ログメッセージ用のキュー
 log_queue = queue.Queue()
@@ -22,12 +25,6 @@ def check_realityscan():
         return False
     return True
 
-def select_image_folder():
-    """画像フォルダを選択"""
-    folder = filedialog.askdirectory(title="画像フォルダを選択")
-    if folder:
-        image_folder_var.set(folder)
-
 def select_output_folder():
     """保存先フォルダを選択"""
     folder = filedialog.askdirectory(title="RSデータ保存先を選択")
@@ -49,21 +46,33 @@ def update_log():
         pass
     app.after(100, update_log)  # 100msごとに更新
 
+def add_image_folder():
+    """画像フォルダをキューに追加"""
+    folder = filedialog.askdirectory(title="画像フォルダを選択")
+    if folder and folder not in image_folders_list.get(0, tk.END):
+        image_folders_list.insert(tk.END, folder)
+
+def remove_image_folder():
+    """選択した画像フォルダをキューから外す"""
+    for index in reversed(image_folders_list.curselection()):
+        image_folders_list.delete(index)
+
 def run_realityscan():
     """RealityScanを実行"""
     if not check_realityscan():
         return
     
-    image_folder = image_folder_var.get()
+    image_folders = list(image_folders_list.get(0, tk.END))
     output_folder = output_folder_var.get()
     
-    if not image_folder or not output_folder:
+    if not image_folders or not output_folder:
         messagebox.showerror("エラー", "画像フォルダと保存先フォルダを指定してください。")
         return
     
-    if not os.path.exists(image_folder):
-        messagebox.showerror("エラー", f"画像フォルダが存在しません: {image_folder}")
-        return
+    for image_folder in image_folders:
+        if not os.path.exists(image_folder):
+            messagebox.showerror("エラー", f"画像フォルダが存在しません: {image_folder}")
+            return
     
     # 出力フォルダを作成
     os.makedirs(output_folder, exist_ok=True)
@@ -73,69 +82,60 @@ def run_realityscan():
     status_var.set("処理中...")
     log_text.delete(1.0, tk.END)
     
+    # 重複除外・同時実行数の設定（Tk の変数はメインスレッドで読んでおく）
+    dedup_distance = dedup_distance_var.get() if dedup_var.get() else None
+    max_parallel = parallel_var.get()
+
     # バックグラウンドで処理を実行
-    Thread(target=process_realityscan, args=(image_folder, output_folder)).start()
+    Thread(target=process_realityscan, args=(image_folders, output_folder, dedup_distance, max_parallel)).start()
+
+def remove_duplicates(image_folder, distance):
+    """ほぼ同じ画像を duplicates/ に移す（前回ハッシュした画像は計算し直さない）"""
+    from dedup import dedup_folder
+
+    log_message(f"重複画像を除外しています（ハッシュの違い {distance} ビット以下）: {image_folder}")
+    stats = dedup_folder(image_folder, distance)
+    log_message(f"残した画像: {stats['kept']} 枚, 重複として移した画像: {stats['duplicates']} 枚"
+                f"（新たにハッシュした画像: {stats['hashed']} 枚）")
+
+def process_realityscan(image_folders, output_folder, dedup_distance=None, max_parallel=1):
+    """RealityScan処理をフォルダごとに実行（バックグラウンド）"""
+    from realityscan_runner import build_command, run_queue
 
-def process_realityscan(image_folder, output_folder):
-    """RealityScan処理を実行（バックグラウンド）"""
     try:
         log_message("=== RealityScan処理を開始 ===")
-        log_message(f"画像フォルダ: {image_folder}")
+        log_message(f"画像フォルダ: {len(image_folders)} 件（同時実行 {max_parallel}）")
         log_message(f"保存先: {output_folder}")
-        
-        # プロジェクトファイルのパス
-        project_path = os.path.join(output_folder, "project.rsproj")
-        cameras_csv = os.path.join(output_folder, "cameras.csv")
-        pointcloud_ply = os.path.join(output_folder, "pointcloud.ply")
-        mesh_obj = os.path.join(output_folder, "mesh.obj")
-        
-        # RealityScan CLIコマンドを構築
-        # calculatePointCloudコマンドを削除（存在しない可能性）
-        commands = [
-            REALITYSCAN_EXE,
-            "-newScene",
-            "-addFolder", image_folder,
-            "-align",
-            "-selectMaximalComponent",  # 最大のアライメント枚数を持つコンポーネントを選択
-            "-setReconstructionRegionAuto",
-            "-exportRegistration", cameras_csv,
-            "-calculateNormalModel",  # モデルを計算
-            "-calculateTexture",  # テクスチャ(カラー情報)を計算
-            "-exportRegistration", os.path.join(output_folder, "colmap_cameras.txt"),  # COLMAP形式でカメラをエクスポート
-            "-save", project_path,
-            "-quit"
-        ]
-        
-        command_str = " ".join([f'"{cmd}"' if " " in str(cmd) else str(cmd) for cmd in commands])
-        
-        log_message("\n実行コマンド:")
-        log_message(command_str)
+        log_message("\n実行コマンド（1件目）:")
+        log_message(subprocess.list2cmdline(build_command(REALITYSCAN_EXE, image_folders[0], output_folder)))
         log_message("\nRealityScanを実行中...")
-        
-        # コマンドを実行（リスト形式で渡す）
-        process = subprocess.Popen(
-            commands,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        # 出力をリアルタイムで表示
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output:
-                log_message(output.strip())
-        
-        # プロセスの完了を待つ
-        return_code = process.wait()
-        
-        if return_code == 0:
+
+        def prepare(job):
+            log_message(f"\n--- 開始: {job['image_folder']} ---")
+            if dedup_distance is not None:
+                remove_duplicates(job['image_folder'], dedup_distance)
+
+        def on_line(job, stream, line):
+            # 複数同時に動かすときは、どのフォルダの出力か分かるように名前を付ける
+            prefix = f"[{os.path.basename(job['image_folder'])}] " if max_parallel > 1 else ""
+            if line.strip():
+                log_message(prefix + ("(stderr) " if stream == 'stderr' else "") + line.strip())
+
+        def on_finished(result):
+            record = result['job'].get('record', {})
+            if result['ok']:
+                log_message(f"--- 完了: {result['job']['image_folder']}（{record.get('seconds', 0):.0f} 秒）---")
+                log_message(f"プロジェクト: {os.path.join(result['job']['output_folder'], 'project.rsproj')}")
+            else:
+                log_message(f"--- エラー: {result['job']['image_folder']}"
+                            f"（リターンコード {record.get('returncode')}, {result['error']}）---")
+
+        results = run_queue(image_folders, output_folder, max_parallel, exe=REALITYSCAN_EXE,
+                            on_line=on_line, on_finished=on_finished, prepare=prepare)
+        failed = [result for result in results if not result['ok']]
+
+        if not failed:
             log_message("\n=== 処理が完了しました ===")
-            log_message(f"プロジェクト: {project_path}")
-            log_message(f"カメラCSV: {cameras_csv}")
-            log_message(f"COLMAPカメラ: {os.path.join(output_folder, 'colmap_cameras.txt')}")
             log_message("\nモデルとテクスチャ（カラー）が計算されました。")
             log_message("メッシュ(OBJ)と点群(PLY)は、プロジェクトをRealityScan GUIで開いて")
             log_message("「エクスポート」から手動で出力してください。")
@@ -146,14 +146,10 @@ def process_realityscan(image_folder, output_folder):
             except:
                 pass
         else:
-            log_message(f"\n=== エラー: リターンコード {return_code} ===")
-            stderr_output = process.stderr.read()
-            if stderr_output:
-                log_message("エラー出力:")
-                log_message(stderr_output)
-            
+            log_message(f"\n=== エラー: {len(failed)} / {len(results)} 件が失敗しました ===")
             try:
-                app.after(0, lambda: messagebox.showerror("エラー", f"RealityScan処理中にエラーが発生しました。\nリターンコード: {return_code}"))
+                app.after(0, lambda: messagebox.showerror(
+                    "エラー", f"RealityScan処理中にエラーが発生しました。\n失敗: {len(failed)} / {len(results)} 件"))
                 app.after(0, lambda: status_var.set("エラー"))
             except:
                 pass
@@ -177,17 +173,23 @@ def process_realityscan(image_folder, output_folder):
 # GUIの作成
 app = tk.Tk()
 app.title("RealityScan GUI ラッパー")
-app.geometry("700x550")
+app.geometry("760x620")
 
 # 変数
-image_folder_var = tk.StringVar()
 output_folder_var = tk.StringVar()
 status_var = tk.StringVar(value="待機中")
-
-# 画像フォルダ選択
-tk.Label(app, text="画像フォルダ:").grid(row=0, column=0, padx=10, pady=10, sticky="e")
-tk.Entry(app, textvariable=image_folder_var, width=50).grid(row=0, column=1, padx=10, pady=10, sticky="ew")
-tk.Button(app, text="選択", command=select_image_folder).grid(row=0, column=2, padx=10, pady=10)
+dedup_var = tk.BooleanVar(value=False)
+dedup_distance_var = tk.IntVar(value=6)
+parallel_var = tk.IntVar(value=1)
+
+# 画像フォルダ選択（複数のフォルダを順番に、または同時に処理する）
+tk.Label(app, text="画像フォルダ:").grid(row=0, column=0, padx=10, pady=10, sticky="ne")
+image_folders_list = tk.Listbox(app, height=4, selectmode=tk.EXTENDED)
+image_folders_list.grid(row=0, column=1, padx=10, pady=10, sticky="ew")
+folder_buttons = tk.Frame(app)
+folder_buttons.grid(row=0, column=2, padx=10, pady=10, sticky="n")
+tk.Button(folder_buttons, text="追加", command=add_image_folder).pack(fill=tk.X)
+tk.Button(folder_buttons, text="削除", command=remove_image_folder).pack(fill=tk.X, pady=(5, 0))
 
 # 保存先フォルダ選択
 tk.Label(app, text="保存先フォルダ:").grid(row=1, column=0, padx=10, pady=10, sticky="e")
@@ -198,27 +200,41 @@ tk.Button(app, text="選択", command=select_output_folder).grid(row=1, column=2
 tk.Label(app, text="状態:").grid(row=2, column=0, padx=10, pady=10, sticky="e")
 tk.Label(app, textvariable=status_var).grid(row=2, column=1, padx=10, pady=10, sticky="w")
 
+# 重複画像の除外（止まっている区間のほぼ同じ画像を RealityScan に渡さない）
+dedup_frame = tk.Frame(app)
+dedup_frame.grid(row=3, column=1, padx=10, pady=5, sticky="w")
+tk.Checkbutton(dedup_frame, text="ほぼ同じ画像を除外する（duplicates フォルダへ移動）", variable=dedup_var).pack(side=tk.LEFT)
+tk.Label(dedup_frame, text="しきい値:").pack(side=tk.LEFT, padx=(10, 0))
+tk.Spinbox(dedup_frame, from_=0, to=20, textvariable=dedup_distance_var, width=4).pack(side=tk.LEFT)
+# ライセンスで同時起動が1つに限られる場合は 1 のまま順番に実行する
+tk.Label(dedup_frame, text="同時実行数:").pack(side=tk.LEFT, padx=(10, 0))
+tk.Spinbox(dedup_frame, from_=1, to=8, textvariable=parallel_var, width=4).pack(side=tk.LEFT)
+
 # 実行ボタン
 run_button = tk.Button(app, text="実行", command=run_realityscan, bg="green", fg="white", font=("Arial", 12, "bold"))
-run_button.grid(row=3, column=1, padx=10, pady=20)
+run_button.grid(row=4, column=1, padx=10, pady=20)
 
 # ログ表示エリア
-tk.Label(app, text="ログ:").grid(row=4, column=0, padx=10, pady=5, sticky="ne")
+tk.Label(app, text="ログ:").grid(row=5, column=0, padx=10, pady=5, sticky="ne")
 log_text = scrolledtext.ScrolledText(app, width=80, height=20, wrap=tk.WORD)
-log_text.grid(row=4, column=1, columnspan=2, padx=10, pady=5, sticky="nsew")
+log_text.grid(row=5, column=1, columnspan=2, padx=10, pady=5, sticky="nsew")
 
 # グリッドの重み設定
 app.columnconfigure(1, weight=1)
-app.rowconfigure(4, weight=1)
+app.rowconfigure(5, weight=1)
+
+def report_realityscan_path():
+    """起動時にRealityScanの存在を確認（ネットワーク上のパスでも画面を止めないようバックグラウンドで行う）"""
+    if os.path.exists(REALITYSCAN_EXE):
+        log_message("RealityScan.exeが見つかりました。")
+        log_message(f"パス: {REALITYSCAN_EXE}")
+    else:
+        log_message("警告: RealityScan.exeが見つかりません。")
 
-# 起動時にRealityScanの存在を確認
-if check_realityscan():
-    log_message("RealityScan.exeが見つかりました。")
-    log_message(f"パス: {REALITYSCAN_EXE}")
-else:
-    log_message("警告: RealityScan.exeが見つかりません。")
+Thread(target=report_realityscan_path, daemon=True).start()
 
 # ログ更新を開始
 update_log()
+startup_profile.on_first_window(app, 'realityscan_gui')
 
 app.mainloop()
@@ -0,0 +1,150 @@
+"""RealityScan の一括実行（複数の画像フォルダをキューに入れ、指定した数ずつ並列に処理する）
+
+1フォルダ = 1ジョブ = 1回の RealityScan の起動。標準出力と標準エラーは別々のスレッドで
+読み続けるので、どちらかのパイプが詰まって止まることはない。ジョブごとの開始・終了時刻、
+所要時間、終了コードを記録し、保存先に realityscan_jobs.json として書き出す。
+
+ライセンスの都合で同時に1つしか起動できない場合は max_parallel=1（既定）で順番に実行する。
+実行ファイルは環境変数 REALITYSCAN_EXE で差し替えられる（動作確認用のスタブなど）。
+"""
+import json
+import os
+import subprocess
+import time
+from threading import Lock, Thread
+
+from job_scheduler import run_jobs
+from proc_group import ProcessGroup
+
+DEFAULT_EXE = r"C:\Program Files\Epic Games\RealityScan_2.1\RealityScan.exe"
+
+JOBS_REPORT_NAME = 'realityscan_jobs.json'
+
+# ジョブの記録に残す標準エラーの末尾の行数
+STDERR_TAIL = 50
+
+
+def default_exe():
+    return os.environ.get('REALITYSCAN_EXE') or DEFAULT_EXE
+
+
+def build_command(exe, image_folder, output_folder):
+    """1フォルダを位置合わせ・モデル・テクスチャまで計算して保存するコマンド（引数のリスト）"""
+    return [
+        exe,
+        "-newScene",
+        "-addFolder", image_folder,
+        "-align",
+        "-selectMaximalComponent",  # 最大のアライメント枚数を持つコンポーネントを選択
+        "-setReconstructionRegionAuto",
+        "-exportRegistration", os.path.join(output_folder, "cameras.csv"),
+        "-calculateNormalModel",  # モデルを計算
+        "-calculateTexture",  # テクスチャ(カラー情報)を計算
+        "-exportRegistration", os.path.join(output_folder, "colmap_cameras.txt"),  # COLMAP形式でカメラをエクスポート
+        "-save", os.path.join(output_folder, "project.rsproj"),
+        "-quit",
+    ]
+
+
+def make_jobs(image_folders, output_root):
+    """画像フォルダごとのジョブを作る。複数のときは保存先の下にフォルダ名ごとの保存先を作る"""
+    jobs = []
+    used = set()
+    for image_folder in image_folders:
+        if len(image_folders) == 1:
+            output_folder = output_root
+        else:
+            name = os.path.basename(os.path.normpath(image_folder)) or 'project'
+            candidate, n = name, 2
+            while candidate in used:
+                candidate, n = f'{name}_{n}', n + 1
+            used.add(candidate)
+            output_folder = os.path.join(output_root, candidate)
+        jobs.append({'kind': 'cpu', 'image_folder': image_folder, 'output_folder': output_folder})
+    return jobs
+
+
+def _drain(stream, on_line, tail=None):
+    for line in stream:
+        line = line.rstrip('\r\n')
+        if tail is not None:
+            tail.append(line)
+            del tail[:-STDERR_TAIL]
+        if on_line is not None:
+            on_line(line)
+    stream.close()
+
+
+def run_project(job, exe=None, on_line=None, should_stop=None, prepare=None):
+    """1ジョブを実行して job['record'] に記録し、成功したかを返す
+
+    on_line(ジョブ, 'stdout' または 'stderr', 行) に出力を1行ずつ渡す。
+    prepare(ジョブ) は起動前に呼ぶ（重複画像の除外など）。
+    RealityScan は自分のプロセスグループで起動し、should_stop() が True になったら
+    そのグループだけを止める（まず穏やかに、終わらなければ強制終了）。
+    """
+    exe = exe or default_exe()
+    os.makedirs(job['output_folder'], exist_ok=True)
+    record = job['record'] = {'image_folder': job['image_folder'], 'output_folder': job['output_folder'],
+                              'started': time.time(), 'returncode': None}
+    if prepare is not None:
+        prepare(job)
+    command = build_command(exe, job['image_folder'], job['output_folder'])
+    record['command'] = command
+    start = time.perf_counter()
+    group = ProcessGroup()
+    process = group.popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          text=True, errors='replace', bufsize=1)
+    stderr_tail = []
+    readers = [
+        Thread(target=_drain, args=(process.stdout, on_line and (lambda line: on_line(job, 'stdout', line))),
+               daemon=True),
+        Thread(target=_drain, args=(process.stderr, on_line and (lambda line: on_line(job, 'stderr', line)),
+                                    stderr_tail), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    try:
+        while process.poll() is None:
+            if should_stop is not None and should_stop():
+                group.terminate()
+                break
+            time.sleep(0.2)
+        returncode = process.wait()
+    finally:
+        if process.poll() is None:
+            group.terminate()
+        group.release(process)
+        for reader in readers:
+            reader.join()
+    record.update(returncode=returncode, seconds=round(time.perf_counter() - start, 3), finished=time.time(),
+                  stderr_tail=stderr_tail)
+    return returncode == 0
+
+
+def save_report(output_root, jobs):
+    records = [job.get('record', {'image_folder': job['image_folder'], 'returncode': None}) for job in jobs]
+    path = os.path.join(output_root, JOBS_REPORT_NAME)
+    tmp_path = path + f'.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'jobs': records}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    return path
+
+
+def run_queue(image_folders, output_root, max_parallel=1, exe=None, on_line=None, on_finished=None,
+              should_stop=None, prepare=None):
+    """画像フォルダのキューを max_parallel 個ずつ実行し、job_scheduler.run_jobs と同じ形の結果を返す"""
+    os.makedirs(output_root, exist_ok=True)
+    jobs = make_jobs(list(image_folders), output_root)
+    lock = Lock()
+
+    def finished(result):
+        with lock:
+            save_report(output_root, jobs)
+        if on_finished is not None:
+            on_finished(result)
+
+    # 失敗したプロジェクトはやり直しても同じ結果になることが多いので再試行しない
+    return run_jobs(jobs, lambda job: run_project(job, exe, on_line, should_stop, prepare),
+                    cpu_workers=max(1, max_parallel), retries=0, should_stop=should_stop, on_finished=finished)
@@ -0,0 +1,145 @@
+"""工程ごとの計測・フック・実行レポート
+
+process_video は工程（probe / plan / sample / decode / reproject / ffmpeg / backpressure /
+encode / write / xmp / manifest）ごとの所要時間と、ジョブごとのコマンド・終了コード・
+速度・書き出しバイト数を RunProfile に集める。集めた内容は hooks（dict を受け取る
+呼び出し可能オブジェクト）にイベントとして渡し、最後に summary() でまとめる。
+
+工程は並列に動くので、工程ごとの秒数の合計は実時間より長くなることがある。
+"""
+import json
+import logging
+import time
+from collections import deque
+from threading import Lock
+
+REPORT_NAME = '360foto_run_report.json'
+REPORT_VERSION = 1
+
+
+def logging_hook(logger=None, level=logging.INFO):
+    """イベントを logging に1行の JSON として流すフック"""
+    logger = logger or logging.getLogger('360foto')
+
+    def hook(event):
+        logger.log(level, json.dumps(event, ensure_ascii=False))
+    return hook
+
+
+def jsonl_hook(path):
+    """イベントを JSON Lines ファイルに追記するフック"""
+    lock = Lock()
+
+    def hook(event):
+        line = json.dumps(event, ensure_ascii=False) + '\n'
+        with lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+    return hook
+
+
+class RunProfile:
+    """工程ごとの時間とジョブの記録を集める（ジョブのスレッドから同時に呼ばれてもよい）"""
+
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+        self.lock = Lock()
+        self.start = time.time()
+        self.stages = {}
+        self.jobs = []
+
+    def emit(self, event, **fields):
+        record = dict(fields, event=event, time=round(time.time(), 3))
+        for hook in self.hooks:
+            try:
+                hook(record)
+            except Exception as e:
+                print(f"Warning: フックでエラーが発生しました: {e}")
+
+    def add(self, stage, seconds, count=1, nbytes=0):
+        with self.lock:
+            entry = self.stages.setdefault(stage, {'seconds': 0.0, 'count': 0, 'bytes': 0})
+            entry['seconds'] += seconds
+            entry['count'] += count
+            entry['bytes'] += nbytes
+
+    def timed(self, stage):
+        """with profile.timed('probe'): ... の形で区間を計る"""
+        return _Timed(self, stage)
+
+    def add_job(self, record):
+        with self.lock:
+            self.jobs.append(record)
+        self.emit('job', **record)
+
+    def summary(self):
+        with self.lock:
+            wall = time.time() - self.start
+            stages = {}
+            for name, entry in self.stages.items():
+                stages[name] = {
+                    'seconds': round(entry['seconds'], 3),
+                    'count': entry['count'],
+                    'bytes': entry['bytes'],
+                    'ms_per_item': round(entry['seconds'] / entry['count'] * 1000, 2) if entry['count'] else 0.0,
+                }
+            images = sum(job.get('images', 0) for job in self.jobs if job.get('ok'))
+            written = sum(job.get('bytes', 0) for job in self.jobs)
+            return {
+                'version': REPORT_VERSION,
+                'wall_seconds': round(wall, 3),
+                'images': images,
+                'images_per_second': round(images / wall, 2) if wall > 0 else 0.0,
+                'bytes_written': written,
+                'stages': stages,
+                'jobs': list(self.jobs),
+            }
+
+
+class _Timed:
+    def __init__(self, profile, stage):
+        self.profile = profile
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.add(self.stage, time.perf_counter() - self.start)
+
+
+class RateMeter:
+    """直近 window 秒の実測の処理速度から残り時間を見積もる
+
+    経過時間 / 処理済み数 で外挿すると、動画情報の取得やジョブの立ち上げにかかった時間まで
+    速度に含まれてしまう。直近の区間だけを見ることで、今の速度で見積もる。
+    """
+
+    def __init__(self, window=15.0):
+        self.window = window
+        self.samples = deque()
+        self.lock = Lock()
+
+    def update(self, processed):
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, processed))
+            while len(self.samples) > 2 and now - self.samples[1][0] > self.window:
+                self.samples.popleft()
+
+    def rate(self):
+        """1秒あたりの処理数。まだ測れていなければ None"""
+        with self.lock:
+            if len(self.samples) < 2:
+                return None
+            (t0, p0), (t1, p1) = self.samples[0], self.samples[-1]
+        if t1 <= t0 or p1 <= p0:
+            return None
+        return (p1 - p0) / (t1 - t0)
+
+    def remaining(self, processed, total):
+        """残り秒数。まだ測れていなければ None"""
+        rate = self.rate()
+        if rate is None or total <= 0:
+            return None
+        return max(0.0, (total - processed) / rate)
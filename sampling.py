@@ -0,0 +1,107 @@
+"""書き出し時刻だけを取り出すためのサンプリング戦略
+
+- select   : 全フレームをデコードし、v360 の前で各区間の先頭フレームだけを残す
+- keyframe : キーフレームだけをデコード（-skip_frame nokey）し、各区間の先頭を残す
+- seek     : 書き出し時刻ごとに入力側シーク（-ss）して1フレームだけデコードする
+
+どれを使うかはキーフレーム間隔（GOP、video_probe で取得）と書き出し間隔の比で決める。
+
+select と keyframe では、番号 k のフレームの時刻（ファイル名の _t と XMP の撮影時刻）を (k - 1) * interval とみなす。
+区間に1枚もフレームが残らないと、それより後の番号と時刻がずれる。select は一定のフレームレートで
+interval が1フレームより長ければ必ず残るが、keyframe はキーフレームのない区間ができうるので、
+いちばん長いキーフレーム間隔でも interval の半分以下（GOP が規則的）の場合だけ使い、そうでなければ seek に回す。
+間隔に AUTO_INTERVAL を指定した場合は adaptive_sampling で書き出し時刻を選び、seek で取り出す。
+
+長い動画は split_segments で書き出し時刻の境目ごとに区間に分け、区間ごとに並列に処理できる。
+"""
+import math
+
+STRATEGIES = ('select', 'keyframe', 'seek')
+
+# 鮮明さ・動きから書き出し時刻を選ぶモード（間隔の代わりに指定する）
+AUTO_INTERVAL = 'auto'
+AUTO_TARGET_INTERVAL = 1.5  # 平均的な動きのときの間隔（秒）
+AUTO_MIN_INTERVAL = 0.5     # 速く動いているときでもこれより詰めない
+AUTO_MAX_INTERVAL = 4.0     # 止まっているときでもこれより空けない
+
+# 長い動画を時間で区切って並列に処理するときの区間の長さ（'auto' は並列数で等分する）
+AUTO_SEGMENT = 'auto'
+MIN_SEGMENT_SECONDS = 60.0  # これより短くは分けない（区間ごとの起動とシークの手間のほうが大きくなる）
+
+
+def choose_strategy(interval, keyframe_interval, keyframe_max_interval=None):
+    """GOP と書き出し間隔からもっとも安い戦略を選ぶ
+
+    keyframe_max_interval（調べた範囲でいちばん長いキーフレーム間隔）がわからなければ keyframe は選ばない。
+    """
+    if keyframe_interval is None:
+        return 'select'
+    if keyframe_max_interval is not None and keyframe_max_interval <= interval / 2:
+        # どの区間にもキーフレームがあるなら、キーフレームだけのデコードで足りる（時刻のずれは GOP 以内）
+        return 'keyframe'
+    if keyframe_interval <= interval:
+        # 1枚あたり平均 GOP/2 フレームのデコードで済むので、全デコードより安い
+        return 'seek'
+    return 'select'
+
+
+def select_expression(interval):
+    """各 interval 秒区間の最初のフレームだけを通す select フィルタ"""
+    return f"select='isnan(prev_selected_t)+gte(floor(t/{interval})-floor(prev_selected_t/{interval}),1)'"
+
+
+def sample_timestamps(duration, interval):
+    """書き出し時刻（0, interval, 2*interval, ...）の一覧"""
+    if duration <= 0:
+        return []
+    count = int(math.floor(duration / interval - 1e-6)) + 1
+    return [round(k * interval, 6) for k in range(count)]
+
+
+def estimate_count(duration, interval):
+    """書き出し枚数の見積もり（自動モードは平均間隔で近似する）"""
+    if interval == AUTO_INTERVAL:
+        return int(math.ceil(duration / AUTO_TARGET_INTERVAL)) if duration > 0 else 0
+    return len(sample_timestamps(duration, interval))
+
+
+def segment_length(duration, workers, segment_seconds=AUTO_SEGMENT):
+    """区間の長さ（秒）。'auto' なら動画を並列数で等分した長さ（MIN_SEGMENT_SECONDS 以上）"""
+    if segment_seconds == AUTO_SEGMENT:
+        return max(MIN_SEGMENT_SECONDS, duration / max(1, workers))
+    return float(segment_seconds)
+
+
+def _since_keyframe(t, keyframe_interval):
+    # t の直前のキーフレームからの秒数（入力側シークで捨てるデコードの量）
+    return t - math.floor(t / keyframe_interval + 1e-6) * keyframe_interval
+
+
+def split_segments(count, interval, segment_seconds, keyframe_interval=None):
+    """書き出し番号 1..count を区間 [(最初の番号, 最後の番号), ...] に分ける。分けない場合は []
+
+    境目は書き出し時刻（interval の倍数）に置くので、区間の先頭へシークして select で取り出しても、
+    選ばれるフレームと番号は一括で処理した場合と同じになる。キーフレーム間隔がわかっていれば、
+    境目を近くの書き出し時刻のうちキーフレームの直後にあたるものへずらす（シークで捨てるデコードを減らす）。
+    """
+    per = max(1, int(round(segment_seconds / interval)))
+    if count <= per:
+        return []
+    window = max(1, int(round(keyframe_interval / interval / 2))) if keyframe_interval else 0
+    bounds = [1]
+    ideal = 1 + per
+    while ideal <= count:
+        best = ideal
+        if window:
+            candidates = range(max(bounds[-1] + 1, ideal - window), min(count, ideal + window) + 1)
+            best = min(candidates, key=lambda n: (round(_since_keyframe((n - 1) * interval, keyframe_interval), 6),
+                                                  abs(n - ideal)))
+        bounds.append(best)
+        ideal = best + per
+    # 最後の区間が短すぎるときは、ひとつ前の区間にまとめる
+    if count + 1 - bounds[-1] < per / 2:
+        bounds.pop()
+    if len(bounds) == 1:
+        return []
+    bounds.append(count + 1)
+    return [(first, last - 1) for first, last in zip(bounds, bounds[1:])]
@@ -0,0 +1,143 @@
+"""GUI の起動時間（最初のウィンドウが出るまで）の計測と、重いモジュールの後読み込み
+
+GUI のいちばん最初に import すると、その時点から時間を計り始める。
+`--startup-report` 付きで起動するか環境変数 FOTO360_STARTUP_REPORT を設定すると、
+python -X importtime と同じように、モジュールごとの import 時間（自分だけ / 下位を含む）を集め、
+最初のウィンドウが表示されるまでの時間と合わせて JSON で報告する。
+
+  FOTO360_STARTUP_REPORT=1          標準エラーに出す
+  FOTO360_STARTUP_REPORT=path.json  ファイルに書く
+  FOTO360_STARTUP_BUDGET=秒         目標時間（既定 1.5 秒）。超えたら警告する
+
+`--startup-report` のときは報告の後すぐに終了し、目標を超えていれば終了コード 1 を返す
+（起動が遅くなる変更を CI などで見つけるため）。
+"""
+import json
+import os
+import sys
+import time
+
+START = time.perf_counter()
+
+DEFAULT_BUDGET = 1.5
+
+# 起動時には読み込まないはずの重いモジュール（読み込まれていたら報告に出す）
+HEAVY_MODULES = ('cv2', 'numpy', 'psutil')
+
+REPORT_FLAG = '--startup-report'
+
+_timings = []   # [名前, 自分だけの秒数, 下位を含む秒数]
+_stack = []     # import 中のモジュールの [開始時刻, 下位の合計秒数]
+
+
+class _TimedLoader:
+    """ローダーを包んで exec_module の時間を計る（それ以外はそのまま元のローダーに任せる）"""
+
+    def __init__(self, loader, name):
+        self._loader = loader
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        entry = [time.perf_counter(), 0.0]
+        _stack.append(entry)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            _stack.pop()
+            total = time.perf_counter() - entry[0]
+            if _stack:
+                _stack[-1][1] += total
+            _timings.append([self._name, total - entry[1], total])
+
+
+class _ImportTimer:
+    """sys.meta_path の先頭に入れ、ほかのファインダーが見つけたモジュールのローダーを包む"""
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader, name)
+        return spec
+
+
+def _requested():
+    return REPORT_FLAG in sys.argv or bool(os.environ.get('FOTO360_STARTUP_REPORT'))
+
+
+if _requested():
+    sys.meta_path.insert(0, _ImportTimer())
+
+
+def _budget():
+    try:
+        return float(os.environ.get('FOTO360_STARTUP_BUDGET') or DEFAULT_BUDGET)
+    except ValueError:
+        return DEFAULT_BUDGET
+
+
+def build_report(name, first_window):
+    """{'name', 'first_window_seconds', 'budget_seconds', 'over_budget', 'heavy_modules', 'imports'}"""
+    budget = _budget()
+    imports = sorted(_timings, key=lambda item: item[2], reverse=True)
+    return {
+        'name': name,
+        'first_window_seconds': round(first_window, 3),
+        'budget_seconds': budget,
+        'over_budget': first_window > budget,
+        'heavy_modules': [module for module in HEAVY_MODULES if module in sys.modules],
+        # 下位を含む時間の長い順に、上位 30 件（単位はマイクロ秒、-X importtime と同じ）
+        'imports': [{'module': module, 'self_us': int(own * 1e6), 'cumulative_us': int(total * 1e6)}
+                    for module, own, total in imports[:30]],
+    }
+
+
+def on_first_window(app, name):
+    """ウィンドウが表示されたら起動時間を記録する（報告を求められたときだけ）"""
+    if not _requested():
+        return
+
+    def report():
+        result = build_report(name, time.perf_counter() - START)
+        target = os.environ.get('FOTO360_STARTUP_REPORT', '1')
+        text = json.dumps(result, ensure_ascii=False, indent=1)
+        if target not in ('1', 'true', 'yes'):
+            with open(target, 'w', encoding='utf-8') as f:
+                f.write(text)
+        else:
+            print(text, file=sys.stderr)
+        if result['over_budget']:
+            print(f"Warning: 起動に {result['first_window_seconds']} 秒かかりました（目標 {result['budget_seconds']} 秒）",
+                  file=sys.stderr)
+        if REPORT_FLAG in sys.argv:
+            app.destroy()
+            sys.exit(1 if result['over_budget'] else 0)
+
+    # 画面が描かれ、待ち状態になった時点を「最初のウィンドウ」とする
+    app.after_idle(lambda: app.after(0, report))
+
+
+def preload(modules):
+    """ウィンドウを出した後、使いそうな重いモジュールをバックグラウンドで読み込んでおく"""
+    from threading import Thread
+
+    def worker():
+        for module in modules:
+            try:
+                __import__(module)
+            except ImportError:
+                pass
+
+    Thread(target=worker, daemon=True).start()
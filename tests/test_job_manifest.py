@@ -0,0 +1,54 @@
+from job_manifest import entry_key, input_hash, is_complete_image
+
+
+def test_entry_key_adds_fov_only_when_not_default():
+    key = entry_key('abc', 2, [45, -10, 0], 1.5, 1600, 'jpg')
+    assert key == 'abc|d2:45,-10,0|i1.5|s1600|jpg'
+    assert entry_key('abc', 2, [45, -10, 0, 120], 1.5, 1600, 'jpg', fov=90) == key
+    assert entry_key('abc', 2, [45, -10, 0], 1.5, 1600, 'jpg', fov=120) == key + '|f120'
+
+
+def test_input_hash_depends_on_content(tmp_path):
+    a = tmp_path / 'a.mp4'
+    b = tmp_path / 'b.mp4'
+    a.write_bytes(b'x' * 100)
+    b.write_bytes(b'x' * 100)
+    assert input_hash(str(a)) == input_hash(str(b))
+    b.write_bytes(b'x' * 99 + b'y')
+    assert input_hash(str(a)) != input_hash(str(b))
+
+
+def test_is_complete_image_missing_or_empty(tmp_path):
+    assert not is_complete_image(str(tmp_path / 'none.jpg'))
+    empty = tmp_path / 'empty.jpg'
+    empty.write_bytes(b'')
+    assert not is_complete_image(str(empty))
+
+
+def test_is_complete_image_checks_trailer(tmp_path):
+    jpg = tmp_path / 'a.jpg'
+    jpg.write_bytes(b'\xff\xd8' + b'\0' * 1000 + b'\xff\xd9')
+    assert is_complete_image(str(jpg))
+    jpg.write_bytes(b'\xff\xd8' + b'\0' * 1000)
+    assert not is_complete_image(str(jpg))
+
+    png = tmp_path / 'a.png'
+    png.write_bytes(b'\x89PNG' + b'\0' * 100 + b'IEND\xaeB`\x82')
+    assert is_complete_image(str(png))
+    png.write_bytes(b'\x89PNG' + b'\0' * 100)
+    assert not is_complete_image(str(png))
+
+
+def test_is_complete_image_webp_length(tmp_path):
+    body = b'WEBP' + b'\0' * 20
+    webp = tmp_path / 'a.webp'
+    webp.write_bytes(b'RIFF' + len(body).to_bytes(4, 'little') + body)
+    assert is_complete_image(str(webp))
+    webp.write_bytes(b'RIFF' + len(body).to_bytes(4, 'little') + body[:-5])
+    assert not is_complete_image(str(webp))
+
+
+def test_is_complete_image_unknown_extension(tmp_path):
+    jxl = tmp_path / 'a.jxl'
+    jxl.write_bytes(b'\0')
+    assert is_complete_image(str(jxl))
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from output_layout import NAME_PATTERN, OutputLayout, safe_stem
+
+INPUT_ID = '3f2a9c1e0123abcd'
+
+
+def test_safe_stem():
+    assert safe_stem('/in/walk 01 (2).mp4') == 'walk_01_2_'
+    assert safe_stem('/in/散歩.mov') == '散歩'
+
+
+def test_name_contains_direction_number_and_time():
+    layout = OutputLayout('out', '/in/walk.mp4', INPUT_ID, 'jpg', time_of=lambda number: (number - 1) * 1.5)
+    assert layout.prefix == 'walk-3f2a9c1e'
+    assert layout.name(2, 15) == 'walk-3f2a9c1e_d02_00015_t00021000.jpg'
+    match = NAME_PATTERN.search(layout.name(2, 15))
+    assert match.groups() == ('02', '00015', '00021000', 'jpg')
+
+
+@pytest.mark.parametrize('kind, directory', [
+    ('flat', 'out'),
+    ('video', os.path.join('out', 'walk-3f2a9c1e')),
+    ('direction', os.path.join('out', 'walk-3f2a9c1e', 'd03')),
+])
+def test_directory_per_layout(kind, directory):
+    layout = OutputLayout('out', '/in/walk.mp4', INPUT_ID, 'png', layout=kind)
+    assert layout.directory(3) == directory
+    assert layout.relpath(3, 1) == os.path.relpath(os.path.join(directory, layout.name(3, 1)), 'out')
+    assert layout.temp_pattern(3) == os.path.join(directory, '_tmp_walk-3f2a9c1e_d03_%05d.png')
+
+
+def test_unknown_layout():
+    with pytest.raises(ValueError):
+        OutputLayout('out', '/in/walk.mp4', INPUT_ID, 'jpg', layout='date')
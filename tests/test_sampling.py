@@ -0,0 +1,53 @@
+from sampling import choose_strategy, estimate_count, sample_timestamps, segment_length, split_segments
+
+
+def test_sample_timestamps():
+    assert sample_timestamps(3.0, 1.0) == [0.0, 1.0, 2.0]
+    assert sample_timestamps(3.2, 1.5) == [0.0, 1.5, 3.0]
+    assert sample_timestamps(0.4, 1.5) == [0.0]
+    assert sample_timestamps(0, 1.5) == []
+    # 浮動小数の誤差で余分な1枚が出ない
+    assert len(sample_timestamps(0.3 * 10, 0.3)) == 10
+
+
+def test_estimate_count_matches_timestamps():
+    assert estimate_count(10.0, 1.5) == len(sample_timestamps(10.0, 1.5))
+    assert estimate_count(9.0, 'auto') == 6
+
+
+def test_split_segments_covers_every_number_once():
+    segments = split_segments(100, 1.0, 30)
+    numbers = [n for first, last in segments for n in range(first, last + 1)]
+    assert numbers == list(range(1, 101))
+    assert segments[0] == (1, 30)
+
+
+def test_split_segments_short_video_is_not_split():
+    assert split_segments(20, 1.0, 30) == []
+
+
+def test_split_segments_merges_short_tail():
+    # 最後の 5 枚だけの区間は作らず、ひとつ前にまとめる
+    assert split_segments(65, 1.0, 30) == [(1, 30), (31, 65)]
+
+
+def test_split_segments_snaps_to_keyframes():
+    # キーフレームが 4 秒ごとなら、境目は 4 の倍数の時刻（番号は時刻 / 間隔 + 1）に寄る
+    segments = split_segments(200, 1.0, 30, keyframe_interval=4.0)
+    for first, _ in segments[1:]:
+        assert (first - 1) % 4 == 0
+
+
+def test_segment_length_auto():
+    assert segment_length(7200, 8) == 900
+    assert segment_length(100, 8) == 60.0
+    assert segment_length(7200, 8, 600) == 600.0
+
+
+def test_choose_strategy():
+    assert choose_strategy(2.0, None) == 'select'
+    assert choose_strategy(2.0, 0.5, 0.5) == 'keyframe'
+    # GOP が不規則（キーフレームのない区間がありうる）なら keyframe は使わない
+    assert choose_strategy(2.0, 0.5, 3.0) == 'seek'
+    assert choose_strategy(2.0, 0.5) == 'seek'
+    assert choose_strategy(2.0, 4.0, 4.0) == 'select'
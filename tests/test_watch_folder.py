@@ -0,0 +1,59 @@
+import os
+
+import foto360_core
+from watch_folder import WatchDaemon
+
+
+def _daemon(tmp_path):
+    folder = tmp_path / 'in'
+    folder.mkdir()
+    daemon = WatchDaemon([str(folder)], str(tmp_path / 'out'), settle=0, use_inotify=False)
+    return daemon, folder
+
+
+def _convert(daemon, path):
+    daemon.active[path] = {'input': path, 'started': 0, 'progress': 0}
+    daemon.convert(path)
+
+
+def test_failed_video_is_not_retried_until_replaced(tmp_path, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError('decode error')
+
+    monkeypatch.setattr(foto360_core, 'process_video', broken)
+    daemon, folder = _daemon(tmp_path)
+    video = folder / 'bad.mp4'
+    video.write_bytes(b'broken')
+    path = str(video)
+
+    _convert(daemon, path)
+    assert daemon.failed == 1
+    [record] = daemon.converted.values()
+    assert record['ok'] is False
+    assert record['error'] == 'decode error'
+    assert not daemon.active
+
+    # 同じ動画は候補に戻らない
+    daemon.scan()
+    assert not daemon.candidates
+
+    # 置き直された（サイズが変わった）動画はやり直す
+    video.write_bytes(b'fixed video')
+    daemon.scan()
+    assert list(daemon.candidates) == [path]
+
+
+def test_converted_video_is_skipped_after_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(foto360_core, 'process_video', lambda *args, **kwargs: [{'ok': True}])
+    daemon, folder = _daemon(tmp_path)
+    video = folder / 'a.mp4'
+    video.write_bytes(b'video')
+    os.makedirs(daemon.output_path)
+
+    _convert(daemon, str(video))
+    assert daemon.failed == 0
+    daemon.write_status()
+
+    restarted = WatchDaemon([str(folder)], daemon.output_path, settle=0, use_inotify=False)
+    restarted.scan()
+    assert not restarted.candidates
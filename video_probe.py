@@ -0,0 +1,217 @@
+"""動画メタデータ（fps・フレーム数・解像度・コーデック・GOP・撮影日時）の取得とキャッシュ
+
+ffprobe でコンテナ／ストリームのヘッダとパケットのフラグだけを読み、デコーダは起動しない。
+結果は (パス, 更新時刻, サイズ) をキーにメモリとディスクへキャッシュし、
+フレーム数の見積もり・CPU/GPU の判定・スケジューラで使い回す。
+"""
+import json
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+# 取得項目や計算方法を変えたら上げる（古いキャッシュを無効化するため）
+PROBE_CACHE_VERSION = 3
+
+_cache = {}
+_cache_loaded = False
+_cache_dirty = False
+_cache_lock = Lock()
+
+
+def default_cache_path():
+    base = os.environ.get('FOTO360_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', '360foto')
+    return os.path.join(base, 'probe.json')
+
+
+def _cache_key(path):
+    st = os.stat(path)
+    return f'{PROBE_CACHE_VERSION}|{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}'
+
+
+def _load_disk_cache():
+    global _cache_loaded
+    if _cache_loaded:
+        return
+    _cache_loaded = True
+    try:
+        with open(default_cache_path(), encoding='utf-8') as f:
+            _cache.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+
+def _save_disk_cache():
+    global _cache_dirty
+    if not _cache_dirty:
+        return
+    _cache_dirty = False
+    path = default_cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + f'.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(_cache, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: 動画情報をキャッシュできませんでした: {e}")
+
+
+def _parse_rate(rate):
+    try:
+        num, _, den = rate.partition('/')
+        value = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+    return value
+
+
+def probe_keyframe_interval(input_path, scan_seconds=30):
+    """先頭 scan_seconds 秒のキーフレーム間隔（秒）の (中央値, 最大値) を返す。調べられなければ (None, None)
+
+    最大値はシーンチェンジなどで GOP が不規則な動画を見分けるのに使う（sampling.choose_strategy）。
+    """
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None, None
+
+    # パケットのフラグだけを読むのでデコードは発生しない
+    command = [
+        ffprobe, '-v', 'error', '-select_streams', 'v:0',
+        '-read_intervals', f'%+{scan_seconds}',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0',
+        input_path,
+    ]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, timeout=60).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None, None
+
+    keyframe_times = []
+    for line in output.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) >= 2 and 'K' in fields[1]:
+            try:
+                keyframe_times.append(float(fields[0]))
+            except ValueError:
+                pass
+
+    keyframe_times.sort()
+    gaps = sorted(b - a for a, b in zip(keyframe_times, keyframe_times[1:]) if b > a)
+    if not gaps:
+        return None, None
+    return gaps[len(gaps) // 2], gaps[-1]
+
+
+def _probe_with_ffprobe(path):
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe is None:
+        return None
+
+    command = [
+        ffprobe, '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,duration:format=duration:format_tags=creation_time',
+        '-of', 'json', path,
+    ]
+    try:
+        data = json.loads(subprocess.run(command, capture_output=True, text=True, timeout=60).stdout or '{}')
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+    streams = data.get('streams') or []
+    if not streams:
+        return None
+    stream = streams[0]
+
+    fps = _parse_rate(stream.get('avg_frame_rate', '')) or _parse_rate(stream.get('r_frame_rate', ''))
+    try:
+        duration = float(stream.get('duration') or data.get('format', {}).get('duration') or 0)
+    except ValueError:
+        duration = 0.0
+    try:
+        frame_count = int(stream.get('nb_frames') or 0)
+    except ValueError:
+        frame_count = 0
+    # MKV などヘッダにフレーム数がない場合は長さから求める
+    if frame_count <= 0 and fps > 0:
+        frame_count = int(round(duration * fps))
+    if duration <= 0 and fps > 0:
+        duration = frame_count / fps
+
+    keyframe_interval, keyframe_max_interval = probe_keyframe_interval(path)
+    return {
+        'width': int(stream.get('width') or 0),
+        'height': int(stream.get('height') or 0),
+        'fps': fps,
+        'frame_count': frame_count,
+        'duration': duration,
+        'codec': stream.get('codec_name', ''),
+        'keyframe_interval': keyframe_interval,
+        'keyframe_max_interval': keyframe_max_interval,
+        'creation_time': (data.get('format', {}).get('tags') or {}).get('creation_time'),
+    }
+
+
+def _probe_with_opencv(path):
+    """ffprobe がない環境向け（デコーダを初期化するので遅い）"""
+    import cv2
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        return {
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': fps,
+            'frame_count': frame_count,
+            'duration': frame_count / fps if fps > 0 else 0.0,
+            'codec': ''.join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00 '),
+            'keyframe_interval': None,
+            'keyframe_max_interval': None,
+            'creation_time': None,
+        }
+    finally:
+        cap.release()
+
+
+def probe_video(path, save=True):
+    """動画1本のメタデータ dict を返す。開けない場合は None
+
+    save=False のときはディスクへの書き出しを呼び出し側（probe_videos）にまかせる。
+    """
+    try:
+        key = _cache_key(path)
+    except OSError:
+        return None
+
+    with _cache_lock:
+        _load_disk_cache()
+        if key in _cache:
+            return dict(_cache[key])
+
+    info = _probe_with_ffprobe(path) or _probe_with_opencv(path)
+    if info is None:
+        return None
+
+    global _cache_dirty
+    with _cache_lock:
+        _cache[key] = info
+        _cache_dirty = True
+        if save:
+            _save_disk_cache()
+    return dict(info)
+
+
+def probe_videos(paths, max_workers=8):
+    """複数の動画を並列に調べ、パス -> メタデータ（または None）の dict を返す"""
+    paths = list(dict.fromkeys(p for p in paths if p))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = dict(zip(paths, pool.map(lambda p: probe_video(p, save=False), paths)))
+    with _cache_lock:
+        _save_disk_cache()
+    return results
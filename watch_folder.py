@@ -0,0 +1,379 @@
+"""入力フォルダを見張り、置かれた動画を自動で変換する常駐モード
+
+Linux では inotify（ctypes で呼ぶので追加のパッケージは不要）で変化を受け取り、使えない環境
+（Windows・macOS など）では poll_interval 秒ごとにフォルダを調べる。どちらの場合も、サイズと更新時刻が
+settle 秒変わらなくなったファイル（コピーが終わったもの）だけをキューに入れ、max_parallel 本ずつ
+process_video で変換する。ネットワーク共有では inotify に届かない変化もあるので、inotify を使うときも
+RESCAN_SECONDS ごとにフォルダを調べ直す。
+
+動画ごとに保存先の下の {動画名}-{入力ID} フォルダへ書き出す（マニフェスト・一覧・レポートも動画ごと）。
+変換した動画は (パス, サイズ, 更新時刻) ごとに状態ファイルへ記録し、再起動しても変換し直さない。
+記録は MAX_CONVERTED 件までで、超えたら消えた・置き換わった動画の分から、それでも多ければ古い順に捨てる。
+
+状態（待ち・変換中・済み・失敗と最近の結果）は保存先の 360foto_watch_status.json に書き、
+status_port を渡すと http://127.0.0.1:<port>/status でも返す。/health は見張りのループが
+止まっていなければ 200、止まっていれば 503 を返す（死活監視用）。
+"""
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+
+from job_manifest import input_hash
+from output_layout import safe_stem
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+
+STATUS_NAME = '360foto_watch_status.json'
+STATUS_VERSION = 1
+
+DEFAULT_SETTLE = 3.0         # この秒数サイズと更新時刻が変わらなければ書き込みが終わったとみなす
+DEFAULT_POLL_INTERVAL = 2.0  # inotify を使えないときにフォルダを調べる間隔
+RESCAN_SECONDS = 60.0        # inotify を使うときも、この間隔でフォルダを調べ直す
+HEARTBEAT_SECONDS = 10.0     # 変化がなくても状態ファイルを書き直す間隔
+RECENT = 50                  # 状態に残す最近の結果の数
+MAX_CONVERTED = 10000        # 状態ファイルに残す変換済みの動画の数
+
+# inotify のイベント（<sys/inotify.h>）
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_EVENT = struct.Struct('iIII')
+
+
+class _Inotify:
+    """inotify でフォルダ直下のファイルの作成・書き込み・移動を受け取る（Linux のみ）"""
+
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify を使えません")
+        self.folders = {}
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        for folder in folders:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"フォルダを見張れません: {folder}")
+            self.folders[wd] = folder
+
+    def wait(self, timeout):
+        """timeout 秒まで待ち、変化のあったファイルのパスのリストを返す"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + _IN_EVENT.size <= len(data):
+            wd, _, _, length = _IN_EVENT.unpack_from(data, offset)
+            offset += _IN_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name and wd in self.folders:
+                paths.append(os.path.join(self.folders[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+def is_video(path):
+    name = os.path.basename(path)
+    return not name.startswith(('.', '~')) and name.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def _stamp(path, st):
+    return f'{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}'
+
+
+class WatchDaemon:
+    """folders に置かれた動画を output_path の下へ変換し続ける
+
+    options は process_video に渡すキーワード引数（preset・interval・size など）。
+    report(種類, 値) には 'watch'（開始）, 'queued', 'started', 'finished' が渡される。
+    """
+
+    def __init__(self, folders, output_path, options=None, max_parallel=1, settle=DEFAULT_SETTLE,
+                 poll_interval=DEFAULT_POLL_INTERVAL, status_port=None, use_inotify=True, report=None):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.output_path = output_path
+        self.options = dict(options or {})
+        self.max_parallel = max(1, max_parallel)
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.status_port = status_port
+        self.use_inotify = use_inotify
+        self.report = report or (lambda kind, value: None)
+        self.lock = Lock()
+        self.stop_event = Event()
+        self.candidates = {}  # パス -> [サイズと更新時刻, 最後に変わった時刻]
+        self.queue = []       # 書き込みが終わり、変換を待っているパス
+        self.active = {}      # 変換中のパス -> {'input', 'output', 'started', 'progress'}
+        self.converted = {}   # _stamp -> 結果（変換済みの動画）
+        self.recent = []
+        self.failed = 0
+        self.mode = None
+        self.state = 'stopping'
+        self.pool = None
+        self.started = time.time()
+        self.heartbeat = time.monotonic()
+        self._status_dirty = True
+        self._load_status()
+
+    def status_path(self):
+        return os.path.join(self.output_path, STATUS_NAME)
+
+    def _load_status(self):
+        try:
+            with open(self.status_path(), encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == STATUS_VERSION:
+                self.converted = data.get('converted', {})
+                self.recent = data.get('recent', [])
+        except (OSError, ValueError):
+            pass
+        self._prune_converted()
+
+    def _prune_converted(self):
+        """変換済みの記録を MAX_CONVERTED 件に収める（呼び出し側でロックを取るか、ほかのスレッドがいないこと）"""
+        if len(self.converted) <= MAX_CONVERTED:
+            return
+        for stamp in list(self.converted):
+            path = stamp.rsplit('|', 2)[0]
+            try:
+                current = _stamp(path, os.stat(path))
+            except OSError:
+                current = None
+            if current != stamp:
+                # 入力フォルダから消えた（または置き換わった）動画は、もう飛ばす必要がない
+                del self.converted[stamp]
+        if len(self.converted) > MAX_CONVERTED:
+            oldest = sorted(self.converted, key=lambda stamp: self.converted[stamp].get('finished') or 0)
+            for stamp in oldest[:len(self.converted) - MAX_CONVERTED]:
+                del self.converted[stamp]
+
+    def status(self):
+        """状態の dict（/status の内容。状態ファイルには、これに変換済みの動画の記録 'converted' を加える）"""
+        with self.lock:
+            return {
+                'version': STATUS_VERSION,
+                'state': self.state if self.stop_event.is_set() else 'running',
+                'mode': self.mode,
+                'folders': self.folders,
+                'pid': os.getpid(),
+                'started': self.started,
+                'updated': time.time(),
+                'waiting': sorted(self.candidates),
+                'queued': list(self.queue),
+                'active': [dict(item) for item in self.active.values()],
+                'failed': self.failed,
+                'recent': list(self.recent),
+                'converted_count': len(self.converted),
+            }
+
+    def healthy(self):
+        # ループが固まっていないか（ファイルの確認は最長でも poll_interval ごとに行う）
+        limit = max(HEARTBEAT_SECONDS, self.poll_interval * 5)
+        return not self.stop_event.is_set() and time.monotonic() - self.heartbeat < limit
+
+    def write_status(self):
+        path = self.status_path()
+        tmp_path = path + f'.{os.getpid()}.tmp'
+        try:
+            status = self.status()
+            with self.lock:
+                status['converted'] = dict(self.converted)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(status, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: 状態ファイルを保存できませんでした: {e}")
+
+    def touch(self, path):
+        """変化のあったファイルを書き込み中の候補にする（サイズか更新時刻が変わったら待ち直す）"""
+        if not is_video(path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self.lock:
+                self.candidates.pop(path, None)
+            return
+        stamp = _stamp(path, st)
+        with self.lock:
+            if stamp in self.converted or path in self.active or path in self.queue:
+                return
+            entry = self.candidates.get(path)
+            if entry is None or entry[0] != stamp:
+                if entry is None:
+                    self._status_dirty = True
+                self.candidates[path] = [stamp, time.monotonic()]
+
+    def scan(self):
+        for folder in self.folders:
+            try:
+                with os.scandir(folder) as items:
+                    for item in items:
+                        if item.is_file():
+                            self.touch(item.path)
+            except OSError as e:
+                print(f"Warning: フォルダを読めません: {folder}: {e}")
+
+    def collect_settled(self):
+        """settle 秒変わらなかった候補をキューに移す"""
+        for path in list(self.candidates):
+            self.touch(path)
+        now = time.monotonic()
+        with self.lock:
+            settled = [path for path, (stamp, changed) in self.candidates.items() if now - changed >= self.settle]
+            for path in settled:
+                del self.candidates[path]
+                self.queue.append(path)
+                self._status_dirty = True
+        for path in settled:
+            self.report('queued', {'input': path})
+
+    def convert(self, path):
+        from foto360_core import process_video
+
+        record = {'input': path, 'started': time.time()}
+        # 変換に失敗しても記録できるよう、先にサイズと更新時刻を控える（消えていれば記録しない）
+        try:
+            stamp = _stamp(path, os.stat(path))
+        except OSError:
+            stamp = None
+        try:
+            output = os.path.join(self.output_path, f'{safe_stem(path)}-{input_hash(path)[:8]}')
+            record['output'] = output
+            with self.lock:
+                self.active[path].update(output=output)
+
+            def report(kind, value):
+                if kind in ('progress', 'frames'):
+                    with self.lock:
+                        self.active[path][kind] = round(value, 1) if kind == 'progress' else value
+
+            self.report('started', {'input': path, 'output': output})
+            results = process_video([path], output, report=report, should_stop=self.stop_event.is_set,
+                                    **self.options)
+            failed = sum(1 for result in results if not result['ok'])
+            record.update(ok=failed == 0, jobs=len(results), failed_jobs=failed)
+        except Exception as e:
+            record.update(ok=False, error=str(e))
+        record['seconds'] = round(time.time() - record['started'], 3)
+        cancelled = self.stop_event.is_set()
+        with self.lock:
+            del self.active[path]
+            if not cancelled:
+                self.recent = (self.recent + [record])[-RECENT:]
+                if not record['ok']:
+                    self.failed += 1
+                if stamp is not None:
+                    # 失敗した動画も記録し、置き直されるか更新される（サイズか更新時刻が変わる）までやり直さない
+                    self.converted[stamp] = {'input': path, 'output': record.get('output'), 'finished': time.time(),
+                                             'ok': record['ok']}
+                    if not record['ok']:
+                        self.converted[stamp]['error'] = record.get('error', 'failed')
+                self._prune_converted()
+            self._status_dirty = True
+        if not cancelled:
+            self.report('finished', record)
+            # 見張りのループを待たずに、次の動画を始める
+            self.dispatch()
+
+    def dispatch(self):
+        with self.lock:
+            while self.queue and len(self.active) < self.max_parallel and not self.stop_event.is_set():
+                path = self.queue.pop(0)
+                self.active[path] = {'input': path, 'started': time.time(), 'progress': 0}
+                self._status_dirty = True
+                self.pool.submit(self.convert, path)
+
+    def _serve_status(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/health':
+                    ok = daemon.healthy()
+                    body, code, kind = (b'ok\n' if ok else b'stalled\n'), 200 if ok else 503, 'text/plain'
+                elif self.path in ('/', '/status'):
+                    body = json.dumps(daemon.status(), ensure_ascii=False).encode('utf-8')
+                    code, kind = 200, 'application/json; charset=utf-8'
+                else:
+                    body, code, kind = b'not found\n', 404, 'text/plain'
+                self.send_response(code)
+                self.send_header('Content-Type', kind)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        # 外からは見えないよう、このマシンからの接続だけを受ける
+        server = ThreadingHTTPServer(('127.0.0.1', self.status_port), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def stop(self):
+        """見張りをやめ、変換中の動画も中断する（中断した動画は次回の起動で続きから変換する）"""
+        self.stop_event.set()
+
+    def run(self):
+        """stop() が呼ばれるまで見張る"""
+        os.makedirs(self.output_path, exist_ok=True)
+        watcher = None
+        if self.use_inotify and hasattr(os, 'O_CLOEXEC') and os.name == 'posix':
+            try:
+                watcher = _Inotify(self.folders)
+            except (OSError, AttributeError) as e:
+                print(f"Warning: inotify を使えないため、{self.poll_interval} 秒ごとにフォルダを調べます: {e}")
+        self.mode = 'inotify' if watcher is not None else 'poll'
+        server = self._serve_status() if self.status_port else None
+        self.report('watch', {'folders': self.folders, 'output': self.output_path, 'mode': self.mode,
+                              'status': self.status_path(), 'port': server.server_address[1] if server else None})
+
+        self.pool = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix='watch')
+        last_scan = last_status = 0.0
+        try:
+            while not self.stop_event.is_set():
+                now = time.monotonic()
+                self.heartbeat = now
+                if watcher is None or now - last_scan >= RESCAN_SECONDS:
+                    self.scan()
+                    last_scan = now
+                self.collect_settled()
+                self.dispatch()
+                if self._status_dirty or now - last_status >= HEARTBEAT_SECONDS:
+                    self._status_dirty = False
+                    self.write_status()
+                    last_status = now
+                # 書き込み中の候補があれば、settle を待たずに確かめ直す
+                timeout = min(self.poll_interval, self.settle / 2) if self.candidates else self.poll_interval
+                if watcher is not None:
+                    for path in watcher.wait(timeout):
+                        self.touch(path)
+                else:
+                    self.stop_event.wait(timeout)
+        finally:
+            self.stop_event.set()
+            self.pool.shutdown(wait=True)
+            if watcher is not None:
+                watcher.close()
+            if server is not None:
+                server.shutdown()
+            self.state = 'stopped'
+            self.write_status()
@@ -0,0 +1,103 @@
+"""RealityScan（RealityCapture）用 XMP サイドカーの一括書き出し
+
+回転行列は方向ごとに1回だけ計算してテンプレートに埋め込み、フレームごとには
+任意の時刻・位置だけを差し込んで書き出す。10万枚規模でも Python 側の処理が
+律速にならないよう、ファイル書き込みはまとめてスレッドプールで行う。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+XMP_TEMPLATE = """<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:xcr="http://www.capturingreality.com/ns/xcr/1.1#"{namespaces}>
+   <xcr:Position>{position}</xcr:Position>
+   <xcr:Rotation>{rotation}</xcr:Rotation>{extra}
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>"""
+
+XMP_NAMESPACE = '\n    xmlns:xmp="http://ns.adobe.com/xap/1.0/"'
+
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+
+
+def rotation_string(yaw, pitch, roll):
+    from equirect import get_rotation_matrix
+
+    R = get_rotation_matrix(yaw, pitch, roll)
+    return " ".join([f"{x:.9f}" for x in R.flatten()])
+
+
+def parse_creation_time(value):
+    """ffprobe の creation_time（ISO 8601）を datetime にする。解釈できなければ None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+def sidecar_path(image_path):
+    return os.path.splitext(image_path)[0] + ".xmp"
+
+
+def _write_chunk(items):
+    for path, data in items:
+        fd = os.open(path, _WRITE_FLAGS, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+    return len(items)
+
+
+def write_xmp_sidecars(image_paths, yaw, pitch, roll, timestamps=None, start_time=None,
+                       position_at=None, max_workers=8, chunk_size=1000):
+    """image_paths の各画像に同じ向きの XMP を書き出し、書き出した数を返す
+
+    timestamps（動画内の秒）と start_time（撮影開始の datetime）があれば xmp:CreateDate を、
+    position_at(秒) -> (x, y, z) があれば xcr:Position をフレームごとに設定する。
+    """
+    rotation = rotation_string(yaw, pitch, roll)
+    with_time = timestamps is not None and start_time is not None
+    if timestamps is None:
+        timestamps = [None] * len(image_paths)
+
+    # 方向ごとに変わらない部分は先に埋めておく
+    template = XMP_TEMPLATE.replace('{rotation}', rotation).replace(
+        '{namespaces}', XMP_NAMESPACE if with_time else '')
+    fixed = template.replace('{position}', '0 0 0').replace('{extra}', '').encode('utf-8')
+
+    items = []
+    for path, t in zip(image_paths, timestamps):
+        if not with_time and position_at is None:
+            data = fixed
+        else:
+            position = '0 0 0'
+            if position_at is not None and t is not None:
+                position = ' '.join(f'{v:.6f}' for v in position_at(t))
+            extra = ''
+            if with_time and t is not None:
+                stamp = (start_time + timedelta(seconds=t)).astimezone(timezone.utc)
+                extra = f"\n   <xmp:CreateDate>{stamp.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]}Z</xmp:CreateDate>"
+            data = template.replace('{position}', position).replace('{extra}', extra).encode('utf-8')
+        items.append((sidecar_path(path), data))
+
+    if not items:
+        return 0
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    if len(chunks) == 1:
+        return _write_chunk(chunks[0])
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return sum(pool.map(_write_chunk, chunks))
+
+
+def write_xmp(output_path, yaw, pitch, roll):
+    """画像1枚分の XMP を書き出す"""
+    try:
+        write_xmp_sidecars([output_path], yaw, pitch, roll)
+    except Exception as e:
+        print(f"Error writing XMP: {e}")